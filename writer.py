@@ -1,84 +1,179 @@
 import sys
+import os
+import time
+import importlib.util
 import subprocess
-import pkg_resources
+
+# Startup timing starts before any of the heavy imports
+STARTUP_START = time.perf_counter()
 
 ## Dependency installation START
 required = 'pyqt5'
+requiredModule = 'PyQt5'
+
+# Marker caching a successful dependency check for this interpreter
+DEPENDENCY_MARKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.writerDeps')
+
+def dependenciesCached():
+    # Marker holds the interpreter and the package folder that was found for it
+    try:
+        with open(DEPENDENCY_MARKER, "rt") as marker:
+            executable, packageDir = marker.read().splitlines()[:2]
+    except (OSError, ValueError):
+        return False
+    return executable == sys.executable and os.path.isdir(packageDir)
+
+def ensureDependencies():
+    # Fast path: nothing to probe if this interpreter was already checked
+    if dependenciesCached():
+        return
+    
+    # Import probe: only locates the package, nothing gets imported yet
+    spec = importlib.util.find_spec(requiredModule)
+    if spec is None:
+        if '--no-install' in sys.argv:
+            sys.exit("Writer needs " + required + ", install it with: " + 
+                     sys.executable + " -m pip install " + required)
+        # implement pip as a subprocess (only when the module is missing):
+        subprocess.check_call([sys.executable, '-m', 'pip', 'install', required])
+        importlib.invalidate_caches()
+        spec = importlib.util.find_spec(requiredModule)
+    
+    # Cache the result so the next launch skips the probe
+    if spec is not None and spec.submodule_search_locations:
+        try:
+            with open(DEPENDENCY_MARKER, "wt") as marker:
+                marker.write(sys.executable + "\n" + list(spec.submodule_search_locations)[0] + "\n")
+        except OSError:
+            pass
 
-# implement pip as a subprocess:
-subprocess.check_call([sys.executable, '-m', 'pip', 'install', required])
+ensureDependencies()
+DEPENDENCIES_DONE = time.perf_counter()
+## Dependency installation END
 
-from enum import Enum
 from PyQt5 import (QtGui, QtCore)
-from PyQt5.QtCore import (Qt)
+from PyQt5.QtCore import (Qt, QObject, QEvent, QTimer)
 from PyQt5.QtWidgets import (QMainWindow, QApplication, QTextEdit, QAction,
                              QFileDialog, QDialog, QFontComboBox, QComboBox,
                              QColorDialog, QGridLayout,
                              QHBoxLayout, QLabel, QWidget,  # Layout
-                             QUndoStack, QUndoCommand,     # Undo
-                             QCompleter, QLineEdit, QPushButton,     # character menu
+                             QUndoStack,     # Undo
+                             QLineEdit, QPushButton,     # character menu
                              QCheckBox,  # header menu
+                             QProgressBar,  # status bar
+                             QListView,     # side panels
+                             QMessageBox,   # crash recovery
                              
                              )
-from PyQt5.QtPrintSupport import QPrintDialog, QPrinter, QPrintPreviewDialog
+from PyQt5.QtPrintSupport import QPrintDialog, QPrinter
 from PyQt5.QtGui import (QTextListFormat, QFont, QTextCursor,
                          QTextCharFormat, QTextBlockFormat, 
-                         QKeySequence,  # Shortcuts
-                         QFontMetrics   # UI Scaling
+                         QKeySequence   # Shortcuts
                          )  
                          
 import writterSettings
+from writerFormats import (BASE_DPI, FormatState, formatRegistry, blockState)
+from writerFile import (readScriptText, readNativeHeader, loadScript, serializeNative, LazyLoader)
+from writerSave import (BackgroundSaver, SaveTask)
+from writerIndex import (BlockTracker, CharacterIndex, SearchIndex, SceneIndex, StatisticsIndex)
+from writerCompleter import CharacterCompleter
+from writerPanels import (CharacterListModel, SceneListModel)
+from writerUndo import UndoRecorder
+from writerFind import FindDialog
+from writerPages import (PageIndex, printPages, pageContent)
+from writerPreview import PreviewDialog
+from writerFountain import (FOUNTAIN_EXTENSIONS, TEXT_EXTENSIONS, readFountain)
+from writerExport import EXPORTERS
+from writerReport import (REPORTERS, scriptBreakdown)
+from writerProfile import (LatencyRecorder, LatencyOverlay)
+from writerRevisions import (BackgroundSnapshots, RevisionsDialog, SnapshotTask, loadRevision)
+from writerDiff import CompareDialog
+from writerJournal import (ScriptJournal, journalPath, lockJournal, readJournal, canReplay, replayJournal)
 
-# UI Scaling helpers
-BASE_DPI = 96
+IMPORTS_DONE = time.perf_counter()
+
+# UI Scaling helpers (see writerFormats.BASE_DPI)
 DPI_MULT = 1
 
 class Main(QMainWindow):
     def __init__(self, parent = None):
         QMainWindow.__init__(self,parent)
         
+        # Bounded by steps here and by memory in initUndo
         self.undoStack = QUndoStack()
+        self.undoStack.setUndoLimit(writterSettings.undoLimit)
         
         self.setMinimumWidth(round(1000*DPI_MULT))
         self.filename = ""
+        self.loader = None
         self.prevFormatState = FormatState.Action
         self.currFormatState = FormatState.Action
         
-        self.setFontFormats()
-        self.setBlockFormats()
+        self.setFormats()
         self.initUI()
+        self.initSaving()
         
         # Set starting format
         self.setStartingFormat()
+        self.initUndo()
  
     def initUI(self):
         # Initialising main widgets
         self.scriptEdit = CompletionTextEdit()
+        # Initialise the document indexes
+        self.initIndexes()
         # Initialise character menu
         self.initCharMenu()
         # Initialise header menu
         self.initHeaderMenu()
+        # Initialise scene navigator
+        self.initSceneMenu()
         
         # scriptEdit formatting
-        self.scriptEdit.setStyleSheet("""
-            QTextEdit {
-                font: 12pt "Courier";
-            }
-        """)
+        self.scriptEdit.setStyleSheet(self.registry.styleSheet)
         self.scriptEdit.setMaximumWidth(self.monoCharSize * 66)
         self.scriptEdit.setMinimumWidth(self.monoCharSize * 66)
         self.detectionEnabled = True
-        self.scriptEdit.cursorPositionChanged.connect(self.detectFormat)         
+        self.scriptEdit.cursorPositionChanged.connect(self.detectFormat)
+        self.scriptEdit.cursorPositionChanged.connect(self.showCurrentScene)         
+        self.scriptEdit.cursorPositionChanged.connect(self.showCurrentPage)
         # Setting/Adding toolbars
         self.initToolbar()
         self.initFormatbar()
         self.initMenubar()
         self.statusbar = self.statusBar()
+        self.loadProgress = QProgressBar()
+        self.loadProgress.setMaximumWidth(round(150*DPI_MULT))
+        self.loadProgress.hide()
+        self.statusbar.addPermanentWidget(self.loadProgress)
+        self.pageLabel = QLabel()
+        self.statusbar.addPermanentWidget(self.pageLabel)
+        # Page breaks are worked out again after a pause in the typing
+        self.pageTimer = QTimer(self)
+        self.pageTimer.setSingleShot(True)
+        self.pageTimer.setInterval(500)
+        self.pageTimer.timeout.connect(self.showCurrentPage)
+        self.pageIndex.changed.connect(self.pageTimer.start)
+        self.showCurrentPage()
+        # Statistics show at most once per statisticsInterval while typing
+        # (the timer isn't restarted by every change), counting them is
+        # left to statisticsIndex
+        self.statisticsLabel = QLabel()
+        self.statusbar.insertPermanentWidget(0, self.statisticsLabel)
+        self.statisticsTimer = QTimer(self)
+        self.statisticsTimer.setSingleShot(True)
+        self.statisticsTimer.setInterval(writterSettings.statisticsInterval)
+        self.statisticsTimer.timeout.connect(self.showStatistics)
+        self.statisticsIndex.changed.connect(self.statisticsChanged)
+        self.pageTimer.timeout.connect(self.showStatistics)
+        self.statisticsAction.setChecked(writterSettings.showStatistics)
+        self.showStatistics()
         
         # Layout
         layoutWidget = QWidget()        
         mainLayout = QHBoxLayout()
         mainLayout.addLayout(self.headerMenuGrid)
+        mainLayout.addLayout(self.sceneMenuGrid)
         mainLayout.addWidget(self.scriptEdit)
         mainLayout.addLayout(self.charMenuGrid)
         layoutWidget.setLayout(mainLayout)
@@ -99,19 +194,29 @@ class Main(QMainWindow):
 
     def initToolbar(self):
         # New
-        self.newAction = QAction(QtGui.QIcon("icons/new.png"),"New",self)
+        self.newAction = QAction(self.registry.icon("new"),"New",self)
         self.newAction.setStatusTip("Create a new script.")
         self.newAction.setShortcut("Ctrl+N")
         self.newAction.triggered.connect(self.new)
 
         # Open
-        self.openAction = QAction(QtGui.QIcon("icons/open.png"),"Open file",self)
+        self.openAction = QAction(self.registry.icon("open"),"Open file",self)
         self.openAction.setStatusTip("Open existing script")
         self.openAction.setShortcut("Ctrl+O")
         self.openAction.triggered.connect(self.open)
 
+        # Import
+        self.importAction = QAction(self.registry.icon("open2"),"Import Fountain or text",self)
+        self.importAction.setStatusTip("Open a Fountain or plain text screenplay as a new script")
+        self.importAction.triggered.connect(self.importScript)
+
+        # Export
+        self.exportAction = QAction("Export Fountain or Final Draft",self)
+        self.exportAction.setStatusTip("Write the script as a .fountain or .fdx file")
+        self.exportAction.triggered.connect(self.exportScript)
+
         # Save
-        self.saveAction = QAction(QtGui.QIcon("icons/save.png"),"Save",self)
+        self.saveAction = QAction(self.registry.icon("save"),"Save",self)
         self.saveAction.setStatusTip("Save script")
         self.saveAction.setShortcut("Ctrl+S")
         self.saveAction.triggered.connect(self.save)
@@ -121,56 +226,83 @@ class Main(QMainWindow):
         self.saveAsAction.setStatusTip("Save script as...")
         self.saveAsAction.triggered.connect(self.saveAs)
         
+        # Revisions
+        self.revisionsAction = QAction(self.registry.icon("time"),"Revisions",self)
+        self.revisionsAction.setStatusTip("Take snapshots of the script, open or restore earlier drafts")
+        self.revisionsAction.triggered.connect(self.revisions)
+        
+        # Compare
+        self.compareAction = QAction("Compare drafts",self)
+        self.compareAction.setStatusTip("Mark what changed between two drafts of the script")
+        self.compareAction.triggered.connect(self.compare)
+        
+        # Breakdown report
+        self.reportAction = QAction("Breakdown report",self)
+        self.reportAction.setStatusTip("Export who speaks in which scene and the scene lengths as CSV or JSON")
+        self.reportAction.triggered.connect(self.breakdownReport)
+        
+        # Statistics
+        self.statisticsAction = QAction(self.registry.icon("count"),"Statistics",self)
+        self.statisticsAction.setStatusTip("Show words, pages, scenes and screen time in the status bar")
+        self.statisticsAction.setCheckable(True)
+        self.statisticsAction.toggled.connect(self.showStatistics)
+        
         # Print
-        self.printAction = QAction(QtGui.QIcon("icons/print.png"),"Print script",self)
+        self.printAction = QAction(self.registry.icon("print"),"Print script",self)
         self.printAction.setStatusTip("Print script")
         self.printAction.setShortcut("Ctrl+P")
         self.printAction.triggered.connect(self.print)
         
         # Print Preview
-        self.previewAction = QAction(QtGui.QIcon("icons/preview.png"),"Print preview",self)
+        self.previewAction = QAction(self.registry.icon("preview"),"Print preview",self)
         self.previewAction.setStatusTip("Preview page before printing")
         self.previewAction.setShortcut("Ctrl+Shift+P")
         self.previewAction.triggered.connect(self.preview)
         
         # Cut
-        self.cutAction = QAction(QtGui.QIcon("icons/cut.png"),"Cut to clipboard",self)
+        self.cutAction = QAction(self.registry.icon("cut"),"Cut to clipboard",self)
         self.cutAction.setStatusTip("Delete and copy text to clipboard")
         self.cutAction.setShortcut("Ctrl+X")
         self.cutAction.triggered.connect(self.scriptEdit.cut)
         
         # Copy
-        self.copyAction = QAction(QtGui.QIcon("icons/copy.png"),"Copy to clipboard",self)
+        self.copyAction = QAction(self.registry.icon("copy"),"Copy to clipboard",self)
         self.copyAction.setStatusTip("Copy text to clipboard")
         self.copyAction.setShortcut("Ctrl+C")
         self.copyAction.triggered.connect(self.scriptEdit.copy)
         
         # Paste
-        self.pasteAction = QAction(QtGui.QIcon("icons/paste.png"),"Paste from clipboard",self)
+        self.pasteAction = QAction(self.registry.icon("paste"),"Paste from clipboard",self)
         self.pasteAction.setStatusTip("Paste text from clipboard")
         self.pasteAction.setShortcut("Ctrl+V")
         self.pasteAction.triggered.connect(self.scriptEdit.paste)
         
         # Undo
-        self.undoAction = QAction(QtGui.QIcon("icons/undo.png"),"Undo last action",self)
+        self.undoAction = QAction(self.registry.icon("undo"),"Undo last action",self)
         self.undoAction.setStatusTip("Undo last action")
         self.undoAction.setShortcut("Ctrl+Z")
         self.undoAction.triggered.connect(self.undoStack.undo)
         
         # Redo
-        self.redoAction = QAction(QtGui.QIcon("icons/redo.png"),"Redo last undone thing",self)
+        self.redoAction = QAction(self.registry.icon("redo"),"Redo last undone thing",self)
         self.redoAction.setStatusTip("Redo last undone thing")
         self.redoAction.setShortcut("Ctrl+Y")
         self.redoAction.triggered.connect(self.undoStack.redo)
         
+        # Find
+        self.findAction = QAction(self.registry.icon("find"),"Find and replace",self)
+        self.findAction.setStatusTip("Find and replace text in the script")
+        self.findAction.setShortcut("Ctrl+F")
+        self.findAction.triggered.connect(self.find)
+        
         # Bullet List [TO REMOVE]
-        bulletAction = QAction(QtGui.QIcon("icons/bullet.png"),"Insert bullet List",self)
+        bulletAction = QAction(self.registry.icon("bullet"),"Insert bullet List",self)
         bulletAction.setStatusTip("Insert bullet list")
         bulletAction.setShortcut("Ctrl+Shift+B")
         bulletAction.triggered.connect(self.bulletList) 
         
         # Number List [TO REMOVE]
-        numberedAction = QAction(QtGui.QIcon("icons/number.png"),"Insert numbered List",self)
+        numberedAction = QAction(self.registry.icon("number"),"Insert numbered List",self)
         numberedAction.setStatusTip("Insert numbered list")
         numberedAction.setShortcut("Ctrl+Shift+L")
         numberedAction.triggered.connect(self.numberList)
@@ -191,6 +323,7 @@ class Main(QMainWindow):
         self.toolbar.addAction(self.pasteAction)
         self.toolbar.addAction(self.undoAction)
         self.toolbar.addAction(self.redoAction)
+        self.toolbar.addAction(self.findAction)
         self.toolbar.addSeparator()
         
         self.toolbar.addAction(bulletAction)
@@ -202,9 +335,9 @@ class Main(QMainWindow):
 
     def initFormatbar(self):        
         # Color control
-        fontColor = QAction(QtGui.QIcon("icons/font-color.png"),"Change font color",self)
+        fontColor = QAction(self.registry.icon("font-color"),"Change font color",self)
         fontColor.triggered.connect(self.fontColor)
-        backColor = QAction(QtGui.QIcon("icons/highlight.png"),"Change background color",self)
+        backColor = QAction(self.registry.icon("highlight"),"Change background color",self)
         backColor.triggered.connect(self.highlight)
         
         # Action
@@ -264,33 +397,33 @@ class Main(QMainWindow):
         # self.autoFormatAction.triggered.connect(self.setAutoFormat)
         
         # Bold
-        boldAction = QAction(QtGui.QIcon("icons/bold.png"),"Bold",self)
+        boldAction = QAction(self.registry.icon("bold"),"Bold",self)
         boldAction.triggered.connect(self.bold)
         # Italics
-        italicAction = QAction(QtGui.QIcon("icons/italic.png"),"Italic",self)
+        italicAction = QAction(self.registry.icon("italic"),"Italic",self)
         italicAction.triggered.connect(self.italic)
         # Underline
-        underlAction = QAction(QtGui.QIcon("icons/underline.png"),"Underline",self)
+        underlAction = QAction(self.registry.icon("underline"),"Underline",self)
         underlAction.triggered.connect(self.underline)
         # Strike-through
-        strikeAction = QAction(QtGui.QIcon("icons/strike.png"),"Strike-out",self)
+        strikeAction = QAction(self.registry.icon("strike"),"Strike-out",self)
         strikeAction.triggered.connect(self.strike)
         strikeAction.setShortcut("Ctrl+Shift+S")
         # Superscript
-        superAction = QAction(QtGui.QIcon("icons/superscript.png"),"Superscript",self)
+        superAction = QAction(self.registry.icon("superscript"),"Superscript",self)
         superAction.triggered.connect(self.superScript)
         # Subscript
-        subAction = QAction(QtGui.QIcon("icons/subscript.png"),"Subscript",self)
+        subAction = QAction(self.registry.icon("subscript"),"Subscript",self)
         subAction.triggered.connect(self.subScript) 
         
         # Align Left
-        alignLeft = QAction(QtGui.QIcon("icons/align-left.png"),"Align left",self)
+        alignLeft = QAction(self.registry.icon("align-left"),"Align left",self)
         alignLeft.triggered.connect(self.alignLeft)
         # Align Center
-        alignCenter = QAction(QtGui.QIcon("icons/align-center.png"),"Align center",self)
+        alignCenter = QAction(self.registry.icon("align-center"),"Align center",self)
         alignCenter.triggered.connect(self.alignCenter)
         # Align Right
-        alignRight = QAction(QtGui.QIcon("icons/align-right.png"),"Align right",self)
+        alignRight = QAction(self.registry.icon("align-right"),"Align right",self)
         alignRight.triggered.connect(self.alignRight)
         
         self.formatbar = self.addToolBar("Format")
@@ -333,8 +466,13 @@ class Main(QMainWindow):
         
         file.addAction(self.newAction)
         file.addAction(self.openAction)
+        file.addAction(self.importAction)
+        file.addAction(self.exportAction)
+        file.addAction(self.reportAction)
         file.addAction(self.saveAction)
         file.addAction(self.saveAsAction)
+        file.addAction(self.revisionsAction)
+        file.addAction(self.compareAction)
         file.addAction(self.printAction)
         file.addAction(self.previewAction)
         
@@ -343,19 +481,79 @@ class Main(QMainWindow):
         edit.addAction(self.cutAction)
         edit.addAction(self.copyAction)
         edit.addAction(self.pasteAction)
+        edit.addAction(self.findAction)
+        
+        view.addAction(self.statisticsAction)
+       
+    def initSaving(self):
+        # Saves are written on a worker thread
+        self.saver = BackgroundSaver(lambda snapshot: serializeNative(snapshot, self.elementFormats), self)
+        self.saver.saved.connect(self.fileSaved)
+        self.saver.failed.connect(self.fileSaveFailed)
+        self.saver.replaced.connect(self.fileSaveReplaced)
+        
+        # Autosave, only fires a save when the script has changed
+        self.autosaveTimer = QTimer(self)
+        self.autosaveTimer.timeout.connect(self.autosave)
+        if (writterSettings.autosaveInterval > 0):
+            self.autosaveTimer.start(round(writterSettings.autosaveInterval * 1000))
+        
+        # Edits since the last save go to a journal next to the script, see writerJournal
+        self.journal = ScriptJournal(self.scriptEdit.document(), self.elementFormats,
+                                     writterSettings.journalDelay,
+                                     writterSettings.journalCompactSize * 1024 * 1024, self)
+        
+        # Draft snapshots are stored as deltas on a worker thread too, see writerRevisions
+        self.snapshots = BackgroundSnapshots(self.elementFormats, self)
+        self.snapshots.created.connect(self.snapshotCreated)
+        self.snapshots.failed.connect(self.snapshotFailed)
+        self.revisionsDialog = None
+        self.compareDialog = None
+       
+    def initIndexes(self):
+        # Indexes follow the document's changes block by block, see writerIndex
+        self.blockTracker = BlockTracker(self.scriptEdit.document(), self)
+        self.characterIndex = CharacterIndex(self)
+        self.blockTracker.addIndex(self.characterIndex)
+        self.searchIndex = SearchIndex(self.blockTracker, self)
+        self.blockTracker.addIndex(self.searchIndex)
+        self.sceneIndex = SceneIndex(self.scriptEdit.document(), self)
+        self.blockTracker.addIndex(self.sceneIndex)
+        self.pageIndex = PageIndex(self.searchIndex, self)
+        self.blockTracker.addIndex(self.pageIndex)
+        self.statisticsIndex = StatisticsIndex(self)
+        self.blockTracker.addIndex(self.statisticsIndex)
+        self.findDialog = None
+        self.previewDialog = None
+       
+    def initUndo(self):
+        # Text edits and format changes go on the undo stack as deltas, see writerUndo
+        self.undoRecorder = UndoRecorder(self.scriptEdit, self.undoStack, self.elementFormats,
+                                         writterSettings.undoMemoryLimit * 1024 * 1024, self)
        
     ### CHARACATER MENU SECTION START ###
     ### - includes autocompletion code 
        
     def initCharMenu(self):
-        # Default characterlist
+        # Default characterlist (names added by hand, the script's own
+        # characters come from the character index)
         self.characterList = []
         if (writterSettings.startWithDefaultCharacters):
             self.characterList = self.characterList + writterSettings.defaultCharacters
         
-        # Adding autocompleter
-        completer = QCompleter(self.characterList, None)
-        self.scriptEdit.setCompleter(completer)
+        # The completer and list follow the character index, at most a few times a second
+        self.characterRefreshTimer = QTimer(self)
+        self.characterRefreshTimer.setSingleShot(True)
+        self.characterRefreshTimer.setInterval(250)
+        self.characterRefreshTimer.timeout.connect(self.refreshCharacters)
+        self.characterIndex.changed.connect(self.characterRefreshTimer.start)
+        
+        # Adding autocompleter, the same one for the whole session
+        self.completer = CharacterCompleter(self)
+        if (writterSettings.castDatabase):
+            self.completer.loadCastDatabase(writterSettings.castDatabase)
+        self.completer.updateNames(self.completionCounts())
+        self.scriptEdit.setCompleter(self.completer)
         
         # Header
         self.charListTitle = QLabel('Characters')
@@ -367,9 +565,22 @@ class Main(QMainWindow):
         self.addCharacterButton = QPushButton('+', self)
         self.addCharacterButton.clicked.connect(self.addCharacter)
         
-        # Character list container
-        self.characterListContainer = QGridLayout()
-        self.characterListContainer.setSpacing(round(2*DPI_MULT))
+        # Remove characters button (for the selected name)
+        self.removeCharacterButton = QPushButton('-', self)
+        self.removeCharacterButton.clicked.connect(self.removeSelectedCharacter)
+        
+        # Character list, only the visible rows are ever drawn
+        self.characterListModel = CharacterListModel(self)
+        self.characterListView = QListView()
+        self.characterListView.setModel(self.characterListModel)
+        self.characterListView.setUniformItemSizes(True)
+        self.characterListView.setEditTriggers(QListView.NoEditTriggers)
+        self.characterListView.setSelectionMode(QListView.SingleSelection)
+        removeSelected = QAction("Remove character", self.characterListView)
+        removeSelected.setShortcut(QKeySequence.Delete)
+        removeSelected.setShortcutContext(Qt.WidgetShortcut)
+        removeSelected.triggered.connect(self.removeSelectedCharacter)
+        self.characterListView.addAction(removeSelected)
         
         # Sizing
         self.charListTitle.setMaximumHeight(round(25*DPI_MULT))
@@ -377,6 +588,9 @@ class Main(QMainWindow):
         self.charListButtonTitle.setMaximumHeight(round(25*DPI_MULT))
         self.addCharacterButton.setMaximumWidth(round(25*DPI_MULT))
         self.addCharacterButton.setMaximumHeight(round(25*DPI_MULT))
+        self.removeCharacterButton.setMaximumWidth(round(25*DPI_MULT))
+        self.removeCharacterButton.setMaximumHeight(round(25*DPI_MULT))
+        self.characterListView.setMaximumWidth(round(200*DPI_MULT))
         self.charMenuGrid = QGridLayout()
         self.charMenuGrid.setSpacing(round(2*DPI_MULT))
         
@@ -385,75 +599,60 @@ class Main(QMainWindow):
         self.charMenuGrid.addWidget(self.charListButtonTitle,       0, 4)
         self.charMenuGrid.addWidget(self.newCharacterEdit,          1, 0, 1, 4)
         self.charMenuGrid.addWidget(self.addCharacterButton,        1, 4)
-        self.charMenuGrid.addLayout(self.characterListContainer,    2, 0, 1, 5)
+        self.charMenuGrid.addWidget(self.characterListView,         2, 0, 1, 4)
+        self.charMenuGrid.addWidget(self.removeCharacterButton,     2, 4, Qt.AlignTop)
         
         # Populate charactert 
         self.setCharacterList() 
         
-    def setCharacterList(self):
-        # Remove old charMenuGrid
-        rowCount = self.characterListContainer.rowCount()
-        colCount = self.characterListContainer.columnCount()
-        
-        for i in range(rowCount):
-            for j in range(colCount):
-                if self.characterListContainer.itemAtPosition(i, j) is not None:
-                    self.characterListContainer.itemAtPosition(i, j).widget().setParent(None)
-        
-        counter = 0
-        if (len(self.characterList) == 0):
-            noTitle = QLabel('None')
-            noTitle.setMaximumHeight(round(25*DPI_MULT))
-            self.characterListContainer.addWidget(noTitle, counter, 0, 1, 4)
-            counter = counter + 1
-        else:
-            for character in self.characterList:
-                charTitle = QLabel(character)
-                charTitle.setMaximumHeight(round(25*DPI_MULT))
-                
-                remButton = QPushButton('-', self)
-                remButton.clicked.connect(lambda ignore, a=character : self.removeCharacter(a))
-                remButton.setMaximumWidth(round(25*DPI_MULT))
-                remButton.setMaximumHeight(round(25*DPI_MULT))
-                
-                self.characterListContainer.addWidget(charTitle, counter, 0, 1, 4)
-                self.characterListContainer.addWidget(remButton, counter, 4)
-                counter = counter + 1
+    def characterNames(self):
+        # Names added by hand first, then the ones found in the script
+        names = list(self.characterList)
+        known = set(names)
+        for name in self.characterIndex.names():
+            if (name not in known):
+                names.append(name)
+        return names
         
-        bottomSpace = QLabel(' ')
-        self.characterListContainer.addWidget(bottomSpace, counter, 0, 1, 5, Qt.AlignBottom)
+    def setCharacterList(self):
+        # Only the rows that changed are touched (see CharacterListModel)
+        characterNames = self.characterNames()
+        counts = {name: self.characterIndex.count(name) for name in characterNames}
+        self.characterListModel.setCharacters(characterNames, counts, self.characterList)
         
-    def addCharacter(self):
-        self.characterList.append(self.newCharacterEdit.text().upper())
-        self.newCharacterEdit.clear()
+    def completionCounts(self):
+        # Every known name with its number of lines in the script
+        return {name: self.characterIndex.count(name) for name in self.characterNames()}
         
-        # Update autocompleter
-        completer = QCompleter(self.characterList, None)
-        self.scriptEdit.setCompleter(completer)
+    def refreshCharacters(self):
+        # Update autocompleter (in place)
+        self.completer.updateNames(self.completionCounts())
         
         # Update displayed list
         self.setCharacterList()
+        
+    def addCharacter(self):
+        self.characterList.append(self.newCharacterEdit.text().upper())
+        self.newCharacterEdit.clear()
+        self.refreshCharacters()
          
     def addCharacterName(self, characterName):
-        if (characterName.upper() not in self.characterList):
+        # Names typed into the script are picked up by the character index
+        self.completer.markUsed(characterName.strip())
+        if (characterName.upper() not in self.characterNames()):
             self.characterList.append(characterName.upper())
-            
-            # Update autocompleter
-            completer = QCompleter(self.characterList, None)
-            self.scriptEdit.setCompleter(completer)
-            
-            # Update displayed list
-            self.setCharacterList()
+            self.refreshCharacters()
         
     def removeCharacter(self, charName):
         self.characterList.remove(charName)
+        self.refreshCharacters()
         
-        # Update autocompleter
-        completer = QCompleter(self.characterList, None)
-        self.scriptEdit.setCompleter(completer)
-        
-        # Update displayed list
-        self.setCharacterList()
+    def removeSelectedCharacter(self):
+        # Only names added by hand can be removed, the others are in the script
+        for index in self.characterListView.selectionModel().selectedRows():
+            charName = self.characterListModel.nameAt(index.row())
+            if (charName in self.characterList):
+                self.removeCharacter(charName)
         
     ### CHARACATER MENU SECTION END ###
     
@@ -522,6 +721,8 @@ class Main(QMainWindow):
     def insertHeader(self):
         # Get cursor
         cursor = self.scriptEdit.textCursor()
+        # The whole title page is undone in one go
+        self.undoStack.beginMacro("Insert title page")
         
         # Make one block space
         cursor.movePosition(QTextCursor.Start, QTextCursor.MoveAnchor)
@@ -548,7 +749,8 @@ class Main(QMainWindow):
         # Character List
         if (self.characterListTitleCheck.checkState() == Qt.Checked):
             # Check if list is empty
-            if (len(self.characterList) > 0):
+            characterNames = self.characterNames()
+            if (len(characterNames) > 0):
                 cursor.insertBlock()
                 self.scriptEdit.setTextCursor(cursor)
                 self.changeFormatTo(FormatState.Dialogue)
@@ -556,14 +758,114 @@ class Main(QMainWindow):
                 cursor.insertBlock()
                 self.scriptEdit.setTextCursor(cursor)
                 self.changeFormatTo(FormatState.Character)
-                for characterName in self.characterList:
+                for characterName in characterNames:
                     cursor.insertText(characterName)
                     cursor.insertBlock()
         
         # Apply any remaining changes
         self.scriptEdit.setTextCursor(cursor)
+        self.undoStack.endMacro()
     ### HEADER MENU SECTION END ###
     
+    ### SCENE NAVIGATOR SECTION START ###
+    
+    def initSceneMenu(self):
+        # The navigator follows the scene index, at most a few times a second
+        self.sceneRefreshTimer = QTimer(self)
+        self.sceneRefreshTimer.setSingleShot(True)
+        self.sceneRefreshTimer.setInterval(250)
+        self.sceneRefreshTimer.timeout.connect(self.refreshScenes)
+        self.sceneIndex.changed.connect(self.sceneRefreshTimer.start)
+        
+        # Header
+        self.sceneListTitle = QLabel('Scenes')
+        
+        # Scene list, clicking a scene jumps to its heading
+        self.sceneListModel = SceneListModel(self)
+        self.sceneListView = QListView()
+        self.sceneListView.setModel(self.sceneListModel)
+        self.sceneListView.setUniformItemSizes(True)
+        self.sceneListView.setEditTriggers(QListView.NoEditTriggers)
+        self.sceneListView.setSelectionMode(QListView.SingleSelection)
+        self.sceneListView.clicked.connect(self.goToScene)
+        self.sceneListView.activated.connect(self.goToScene)
+        
+        # Sizing
+        self.sceneListTitle.setMaximumHeight(round(25*DPI_MULT))
+        self.sceneListView.setMaximumWidth(round(220*DPI_MULT))
+        self.sceneMenuGrid = QGridLayout()
+        self.sceneMenuGrid.setSpacing(round(2*DPI_MULT))
+        
+        # Build main sceneMenuGrid
+        self.sceneMenuGrid.addWidget(self.sceneListTitle,           0, 0)
+        self.sceneMenuGrid.addWidget(self.sceneListView,            1, 0)
+        
+        self.refreshScenes()
+        
+    def refreshScenes(self):
+        # The scene index only estimates pages, the page index knows them
+        # Scenes and pages are both in document order, one pass over both does
+        document = self.scriptEdit.document()
+        scenes = self.sceneIndex.scenes
+        numbers = [document.findBlock(scene.position()).blockNumber() for scene in scenes]
+        for scene, page in zip(scenes, self.pageIndex.pagesOf(numbers)):
+            scene.page = page
+        self.sceneListModel.setScenes(self.sceneIndex.scenes)
+        self.sceneListTitle.setText('Scenes (' + str(len(self.sceneIndex.scenes)) + ')')
+        self.showCurrentScene()
+        
+    def goToScene(self, index):
+        scene = self.sceneListModel.sceneAt(index.row())
+        cursor = self.scriptEdit.textCursor()
+        cursor.setPosition(scene.position())
+        # Going to the end first leaves the heading at the top of the view
+        self.scriptEdit.moveCursor(QTextCursor.End)
+        self.scriptEdit.setTextCursor(cursor)
+        self.scriptEdit.setFocus()
+        
+    def showCurrentScene(self):
+        # Selects the scene the text cursor is in (a lookup by position)
+        number = self.sceneIndex.sceneAt(self.scriptEdit.textCursor().position())
+        if (0 <= number < self.sceneListModel.rowCount()):
+            index = self.sceneListModel.index(number)
+            if (self.sceneListView.currentIndex() != index):
+                self.sceneListView.setCurrentIndex(index)
+        else:
+            self.sceneListView.clearSelection()
+            
+    def showCurrentPage(self):
+        # While typing, the page breaks wait for pageTimer
+        if (self.pageIndex.dirtyFrom is not None and self.sender() is self.scriptEdit):
+            return
+        block = self.scriptEdit.textCursor().block()
+        self.pageLabel.setText("Page " + str(self.pageIndex.pageOf(block.blockNumber())) +
+                               " of " + str(self.pageIndex.pageCount()))
+    
+    def statisticsChanged(self):
+        if (not self.statisticsTimer.isActive()):
+            self.statisticsTimer.start()
+            
+    def showStatistics(self):
+        # Only reads statisticsIndex's totals, pages (and the screen time)
+        # are the ones last worked out for the page label
+        visible = self.statisticsAction.isChecked()
+        self.statisticsLabel.setVisible(visible)
+        if (not visible):
+            return
+        statistics = self.statisticsIndex
+        dialogue = round(statistics.ratio() * 100)
+        action = 100 - dialogue if statistics.lineCount() else 0
+        # Screen time at a page a minute, the page count is next to it in the page label
+        pages = max(len(self.pageIndex.pages), 1)
+        self.statisticsLabel.setText("{:,} words | {} scenes | {}% dialogue | ~{}:{:02d} h |".format(
+            statistics.wordCount(), statistics.scenes, dialogue, pages // 60, pages % 60))
+        self.statisticsLabel.setToolTip("{} pages, {} scenes, {}% dialogue and {}% action\n".format(
+            pages, statistics.scenes, dialogue, action) + "Words: " + ", ".join(
+            state.name + " " + str(statistics.words.get(state, 0)) for state in FormatState) +
+            "\nScreen time at a page a minute")
+    
+    ### SCENE NAVIGATOR SECTION END ###
+    
     ### MENUBAR FUNCTIONS START ###
     
     def new(self):
@@ -574,48 +876,292 @@ class Main(QMainWindow):
         # Get filename and show only .writer files
         self.filename = QFileDialog.getOpenFileName(self, 'Open File',".","(*.writer)")[0]
         if self.filename:
-            with open(self.filename,"rt") as file:
-                self.scriptEdit.setText(file.read())
+            self.openFile(self.filename)
+            
+    def openFile(self, filename):
+        self.finishLoading()
+        self.journal.close()
+        document = self.scriptEdit.document()
+        
+        # Big native scripts show their first scenes straight away and
+        # stream in the rest, everything else is loaded in one go
+        header = readNativeHeader(filename)
+        if (header is not None and writterSettings.lazyLoadBlocks > 0 and
+            header.get("blocks", 0) > writterSettings.lazyLoadBlocks):
+            self.loader = LazyLoader(filename, document, self.elementFormats,
+                                     writterSettings.lazyFirstScenes, parent=self)
+            self.loader.progress.connect(self.loadProgressed)
+            self.loader.finished.connect(self.loadFinished)
+            self.loadProgress.setValue(0)
+            self.loadProgress.show()
+            self.loader.start()
+            self.scriptEdit.moveCursor(QTextCursor.Start)
+        else:
+            # Native scripts are built straight from their blocks,
+            # older html scripts still go through Qt's html import
+            loadScript(readScriptText(filename), document, self.elementFormats)
+            document.setModified(False)
+        # Nothing to undo in a freshly opened script
+        self.undoRecorder.reset()
+        self.startJournal(filename)
+        
+    def startJournal(self, filename):
+        # A journal that is still there after a crash holds the edits that
+        # weren't saved, they are replayed on top of the saved script
+        if (not writterSettings.journalEnabled):
+            return
+        path = journalPath(filename)
+        lock = lockJournal(path)
+        if (lock is None):
+            self.statusbar.showMessage(os.path.basename(filename) + 
+                                       " is open in another window, its edits aren't journaled here")
+            return
+        entries = []
+        if (os.path.exists(path)):
+            try:
+                header, entries, length = readJournal(path)
+            except (OSError, ValueError):
+                entries = []
+            if (entries and not canReplay(header, entries, filename)):
+                self.statusbar.showMessage("Unsaved edits of " + os.path.basename(filename) + 
+                                           " were left out, the script was changed since")
+                entries = []
+        if (entries and QMessageBox.question(self, "Recover edits",
+                os.path.basename(filename) + " wasn't closed properly. Recover the edits that weren't saved?",
+                QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes) == QMessageBox.Yes):
+            self.finishLoading()
+            document = self.scriptEdit.document()
+            replayJournal(document, entries, self.elementFormats)
+            document.setModified(True)
+            self.undoRecorder.reset()
+            self.journal.resume(filename, lock, length)
+            self.statusbar.showMessage("Recovered the unsaved edits of " + os.path.basename(filename), 5000)
+        else:
+            self.journal.start(filename, lock)
+            
+    def importScript(self):
+        extensions = " ".join("*" + extension for extension in FOUNTAIN_EXTENSIONS + TEXT_EXTENSIONS)
+        filename = QFileDialog.getOpenFileName(self, 'Import File', ".", "(" + extensions + ")")[0]
+        if filename:
+            self.importFile(filename)
+            
+    def importFile(self, filename):
+        # The imported script is a new one, saving asks for a .writer name
+        self.finishLoading()
+        self.journal.close()
+        readFountain(filename, self.scriptEdit.document(), self.elementFormats)
+        self.filename = ""
+        self.scriptEdit.document().setModified(True)
+        self.scriptEdit.moveCursor(QTextCursor.Start)
+        self.undoRecorder.reset()
+            
+    def exportScript(self):
+        filters = ["Fountain (*.fountain)", "Final Draft (*.fdx)"]
+        filename, chosen = QFileDialog.getSaveFileName(self, 'Export File', ".", ";;".join(filters))
+        if not filename:
+            return
+        # The extension picks the format, the chosen filter adds it when missing
+        name = "fountain"
+        if (filename.lower().endswith(".fdx") or
+            (chosen == filters[1] and not filename.lower().endswith(".fountain"))):
+            name = "fdx"
+        extension, writeScript = EXPORTERS[name]
+        if not filename.lower().endswith(extension):
+            filename += extension
+        self.finishLoading()
+        try:
+            writeScript(self.scriptEdit.document(), filename, self.elementFormats)
+        except OSError as error:
+            self.statusbar.showMessage("Could not export " + filename + ": " + str(error))
+            return
+        self.statusbar.showMessage("Exported " + filename, 5000)
+            
+    def breakdownReport(self):
+        filters = ["CSV (*.csv)", "JSON (*.json)"]
+        filename, chosen = QFileDialog.getSaveFileName(self, 'Breakdown Report', ".", ";;".join(filters))
+        if not filename:
+            return
+        # The extension picks the format, the chosen filter adds it when missing
+        name = "csv"
+        if (filename.lower().endswith(".json") or
+            (chosen == filters[1] and not filename.lower().endswith(".csv"))):
+            name = "json"
+        extension, writeReport = REPORTERS[name]
+        if not filename.lower().endswith(extension):
+            filename += extension
+        self.finishLoading()
+        # The page index has the page breaks (and printed lines) already
+        pages = self.pageIndex.update()
+        elements = self.pageIndex.elements()
+        report = scriptBreakdown([data.text for data in elements.blocks], elements, pages)
+        try:
+            writeReport(report, filename)
+        except OSError as error:
+            self.statusbar.showMessage("Could not write " + filename + ": " + str(error))
+            return
+        self.statusbar.showMessage("Wrote the breakdown of " + str(len(report["scenes"])) +
+                                   " scenes to " + filename, 5000)
+            
+    def finishLoading(self):
+        # Anything that needs the whole script waits for the rest of it
+        if (self.loader is not None):
+            self.loader.finishNow()
+            
+    def loadProgressed(self, loaded, total):
+        self.loadProgress.setMaximum(max(total, 1))
+        self.loadProgress.setValue(loaded)
+        
+    def loadFinished(self):
+        self.loadProgress.hide()
+        self.loader.deleteLater()
+        self.loader = None
                 
     def save(self):
         # Only open dialog if there is no filename yet
         if not self.filename:
             self.filename = QFileDialog.getSaveFileName(self, 'Save File')[0]
+            if not self.filename:
+                return
 
         # Append extension if not there yet
         if not self.filename.endswith(".writer"):
             self.filename += ".writer"
 
-        # We just store the contents of the text file along with the
-        # format in html, which Qt does in a very nice way for us
-        with open(self.filename,"wt") as file:
-            file.write(self.scriptEdit.toHtml())
+        self.writeFile()
             
     def saveAs(self):
-        # Only open dialog if there is no filename yet
-        self.filename = QFileDialog.getSaveFileName(self, 'Save File')[0]
+        filename = QFileDialog.getSaveFileName(self, 'Save File')[0]
+        if not filename:
+            return
+        self.filename = filename
 
         # Append extension if not there yet
         if not self.filename.endswith(".writer"):
             self.filename += ".writer"
 
-        # We just store the contents of the text file along with the
-        # format in html, which Qt does in a very nice way for us
-        with open(self.filename,"wt") as file:
-            file.write(self.scriptEdit.toHtml())
+        self.writeFile()
+        
+    def writeFile(self):
+        # Scripts are stored block by block (element type, text and any
+        # inline formatting), see writerFile. Only the snapshot is taken
+        # here, encoding and writing (to a temp file renamed over the old
+        # one) happen on the saver's thread
+        self.finishLoading()
+        checkpoint = None
+        if (writterSettings.journalEnabled):
+            checkpoint = self.journal.checkpoint()
+        self.saver.save(self.filename, self.scriptEdit.document(), checkpoint)
+        
+    def autosave(self):
+        # Untitled scripts wait for a first manual save
+        if (self.filename and self.scriptEdit.document().isModified()):
+            self.writeFile()
+            
+    def fileSaved(self, filename, seconds, checkpoint):
+        self.statusbar.showMessage("Saved " + os.path.basename(filename), 3000)
+        # The journal starts over from the saved script, unless another
+        # script was opened while it was being written
+        if (checkpoint is not None and filename == self.filename):
+            self.journal.saved(filename, checkpoint)
+        
+    def fileSaveFailed(self, filename, error, checkpoint):
+        # The changes are still unsaved
+        self.scriptEdit.document().setModified(True)
+        self.statusbar.showMessage("Could not save " + filename + ": " + error)
+        if (checkpoint is not None and filename == self.filename):
+            self.journal.saveFailed(checkpoint)
+        
+    def fileSaveReplaced(self, checkpoint):
+        # A newer save took its place before it was written
+        if (checkpoint is not None):
+            self.journal.saveReplaced(checkpoint)
+        
+    def revisions(self):
+        if (self.revisionsDialog is None):
+            self.revisionsDialog = RevisionsDialog(self, self)
+        self.revisionsDialog.showRevisions()
+        
+    def takeSnapshot(self, name=""):
+        # Only the copy of the document is taken here
+        self.finishLoading()
+        self.snapshots.snapshot(self.filename, self.scriptEdit.document(), name)
+        
+    def snapshotCreated(self, path, revision, seconds):
+        self.statusbar.showMessage("Stored revision " + str(revision["number"]), 3000)
+        if (self.revisionsDialog is not None and self.revisionsDialog.isVisible()):
+            self.revisionsDialog.refresh()
+        
+    def snapshotFailed(self, path, error):
+        self.statusbar.showMessage("Could not store the revision: " + error)
+        if (self.revisionsDialog is not None and self.revisionsDialog.isVisible()):
+            self.revisionsDialog.statusLabel.setText("Could not store the revision: " + error)
+        
+    def openRevision(self, revision, lines):
+        self.openLines(os.path.basename(self.filename) + ", revision " + str(revision["number"]) + 
+                       (" (" + revision["name"] + ")" if revision["name"] else ""), lines)
+        
+    def openLines(self, title, lines):
+        # Drafts open in a window of their own, as an untitled script
+        spawn = Main(self)
+        loadRevision(spawn.scriptEdit.document(), lines, self.elementFormats)
+        spawn.undoRecorder.reset()
+        spawn.setWindowTitle("Writer - " + title)
+        spawn.show()
+        return spawn
+        
+    def compare(self):
+        if (self.compareDialog is None):
+            self.compareDialog = CompareDialog(self, self)
+        self.compareDialog.showCompare()
+        
+    def closeEvent(self, event):
+        # Don't leave with a save (or a snapshot) still being written. Its
+        # signals would only come after the journal is closed and start it
+        # over, so they are blocked
+        self.saver.blockSignals(True)
+        self.saver.wait()
+        self.snapshots.wait()
+        # A clean exit leaves no journal behind
+        self.journal.wait()
+        self.journal.close()
+        if (self.previewDialog is not None):
+            self.previewDialog.renderer.cancel()
+        QMainWindow.closeEvent(self, event)
         
     def preview(self):
-        preview = QPrintPreviewDialog()
-        preview.printer().setResolution(BASE_DPI)
-        preview.paintRequested.connect(lambda p: self.scriptEdit.print(p))
-        preview.exec_()
+        # Rendered pages are kept by content, reopening only renders what changed
+        if (self.previewDialog is None):
+            self.previewDialog = PreviewDialog(self.previewPages, self.print,
+                                               writterSettings.previewCacheMemory * 1024 * 1024, self)
+            self.pageIndex.changed.connect(self.previewDialog.documentChanged)
+        self.previewDialog.showPreview()
+        
+    def previewPages(self):
+        self.finishLoading()
+        pages = self.pageIndex.update()
+        elements = self.pageIndex.elements()
+        return [(page.number, pageContent(page, elements)) for page in pages]
      
     def print(self):
         printer = QPrinter()
         dialog = QPrintDialog(printer)
+        dialog.setMinMax(1, max(self.pageIndex.pageCount(), 1))
         if dialog.exec() == QDialog.Accepted:
             dialog.printer().setResolution(BASE_DPI)
-            self.scriptEdit.document().print(dialog.printer())
+            self.printScript(dialog.printer())
+            
+    def printScript(self, printer):
+        # Printed with the page index's page breaks, see writerPages
+        self.finishLoading()
+        printPages(printer, self.pageIndex.update(), self.pageIndex.elements())
+                   
+    def find(self):
+        # Searches the script's text index, see writerFind
+        if (self.findDialog is None):
+            self.findDialog = FindDialog(self.scriptEdit, self.searchIndex, self.characterNames, self)
+        # A selection on a single line is what gets searched for
+        selected = self.scriptEdit.textCursor().selectedText()
+        self.findDialog.showFind(selected if "\u2029" not in selected else "")
                    
     def bulletList(self):
         cursor = self.scriptEdit.textCursor()
@@ -628,32 +1174,45 @@ class Main(QMainWindow):
           
     def fontColor(self):
         color = QColorDialog.getColor()
+        self.undoRecorder.beginStyle()
         self.scriptEdit.setTextColor(color)
+        self.undoRecorder.endStyle()
      
     def highlight(self):
         color = QColorDialog.getColor()
+        self.undoRecorder.beginStyle()
         self.scriptEdit.setTextBackgroundColor(color)
+        self.undoRecorder.endStyle()
 
     def bold(self):
+        self.undoRecorder.beginStyle()
         if self.scriptEdit.fontWeight() == QtGui.QFont.Bold:
             self.scriptEdit.setFontWeight(QtGui.QFont.Normal)
         else:
             self.scriptEdit.setFontWeight(QtGui.QFont.ExtraBold)
+        self.undoRecorder.endStyle()
      
     def italic(self):
+        self.undoRecorder.beginStyle()
         state = self.scriptEdit.fontItalic()
         self.scriptEdit.setFontItalic(not state)
+        self.undoRecorder.endStyle()
      
     def underline(self):
+        self.undoRecorder.beginStyle()
         state = self.scriptEdit.fontUnderline()
         self.scriptEdit.setFontUnderline(not state)
+        self.undoRecorder.endStyle()
      
     def strike(self):
+        self.undoRecorder.beginStyle()
         fmt = self.scriptEdit.currentCharFormat()
         fmt.setFontStrikeOut(not fmt.fontStrikeOut())
         self.scriptEdit.setCurrentCharFormat(fmt)
+        self.undoRecorder.endStyle()
      
     def superScript(self):
+        self.undoRecorder.beginStyle()
         fmt = self.scriptEdit.currentCharFormat()
         align = fmt.verticalAlignment()
         if align == QtGui.QTextCharFormat.AlignNormal:
@@ -661,8 +1220,10 @@ class Main(QMainWindow):
         else:
             fmt.setVerticalAlignment(QtGui.QTextCharFormat.AlignNormal)
         self.scriptEdit.setCurrentCharFormat(fmt)
+        self.undoRecorder.endStyle()
      
     def subScript(self):
+        self.undoRecorder.beginStyle()
         fmt = self.scriptEdit.currentCharFormat()
         align = fmt.verticalAlignment()
         if align == QtGui.QTextCharFormat.AlignNormal:
@@ -670,6 +1231,7 @@ class Main(QMainWindow):
         else:
             fmt.setVerticalAlignment(QtGui.QTextCharFormat.AlignNormal)
         self.scriptEdit.setCurrentCharFormat(fmt)
+        self.undoRecorder.endStyle()
        
     def alignLeft(self):
         self.scriptEdit.setAlignment(Qt.AlignLeft)
@@ -682,105 +1244,13 @@ class Main(QMainWindow):
         
     ### MENUBAR FUNCTIONS END ###
     
-    def setFontFormats(self):
-        basefont = QFont()
-        basefont.setFamily("Courier")
-        basefont.setPointSizeF(12)
-        
-        # Set the size of a single character (used for UI scaling)
-        fm = QFontMetrics(basefont)
-        self.monoCharSize = fm.horizontalAdvance("a")
-    
-        self.actionFormat = QTextCharFormat()
-        self.actionFormat.setFont(basefont)
-        #self.actionFormat.setFontFamily("Courier")
-        #self.actionFormat.setFontPointSize(12)
-        self.actionFormat.setFontCapitalization(QFont.MixedCase)    #First letter is capitalized later
-        self.actionFormat.setFontItalic(True)
-        self.actionFormat.setFontUnderline(False)
-        self.actionFormat.setFontWeight(QtGui.QFont.Normal)
-        self.actionFormat.setFontLetterSpacing(101)                 #Added a small change to differentiate from Dialogue
-        
-        self.characterFormat = QTextCharFormat()
-        self.characterFormat.setFont(basefont)
-        #self.characterFormat.setFontFamily("Courier")
-        #self.characterFormat.setFontPointSize(12)
-        self.characterFormat.setFontCapitalization(QFont.AllUppercase)
-        self.characterFormat.setFontItalic(False)
-        self.characterFormat.setFontUnderline(False)
-        self.characterFormat.setFontWeight(QtGui.QFont.ExtraBold)
-        self.characterFormat.setFontLetterSpacing(100)
-        
-        self.dialogueFormat = QTextCharFormat()
-        self.dialogueFormat.setFont(basefont)
-        #self.dialogueFormat.setFontFamily("Courier")
-        #self.dialogueFormat.setFontPointSize(12)
-        self.dialogueFormat.setFontCapitalization(QFont.MixedCase)  #First letter is capitalized later
-        self.dialogueFormat.setFontItalic(False)
-        self.dialogueFormat.setFontUnderline(False)
-        self.dialogueFormat.setFontWeight(QtGui.QFont.Normal)
-        self.dialogueFormat.setFontLetterSpacing(100)
-        
-        self.paranthesisFormat = QTextCharFormat()
-        self.paranthesisFormat.setFont(basefont)
-        #self.paranthesisFormat.setFontFamily("Courier")
-        #self.paranthesisFormat.setFontPointSize(12)
-        self.paranthesisFormat.setFontCapitalization(QFont.MixedCase)
-        self.paranthesisFormat.setFontItalic(True)
-        self.paranthesisFormat.setFontUnderline(False)
-        self.paranthesisFormat.setFontWeight(QtGui.QFont.Normal)
-        self.paranthesisFormat.setFontLetterSpacing(100)
-        
-        self.headingFormat = QTextCharFormat()
-        self.headingFormat.setFont(basefont)
-        #self.headingFormat.setFontFamily("Courier")
-        #self.headingFormat.setFontPointSize(12)
-        self.headingFormat.setFontCapitalization(QFont.AllUppercase)
-        self.headingFormat.setFontItalic(False)
-        self.headingFormat.setFontUnderline(True)
-        self.headingFormat.setFontWeight(QtGui.QFont.ExtraBold)
-        self.headingFormat.setFontLetterSpacing(100)
-        
-        self.transitionFormat = QTextCharFormat()
-        self.transitionFormat.setFont(basefont)
-        #self.transitionFormat.setFontFamily("Courier")
-        #self.transitionFormat.setFontPointSize(12)
-        self.transitionFormat.setFontCapitalization(QFont.AllUppercase)
-        self.transitionFormat.setFontItalic(False)
-        self.transitionFormat.setFontUnderline(False)
-        self.transitionFormat.setFontWeight(QtGui.QFont.Normal)
-        self.transitionFormat.setFontLetterSpacing(101)             #Added a small change to differentiate from Character
-        
-    def setBlockFormats(self):
-        self.actionBlock = QTextBlockFormat();
-        self.actionBlock.setLeftMargin(0)
-        self.actionBlock.setRightMargin(0)
-        self.actionBlock.setAlignment(Qt.AlignLeft)
-        
-        self.characterBlock = QTextBlockFormat();
-        self.characterBlock.setLeftMargin(240)
-        self.characterBlock.setRightMargin(0)
-        self.characterBlock.setAlignment(Qt.AlignLeft)
-        
-        self.dialogueBlock = QTextBlockFormat();
-        self.dialogueBlock.setLeftMargin(120)
-        self.dialogueBlock.setRightMargin(120)
-        self.dialogueBlock.setAlignment(Qt.AlignLeft)
-        
-        self.paranthesisBlock = QTextBlockFormat();
-        self.paranthesisBlock.setLeftMargin(190)
-        self.paranthesisBlock.setRightMargin(190)
-        self.paranthesisBlock.setAlignment(Qt.AlignLeft)
-        
-        self.headingBlock = QTextBlockFormat();
-        self.headingBlock.setLeftMargin(0)
-        self.headingBlock.setRightMargin(0)
-        self.headingBlock.setAlignment(Qt.AlignCenter)
-        
-        self.transitionBlock = QTextBlockFormat();
-        self.transitionBlock.setLeftMargin(0)
-        self.transitionBlock.setRightMargin(0)
-        self.transitionBlock.setAlignment(Qt.AlignRight)
+    def setFormats(self):
+        # Formats, font metrics, style sheet and icons are built once and
+        # shared by every window, see FormatRegistry
+        self.registry = formatRegistry()
+        self.monoCharSize = self.registry.monoCharSize
+        # (block format, char format) of every element
+        self.elementFormats = self.registry.elementFormats
         
     def changeStyle(self):
         if (self.currFormatState == FormatState.Action):
@@ -811,158 +1281,73 @@ class Main(QMainWindow):
             self.changeFormatTo(FormatState.Action, True)
         
     def formatAction(self, changeCursor):
-        # Setup
-        toSetReturnPosition = changeCursor.position()
-        
-        # Line format
-        #self.capitalizeFirst(changeCursor)
-        changeCursor.select(QTextCursor.BlockUnderCursor)
-        changeCursor.setCharFormat(self.actionFormat)
-                
-        # Return cursor to it's original position
-        changeCursor.setPosition(toSetReturnPosition)
-                
-        # Apply the changes
-        changeCursor.setBlockFormat(self.actionBlock)
-        self.scriptEdit.setTextCursor(changeCursor)
-                
-        # Track state
-        self.prevFormatState = self.currFormatState
-        self.currFormatState = FormatState.Action
-        self.setChecked(self.currFormatState)
+        self.applyFormat(changeCursor, FormatState.Action)
+        self.showFormat(changeCursor, FormatState.Action)
         
     def formatCharacter(self, changeCursor):
-        # Setup
-        toSetReturnPosition = changeCursor.position()
-        
-        # Line format
-        changeCursor.select(QTextCursor.BlockUnderCursor)
-        changeCursor.setCharFormat(self.characterFormat)
-        
-        # Return cursor to it's original position
-        changeCursor.setPosition(toSetReturnPosition)
-        
-        # Apply the changes
-        changeCursor.setBlockFormat(self.characterBlock)
-        ##changeCursor.setBlockCharFormat(self.characterFormat)
-        self.scriptEdit.setTextCursor(changeCursor)
-        
-        # Track state
-        self.prevFormatState = self.currFormatState
-        self.currFormatState = FormatState.Character
-        self.setChecked(self.currFormatState)
+        self.applyFormat(changeCursor, FormatState.Character)
+        self.showFormat(changeCursor, FormatState.Character)
        
     def formatParanthesis(self, changeCursor):
-        # Setup
-        toSetReturnPosition = changeCursor.position()
-        
-        # Line format
-        changeCursor.select(QTextCursor.BlockUnderCursor)
-        changeCursor.setCharFormat(self.paranthesisFormat)
-        
-        # Return cursor to it's original position
-        changeCursor.setPosition(toSetReturnPosition)
-        
-        # Apply the changes
-        changeCursor.setBlockFormat(self.paranthesisBlock)
-        self.scriptEdit.setTextCursor(changeCursor)
-                
-        # Track state
-        self.prevFormatState = self.currFormatState
-        self.currFormatState = FormatState.Paranthesis
-        self.setChecked(self.currFormatState)
+        self.applyFormat(changeCursor, FormatState.Paranthesis)
+        self.showFormat(changeCursor, FormatState.Paranthesis)
         
     def formatDialogue(self, changeCursor):
-        # Setup
-        toSetReturnPosition = changeCursor.position()
-        
-        # Line format
-        #self.capitalizeFirst(changeCursor)
-        changeCursor.select(QTextCursor.BlockUnderCursor)
-        changeCursor.setCharFormat(self.dialogueFormat)
-        
-        # Return cursor to it's original position
-        changeCursor.setPosition(toSetReturnPosition)
-                
-        # Apply the changes
-        changeCursor.setBlockFormat(self.dialogueBlock)
-        ##changeCursor.setBlockCharFormat(self.dialogueFormat)
-        self.scriptEdit.setTextCursor(changeCursor)
-                
-        # Track state
-        self.prevFormatState = self.currFormatState
-        self.currFormatState = FormatState.Dialogue
-        self.setChecked(self.currFormatState)
+        self.applyFormat(changeCursor, FormatState.Dialogue)
+        self.showFormat(changeCursor, FormatState.Dialogue)
         
     def formatHeading(self, changeCursor):
-        # Setup
-        toSetReturnPosition = changeCursor.position()
+        self.applyFormat(changeCursor, FormatState.Heading)
+        self.showFormat(changeCursor, FormatState.Heading)
         
-        # Line format
-        changeCursor.select(QTextCursor.BlockUnderCursor)
-        changeCursor.setCharFormat(self.headingFormat)
+    def formatTransition(self, changeCursor):
+        self.applyFormat(changeCursor, FormatState.Transition)
+        self.showFormat(changeCursor, FormatState.Transition)
         
-        # Return cursor to it's original position
-        changeCursor.setPosition(toSetReturnPosition)
-                
-        # Apply the changes
-        changeCursor.setBlockFormat(self.headingBlock)
-        self.scriptEdit.setTextCursor(changeCursor)
-                
-        # Track state
-        self.prevFormatState = self.currFormatState
-        self.currFormatState = FormatState.Heading
-        self.setChecked(self.currFormatState)
+    def applyFormat(self, changeCursor, newFormatState):
+        # Only changes the document, the view and toolbar are left to showFormat
+        blockFormat, charFormat = self.elementFormats[newFormatState]
         
-    def formatTransition(self, changeCursor):
         # Setup
         toSetReturnPosition = changeCursor.position()
         
+        # Tag the block with its element type
+        changeCursor.block().setUserState(newFormatState.value)
+        
         # Line format
         changeCursor.select(QTextCursor.BlockUnderCursor)
-        changeCursor.setCharFormat(self.transitionFormat)
-        
+        changeCursor.setCharFormat(charFormat)
+                
         # Return cursor to it's original position
         changeCursor.setPosition(toSetReturnPosition)
                 
-        # Apply changes
-        changeCursor.setBlockFormat(self.transitionBlock)
+        # Apply the changes
+        changeCursor.setBlockFormat(blockFormat)
+        
+    def showFormat(self, changeCursor, newFormatState):
         self.scriptEdit.setTextCursor(changeCursor)
                 
         # Track state
         self.prevFormatState = self.currFormatState
-        self.currFormatState = FormatState.Transition
+        self.currFormatState = newFormatState
         self.setChecked(self.currFormatState)
         
     # ----- FORMAT HELPERS -----
     def changeFormatTo(self, newFormatState, newLine = False):
         # Get cursor
         toSet = self.scriptEdit.textCursor()
-        
-        # Start tracking undo
-        formatUndo = QUndoCommand()
-        formatUndo.setText("Changing preset format")
+        blockFormat, charFormat = self.elementFormats[newFormatState]
         
         #Disable format detection during format changing
         self.detectionEnabled = False
         
+        # The whole change is a single edit: one relayout and one undo step,
+        # no matter how many blocks are selected
+        toSet.beginEditBlock()
+        
         # Optional add new line
         if (newLine):
-            if (newFormatState == FormatState.Action):
-               toSet.insertBlock(self.actionBlock, self.actionFormat)
-            elif (newFormatState == FormatState.Character):
-               toSet.insertBlock(self.characterBlock, self.characterFormat)
-            elif (newFormatState == FormatState.Dialogue):
-               toSet.insertBlock(self.dialogueBlock, self.dialogueFormat)
-            elif (newFormatState == FormatState.Heading):
-               toSet.insertBlock(self.headingBlock, self.headingFormat)
-            elif (newFormatState == FormatState.Paranthesis):
-               toSet.insertBlock(self.paranthesisBlock, self.paranthesisFormat)
-            elif (newFormatState == FormatState.Transition):
-               toSet.insertBlock(self.transitionBlock, self.transitionFormat)
-                
-            self.scriptEdit.setTextCursor(toSet)
-            toSet = self.scriptEdit.textCursor()
+            toSet.insertBlock(blockFormat, charFormat)
         
         # Get/Init cursor position data
         self.cursorStartPosition = toSet.selectionStart()
@@ -986,55 +1371,38 @@ class Main(QMainWindow):
         # Check if we're changing on an empty line
         noSelectedText = False
         if (self.cursorStartPosition == self.cursorEndPosition):
-            toSet.select(QTextCursor.LineUnderCursor)
-            if (toSet.selectedText() == ""):
+            if (toSet.block().text() == ""):
                 noSelectedText = True
                     
         # Go through all selected blocks
         toSet.setPosition(self.cursorStartPosition)
         while (startingBlock <= endingBlock):
+            # Each block's own element type decides what needs undoing
+            oldFormatState = blockState(toSet.block())
             # Parantheses check
-            if (self.currFormatState == FormatState.Paranthesis and newFormatState != FormatState.Paranthesis):
+            if (oldFormatState == FormatState.Paranthesis and newFormatState != FormatState.Paranthesis):
                 self.changeParenthesis(toSet, False)
             # Colon check           
-            if (self.currFormatState == FormatState.Transition and newFormatState != FormatState.Transition):
+            if (oldFormatState == FormatState.Transition and newFormatState != FormatState.Transition):
                 self.changeColon(toSet, False)
                 
             # Empty Line check
-            toSet.select(QTextCursor.LineUnderCursor)
-            emptyLine = (toSet.selectedText() == "")
+            emptyLine = (toSet.block().text() == "")
             
             # Apply format
-            if (newFormatState == FormatState.Action):
-                if (emptyLine):
-                    toSet.setBlockCharFormat(self.actionFormat)
-                    self.scriptEdit.setTextCursor(toSet)
-                self.formatAction(toSet)
-            elif (newFormatState == FormatState.Character):
-                if (emptyLine):
-                    toSet.setBlockCharFormat(self.characterFormat)
-                    self.scriptEdit.setTextCursor(toSet)
-                self.formatCharacter(toSet)
-            elif (newFormatState == FormatState.Dialogue):
-                if (emptyLine):
-                    toSet.setBlockCharFormat(self.dialogueFormat)
-                    self.scriptEdit.setTextCursor(toSet)
-                self.formatDialogue(toSet)
-            elif (newFormatState == FormatState.Heading):
-                if (emptyLine):
-                    toSet.setBlockCharFormat(self.headingFormat)
-                    self.scriptEdit.setTextCursor(toSet)
-                self.formatHeading(toSet)
-            elif (newFormatState == FormatState.Paranthesis):
+            if (newFormatState == FormatState.Paranthesis):
                 self.changeParenthesis(toSet, True)
-                self.formatParanthesis(toSet)
             elif (newFormatState == FormatState.Transition):
                 self.changeColon(toSet, True)
-                self.formatTransition(toSet)
+            elif (emptyLine):
+                toSet.setBlockCharFormat(charFormat)
+            self.applyFormat(toSet, newFormatState)
             
             startingBlock += 1
             toSet.movePosition(QTextCursor.NextBlock)
             
+        toSet.endEditBlock()
+            
         # Set cursor positions
         if (self.cursorStartPosition == self.cursorEndPosition):
             self.cursorStartPosition += self.newCharactersBehindStart
@@ -1047,8 +1415,8 @@ class Main(QMainWindow):
             self.cursorEndPosition += self.newCharactersBehindEnd
             toSet.setPosition(self.cursorEndPosition, QTextCursor.KeepAnchor)
             
-        # Apply changes
-        self.scriptEdit.setTextCursor(toSet)
+        # Apply changes, the view and toolbar are only updated once
+        self.showFormat(toSet, newFormatState)
             
         #Disable format detection during format changing
         self.detectionEnabled = True
@@ -1139,48 +1507,13 @@ class Main(QMainWindow):
         toCap.clearSelection()
             
     def detectFormat(self):
-        # Get cursor
-        toDetect = self.scriptEdit.textCursor()
-        blockFormat = toDetect.charFormat()
-        detectedType = 0
+        detectedType = FormatState.NoState
         
         if (self.detectionEnabled):
-            # Get object to compare
-            toCompare = QTextCharFormat();
-            toCompare.setFontFamily(toDetect.charFormat().fontFamily())
-            toCompare.setFontPointSize(toDetect.charFormat().fontPointSize())
-            toCompare.setFontCapitalization(toDetect.charFormat().fontCapitalization())
-            toCompare.setFontItalic(toDetect.charFormat().fontItalic())
-            toCompare.setFontUnderline(toDetect.charFormat().fontUnderline())
-            toCompare.setFontLetterSpacing(toDetect.charFormat().fontLetterSpacing())
-        
-            if (toCompare == self.actionFormat):
-                self.setChecked(FormatState.Action)
-                detectedType = FormatState.Action
-            elif (toCompare == self.characterFormat):
-                self.setChecked(FormatState.Character)
-                detectedType = FormatState.Character
-            elif (toCompare == self.dialogueFormat):
-                self.setChecked(FormatState.Dialogue)
-                detectedType = FormatState.Dialogue
-            elif (toCompare == self.paranthesisFormat):
-                self.setChecked(FormatState.Paranthesis)
-                detectedType = FormatState.Paranthesis
-            elif (toCompare == self.headingFormat):
-                self.setChecked(FormatState.Heading)
-                detectedType = FormatState.Heading
-            elif (toCompare == self.transitionFormat):
-                self.setChecked(FormatState.Transition)
-                detectedType = FormatState.Transition
-            else:
-                detectedType = 7
-                ## if no format is detected, force previous format
-                ##if (self.autoFormatOnLineChange):
-                ##self.changeFormatTo(self.currFormatState)
-                ## if (toDetect.position() == 0):
-                ##    print(toDetect.position())
-            
-            if (detectedType != 7):
+            # Every block is tagged with its element type, a single lookup is enough
+            detectedType = blockState(self.scriptEdit.textCursor().block())
+            if (detectedType != FormatState.NoState and detectedType != self.currFormatState):
+                self.setChecked(detectedType)
                 self.currFormatState = detectedType
             
         return detectedType
@@ -1217,16 +1550,6 @@ class Main(QMainWindow):
             self.formatAction(toStart)
             self.setChecked(FormatState.Action)
 
-# Ease of tracking/comparing states
-class FormatState(Enum):
-    Action = 0
-    Character = 1
-    Dialogue = 2
-    Paranthesis = 3
-    Heading = 4
-    Transition = 5
-    NoState = 6
-   
 # Modifying the QTextEdit implementation in order to allow autocompletion
 class CompletionTextEdit(QTextEdit):
     def __init__(self, parent=None):
@@ -1235,10 +1558,10 @@ class CompletionTextEdit(QTextEdit):
 
     def setCompleter(self, completer):
         if self.completer is not None:
-            self.completer.activated.disconnect()
+            self.completer.activated[str].disconnect(self.insertCompletion)
             
+        # (the completion mode is left to the completer, see CharacterCompleter)
         completer.setWidget(self)
-        completer.setCompletionMode(QCompleter.PopupCompletion)
         completer.setCaseSensitivity(QtCore.Qt.CaseInsensitive)
         completer.activated.connect(self.insertCompletion)
         self.completer = completer
@@ -1279,6 +1602,16 @@ class CompletionTextEdit(QTextEdit):
             return
                   
     def keyPressEvent(self, event):    
+        # Undo/redo go through the window's undo stack, the document
+        # keeps no history of its own (see writerUndo)
+        if (event.matches(QKeySequence.Undo)):
+            self.parent().parent().undoStack.undo()
+            return
+        if (event.matches(QKeySequence.Redo) or
+            (event.key() == QtCore.Qt.Key_Y and event.modifiers() == QtCore.Qt.ControlModifier)):
+            self.parent().parent().undoStack.redo()
+            return
+            
         if self.completer and self.completer.popup().isVisible():
             if event.key() in (
             QtCore.Qt.Key_Enter,
@@ -1339,7 +1672,79 @@ class CompletionTextEdit(QTextEdit):
             + self.completer.popup().verticalScrollBar().sizeHint().width())
         self.completer.complete(cr) ## pop it up!
         
+# Reports how long each stage of a launch took, ending at the first paint
+class StartupTimer(QObject):
+    def __init__(self, parent=None):
+        super(StartupTimer, self).__init__(parent)
+        self.marks = [("dependency check", STARTUP_START, DEPENDENCIES_DONE),
+                      ("imports", DEPENDENCIES_DONE, IMPORTS_DONE)]
+        self.lastMark = IMPORTS_DONE
+        self.painted = False
+        
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.marks.append((stage, self.lastMark, now))
+        self.lastMark = now
+        
+    def watchFirstPaint(self, widget):
+        self.paintWidget = widget
+        widget.installEventFilter(self)
+        
+    def eventFilter(self, watched, event):
+        if (event.type() == QEvent.Paint and not self.painted):
+            self.painted = True
+            self.mark("first paint")
+            watched.removeEventFilter(self)
+            self.report()
+        return False
+        
+    def report(self):
+        lines = ["Startup timing (ms):"]
+        for stage, start, end in self.marks:
+            lines.append("  {:<18}{:>9.1f}".format(stage, (end - start) * 1000))
+        lines.append("  {:<18}{:>9.1f}".format("total", (self.lastMark - STARTUP_START) * 1000))
+        print("\n".join(lines), file=sys.stderr)
+
+def startupTimingEnabled():
+    return ('--startup-timing' in sys.argv) or bool(os.environ.get("WRITER_STARTUP_TIMING"))
+
+def latencyEnabled():
+    return ('--latency' in sys.argv) or bool(os.environ.get("WRITER_LATENCY"))
+
+def latencyTraceFile():
+    # --latency-trace FILE, the trace is written when Writer quits
+    if ('--latency-trace' in sys.argv[:-1]):
+        return sys.argv[sys.argv.index('--latency-trace') + 1]
+    return os.environ.get("WRITER_LATENCY_TRACE", "")
+
+# Handlers timed by --latency: key events, formatting, the completer, the
+# document indexes and the journal, saving and loading
+LATENCY_PROBES = [
+    (CompletionTextEdit, ("keyPressEvent", "keyReleaseEvent", "insertCompletion")),
+    (Main, ("detectFormat", "changeFormatTo", "changeStyle", "customNewLineStyle",
+            "addCharacterName", "refreshCharacters", "showCurrentScene", "refreshScenes",
+            "showCurrentPage", "showStatistics", "openFile", "importFile", "writeFile", "fileSaved")),
+    (CharacterCompleter, ("setCompletionPrefix", "updateNames")),
+    (BlockTracker, ("contentsChanged",)),
+    (PageIndex, ("update",)),
+    (UndoRecorder, ("contentsChanged",)),
+    (ScriptJournal, ("contentsChange", "flush")),
+    (LazyLoader, ("loadChunk",)),
+    (SaveTask, ("run",)),
+    (SnapshotTask, ("run",)),
+]
+
 def main():
+    timer = None
+    if (startupTimingEnabled()):
+        timer = StartupTimer()
+    # Instrumented before the window connects its handlers
+    latency = None
+    if (latencyEnabled()):
+        latency = LatencyRecorder()
+        for cls, names in LATENCY_PROBES:
+            latency.instrument(cls, names)
+    
     app = QApplication(sys.argv)
     
     global DPI_MULT
@@ -1349,11 +1754,25 @@ def main():
     f = app.font();
     f.setPointSizeF(8 * DPI_MULT);
     app.setFont(f);
+    if (timer):
+        timer.mark("QApplication")
     
     #app.setAttribute(Qt.AA_EnableHighDpiScaling)
     main = Main()
+    if (timer):
+        timer.mark("Main.__init__")
+        timer.watchFirstPaint(main.scriptEdit.viewport())
+    if (latency):
+        latency.watchEditor(main.scriptEdit)
+        main.latencyOverlay = LatencyOverlay(latency, main.scriptEdit)
     main.show()
-    sys.exit(app.exec_())
+    status = app.exec_()
+    if (latency):
+        print(latency.report(), file=sys.stderr)
+        traceFile = latencyTraceFile()
+        if (traceFile):
+            print(str(latency.writeTrace(traceFile)) + " trace events written to " + traceFile, file=sys.stderr)
+    sys.exit(status)
  
 if __name__ == "__main__":
     main()
@@ -0,0 +1,603 @@
+import sys
+import os
+import time
+import random
+import json
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+# Benchmarks run without a display
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtCore import Qt, QT_VERSION_STR
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtGui import QFont, QTextCursor, QTextDocument
+from PyQt5.QtPrintSupport import QPrinter
+from PyQt5.QtTest import QTest
+
+import writer
+import writterSettings
+from writerFormats import (BASE_DPI, FormatState, FormatRegistry)
+from writerFile import documentHtml, serializeNative, loadNative, loadScript, insertRecords
+from writerFountain import fountainRecords, loadFountain, readFountain
+from writerExport import documentBlocks, writeFountain, writeFdx
+from writerJournal import snapshotEntry
+from writerRevisions import RevisionStore, documentLines
+from writerIndex import StatisticsIndex
+from writerPages import elementLines, paginate
+
+ACTION_LINE = "The rain hammers the windows while the detective studies the map again."
+
+### SYNTHETIC SCRIPTS START ###
+
+WORDS = ("the door window light rain street car night morning coffee table phone "
+         "letter money gun knife city river bridge train station office kitchen "
+         "looks waits runs opens closes turns stops smiles laughs whispers falls "
+         "slowly quietly again never always maybe tonight tomorrow yesterday").split()
+NAMES = ["ALEX", "CHARLIE", "FRANKIE", "JESSIE", "MORGAN", "SAM", "RILEY", "JORDAN"]
+PLACES = ["KITCHEN", "OFFICE", "STREET", "CAR", "ROOFTOP", "TRAIN STATION", "BAR", "APARTMENT"]
+TIMES = ["DAY", "NIGHT", "MORNING", "LATER", "CONTINUOUS"]
+PARENTHETICALS = ["(beat)", "(quietly)", "(laughing)", "(to Sam)", "(beat, then)"]
+
+def sentence(rng, low, high):
+    words = [rng.choice(WORDS) for i in range(rng.randint(low, high))]
+    return words[0].capitalize() + " " + " ".join(words[1:]) + rng.choice(".!?.")
+
+def syntheticScript(scenes, seed=1):
+    # (FormatState, text) records with a realistic element mix, the same every run
+    rng = random.Random(seed)
+    records = []
+    for scene in range(scenes):
+        records.append((FormatState.Heading, rng.choice(("INT. ", "EXT. ")) +
+                        rng.choice(PLACES) + " - " + rng.choice(TIMES)))
+        for paragraph in range(rng.randint(1, 3)):
+            records.append((FormatState.Action, " ".join(sentence(rng, 5, 14) for i in range(rng.randint(1, 4)))))
+            for speech in range(rng.randint(1, 4)):
+                records.append((FormatState.Character, rng.choice(NAMES)))
+                if (rng.random() < 0.2):
+                    records.append((FormatState.Paranthesis, rng.choice(PARENTHETICALS)))
+                records.append((FormatState.Dialogue, " ".join(sentence(rng, 3, 12) for i in range(rng.randint(1, 3)))))
+        if (rng.random() < 0.15):
+            records.append((FormatState.Transition, "CUT TO:"))
+    return records
+
+def fillElements(document, records, formats):
+    # Replaces the document with the records, in one edit
+    document.clear()
+    cursor = QTextCursor(document)
+    cursor.beginEditBlock()
+    insertRecords(cursor, ([state.value, text] for state, text in records), formats, first=True)
+    cursor.endEditBlock()
+
+def fountainLines(records):
+    # The records as Fountain, dialogue and parentheticals under their character
+    for state, text in records:
+        if (state not in (FormatState.Dialogue, FormatState.Paranthesis)):
+            yield "\n"
+        yield text + "\n"
+
+def pageCount(records):
+    return sum(1 for page in paginate([(state, elementLines(state, text)) for state, text in records]))
+
+def scriptForPages(pages):
+    # Synthetic script that prints on (about) that many pages
+    scenes = max(round(pages * 4 / 3), 1)
+    for attempt in range(8):
+        records = syntheticScript(scenes)
+        count = pageCount(records)
+        if (count == pages):
+            break
+        guess = round(scenes * pages / max(count, 1))
+        if (guess == scenes):
+            guess += 1 if (count < pages) else -1
+        scenes = max(guess, 1)
+    return records
+
+### SYNTHETIC SCRIPTS END ###
+
+def fillScript(main, blocks):
+    # Plain action lines, inserted in one go so setup time stays out of the numbers
+    blockFormat, charFormat = main.elementFormats[FormatState.Action]
+    cursor = QTextCursor(main.scriptEdit.document())
+    cursor.beginEditBlock()
+    cursor.select(QTextCursor.Document)
+    cursor.removeSelectedText()
+    for i in range(blocks):
+        if (i > 0):
+            cursor.insertBlock(blockFormat, charFormat)
+        cursor.insertText(ACTION_LINE, charFormat)
+        cursor.block().setUserState(FormatState.Action.value)
+    cursor.endEditBlock()
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return (time.perf_counter() - start) * 1000, result
+
+def benchReformat(main, args):
+    # Time changeFormatTo over a selection of the whole script
+    print("changeFormatTo on a full selection")
+    print("{:>8} {:>12} {:>12} {:>11}".format("blocks", "total ms", "us/block", "undo steps"))
+    for size in args.sizes:
+        fillScript(main, size)
+        cursor = main.scriptEdit.textCursor()
+        cursor.select(QTextCursor.Document)
+        main.scriptEdit.setTextCursor(cursor)
+        # Steps on the window's undo stack (see writerUndo)
+        main.undoRecorder.reset()
+
+        start = time.perf_counter()
+        main.changeFormatTo(FormatState.Dialogue)
+        QApplication.processEvents()
+        elapsed = time.perf_counter() - start
+
+        print("{:>8} {:>12.1f} {:>12.1f} {:>11}".format(size, elapsed * 1000,
+              elapsed * 1e6 / size, main.undoStack.count()))
+
+def benchFileFormat(main, args):
+    # Legacy html against the native block format, same synthetic scripts
+    print("file formats (html = legacy QTextEdit.toHtml, native = writerFile)")
+    print("{:>7} {:>7} {:>10} {:>10} {:>9} {:>9} {:>9} {:>9}".format("scenes", "blocks",
+          "html KB", "native KB", "html ms", "nat. ms", "html ms", "nat. ms"))
+    print("{:>7} {:>7} {:>10} {:>10} {:>19} {:>19}".format("", "", "", "", "save", "load"))
+    for scenes in args.scenes:
+        document = main.scriptEdit.document()
+        fillElements(document, syntheticScript(scenes), main.elementFormats)
+
+        htmlSave, html = timed(documentHtml, document)
+        nativeSave, native = timed(serializeNative, document, main.elementFormats)
+
+        target = QTextDocument()
+        htmlLoad, ignore = timed(loadScript, html, target)
+        target = QTextDocument()
+        nativeLoad, ignore = timed(loadNative, native.splitlines(), target, main.elementFormats)
+
+        print("{:>7} {:>7} {:>10.1f} {:>10.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+              scenes, document.blockCount(), len(html.encode("utf-8")) / 1024,
+              len(native.encode("utf-8")) / 1024, htmlSave, nativeSave, htmlLoad, nativeLoad))
+
+def benchPaginate(main, args):
+    # Full pagination, then one keystroke's worth of repagination mid-script
+    print("page breaks (full = whole script, edit = after typing in the middle)")
+    print("{:>7} {:>7} {:>7} {:>10} {:>10}".format("scenes", "blocks", "pages", "full ms", "edit ms"))
+    for scenes in args.scenes:
+        document = main.scriptEdit.document()
+        fillElements(document, syntheticScript(scenes), main.elementFormats)
+        main.pageIndex.dirtyFrom = 0
+        main.pageIndex.pages = []
+        full, pages = timed(main.pageIndex.update)
+
+        cursor = QTextCursor(document.findBlockByNumber(document.blockCount() // 2))
+        cursor.insertText("Another few words. ")
+        edit, pages = timed(main.pageIndex.update)
+
+        print("{:>7} {:>7} {:>7} {:>10.1f} {:>10.2f}".format(
+              scenes, document.blockCount(), len(pages), full, edit))
+
+def benchFountain(main, args):
+    # Import throughput: classification alone, then into a document
+    print("fountain import (parse = classification only, load = into a document)")
+    print("{:>7} {:>8} {:>9} {:>10} {:>10} {:>10}".format("MB", "blocks", "parse ms", "parse MB/s",
+          "load ms", "load MB/s"))
+    for megabytes in args.megabytes:
+        lines = []
+        size = 0
+        seed = 1
+        while size < megabytes * 1024 * 1024:
+            for line in fountainLines(syntheticScript(100, seed)):
+                lines.append(line)
+                size += len(line.encode("utf-8"))
+            seed += 1
+        size /= 1024 * 1024
+
+        parse, records = timed(lambda: sum(1 for record in fountainRecords(lines)))
+        target = QTextDocument()
+        load, ignore = timed(loadFountain, lines, target, main.elementFormats)
+        print("{:>7.1f} {:>8} {:>9.1f} {:>10.1f} {:>10.1f} {:>10.1f}".format(size, target.blockCount(),
+              parse, size / parse * 1000, load, size / load * 1000))
+
+# Blocks an export has to force or mark: look-alike elements, dialogue
+# without a character, emphasis in italic and bold elements, literal markers
+EXPORT_CASES = [
+    [FormatState.Action.value, "INT. not a heading really"],
+    [FormatState.Dialogue.value, "I said no really", [[7, 2, {"w": QFont.Bold}], [10, 6, {"u": 1}]]],
+    [FormatState.Action.value, "The door, both ways", [[4, 4, {"i": 0}], [10, 4, {"w": QFont.Bold, "i": 0}]]],
+    [FormatState.Paranthesis.value, "(beat)", [[1, 4, {"i": 0}]]],
+    [FormatState.Character.value, "SAM"],
+    [FormatState.Action.value, "SAM LEAVES"],
+    [FormatState.Heading.value, "INT. HOUSE - DAY", [[0, 4, {"u": 0}], [5, 5, {"w": QFont.Normal}]]],
+    [FormatState.Action.value, "Stars * and _ marks, cut to:"],
+    [FormatState.Transition.value, "Smash cut"],
+]
+
+def blockStyles(document, formats):
+    # (element, text, style of every character) of every block, however the
+    # styled text is split into pieces
+    return [(state, text, [style for piece, *style in pieces for character in piece])
+            for state, text, pieces in documentBlocks(document, formats)]
+
+def roundTrip(expected, document, formats):
+    # Blocks that don't read back as they were written. Fountain has no
+    # dialogue without a character, that reads back as action
+    actual = blockStyles(document, formats)
+    differences = abs(len(expected) - len(actual))
+    previous = None
+    for (state, text, styles), read in zip(expected, actual):
+        if (state in (FormatState.Dialogue, FormatState.Paranthesis) and
+            previous not in (FormatState.Character, FormatState.Dialogue, FormatState.Paranthesis)):
+            previous = state
+            state = FormatState.Action
+        else:
+            previous = state
+        if ((state, text, styles) != read):
+            differences += 1
+    return differences
+
+def benchExport(main, args):
+    # Streaming exports, and the Fountain export read back in
+    print("export (round trip = fountain blocks that read back differently)")
+    print("{:>7} {:>7} {:>12} {:>9} {:>11}".format("scenes", "blocks", "fountain ms", "fdx ms", "round trip"))
+    document = main.scriptEdit.document()
+    failed = 0
+    with tempfile.TemporaryDirectory() as folder:
+        fountain = os.path.join(folder, "bench.fountain")
+        fdx = os.path.join(folder, "bench.fdx")
+        for scenes in args.scenes:
+            records = [[state.value, text] for state, text in syntheticScript(scenes)] + EXPORT_CASES
+            document.clear()
+            cursor = QTextCursor(document)
+            cursor.beginEditBlock()
+            insertRecords(cursor, records, main.elementFormats, first=True)
+            cursor.endEditBlock()
+            fountainTime, ignore = timed(writeFountain, document, fountain, main.elementFormats)
+            fdxTime, ignore = timed(writeFdx, document, fdx, main.elementFormats)
+
+            target = QTextDocument()
+            readFountain(fountain, target, main.elementFormats)
+            differences = roundTrip(blockStyles(document, main.elementFormats), target, main.elementFormats)
+            failed += differences
+            print("{:>7} {:>7} {:>12.1f} {:>9.1f} {:>11}".format(scenes, document.blockCount(),
+                  fountainTime, fdxTime, differences))
+    return 1 if failed else 0
+
+def benchJournal(main, args):
+    # Writing one keystroke's journal entry (next to what the keystroke costs
+    # the editor) and compacting the journal into one snapshot entry
+    print("crash journal (keystroke = one character typed, then its entry written)")
+    print("{:>7} {:>7} {:>10} {:>10} {:>12} {:>12}".format("scenes", "blocks", "edit us",
+          "entry us", "bytes/entry", "compact ms"))
+    document = main.scriptEdit.document()
+    keystrokes = 500
+    with tempfile.TemporaryDirectory() as folder:
+        filename = os.path.join(folder, "bench.writer")
+        for scenes in args.scenes:
+            fillElements(document, syntheticScript(scenes), main.elementFormats)
+            with open(filename, "wt", encoding="utf-8") as file:
+                file.write(serializeNative(document, main.elementFormats))
+            document.setModified(False)
+            main.journal.start(filename)
+
+            rng = random.Random(1)
+            size = main.journal.size
+            edit = 0
+            entry = 0
+            for i in range(keystrokes):
+                block = document.findBlockByNumber(rng.randrange(document.blockCount()))
+                start = time.perf_counter()
+                QTextCursor(block).insertText("x")
+                middle = time.perf_counter()
+                main.journal.flush()
+                edit += middle - start
+                entry += time.perf_counter() - middle
+            entryBytes = (main.journal.size - size) / keystrokes
+            compact, ignore = timed(snapshotEntry, document, main.elementFormats)
+            main.journal.close()
+
+            print("{:>7} {:>7} {:>10.1f} {:>10.1f} {:>12.0f} {:>12.1f}".format(scenes,
+                  document.blockCount(), edit * 1e6 / keystrokes, entry * 1e6 / keystrokes,
+                  entryBytes, compact))
+
+def benchRevisions(main, args):
+    # Drafts stored as deltas: size of the store against one draft stored
+    # whole, time to store a draft and to restore the slowest one
+    print("revision store (20 drafts, a few edits apart)")
+    print("{:>7} {:>7} {:>10} {:>11} {:>10} {:>11}".format("scenes", "blocks", "draft KB",
+          "store KB", "store ms", "restore ms"))
+    document = main.scriptEdit.document()
+    drafts = 20
+    with tempfile.TemporaryDirectory() as folder:
+        for scenes in args.scenes:
+            fillElements(document, syntheticScript(scenes), main.elementFormats)
+            store = RevisionStore(os.path.join(folder, str(scenes) + ".revisions"))
+            rng = random.Random(1)
+            storing = 0
+            for draft in range(drafts):
+                for edit in range(10):
+                    block = document.findBlockByNumber(rng.randrange(document.blockCount()))
+                    QTextCursor(block).insertText("Another few words. ")
+                elapsed, header = timed(store.add, documentLines(document, main.elementFormats))
+                storing += elapsed
+            whole = len(serializeNative(document, main.elementFormats).encode("utf-8"))
+            restore, ignore = timed(RevisionStore(store.path).lines, drafts)
+            print("{:>7} {:>7} {:>10.1f} {:>11.1f} {:>10.1f} {:>11.1f}".format(scenes,
+                  document.blockCount(), whole / 1024, os.path.getsize(store.path) / 1024,
+                  storing / drafts, restore))
+
+def benchStatistics(main, args):
+    # What a keystroke costs the status bar statistics (the time spent in the
+    # window's StatisticsIndex) against counting the whole script again
+    print("status bar statistics (keystroke = one character typed)")
+    print("{:>7} {:>7} {:>10} {:>14}".format("scenes", "blocks", "update us", "full count ms"))
+    document = main.scriptEdit.document()
+    statistics = main.statisticsIndex
+    keystrokes = 500
+    spent = [0.0]
+    def timedMethod(method):
+        def wrapper(*args):
+            start = time.perf_counter()
+            method(*args)
+            spent[0] += time.perf_counter() - start
+        return wrapper
+    statistics.blockChanged = timedMethod(statistics.blockChanged)
+    statistics.flush = timedMethod(statistics.flush)
+    for scenes in args.scenes:
+        fillElements(document, syntheticScript(scenes), main.elementFormats)
+        rng = random.Random(1)
+        spent[0] = 0.0
+        for i in range(keystrokes):
+            block = document.findBlockByNumber(rng.randrange(document.blockCount()))
+            QTextCursor(block).insertText("x")
+        # A new index counts every block, as a rescan on each change would
+        full, ignore = timed(main.blockTracker.addIndex, StatisticsIndex())
+        main.blockTracker.indexes.pop()
+        print("{:>7} {:>7} {:>10.1f} {:>14.1f}".format(scenes, document.blockCount(),
+              spent[0] * 1e6 / keystrokes, full))
+    del statistics.blockChanged
+    del statistics.flush
+
+def benchWindows(main, args):
+    # File > New: building and showing another window, next to what building
+    # the shared formats, metrics and icons once costs (see FormatRegistry)
+    print("new windows (registry = the formats and icons every window shares)")
+    print("{:>8} {:>12} {:>11} {:>11}".format("windows", "registry ms", "median ms", "max ms"))
+    registry, ignore = timed(FormatRegistry, writterSettings)
+    times = []
+    windows = []
+    for i in range(args.windows):
+        start = time.perf_counter()
+        window = writer.Main(main)
+        window.show()
+        QApplication.processEvents()
+        times.append((time.perf_counter() - start) * 1000)
+        windows.append(window)
+    print("{:>8} {:>12.2f} {:>11.1f} {:>11.1f}".format(len(times), registry,
+          statistics.median(times), max(times)))
+    for window in windows:
+        window.close()
+        window.deleteLater()
+    QApplication.processEvents()
+
+### SUITE START ###
+
+# writerBench.py suite: the editor's everyday operations on feature length
+# scripts, every run appended to a history file. A time well over what the
+# last runs on the same machine took is a regression, and makes the run fail
+
+SUITE_HISTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench-history.jsonl")
+# Typed into the middle of the script by the typing session, Enter moves on
+# to the next element the way the editor picks it
+TYPING_SESSION = ["The detective crosses to the window and looks down at the street.",
+                  "SAM", "You said it would stop raining by now.", "It never does."]
+
+def sessionKeys():
+    # One Enter after every line of TYPING_SESSION, keys as (key, text)
+    keys = []
+    for line in TYPING_SESSION:
+        keys.extend((None, character) for character in line)
+        keys.append((Qt.Key_Return, ""))
+    return keys
+
+def suiteRun(main, filename):
+    # One pass over a saved script, {metric: ms}
+    results = {}
+    document = main.scriptEdit.document()
+    start = time.perf_counter()
+    main.openFile(filename)
+    results["open first ms"] = (time.perf_counter() - start) * 1000
+    main.finishLoading()
+    QApplication.processEvents()
+    results["open ms"] = (time.perf_counter() - start) * 1000
+
+    # detectFormat (and the scene and page lookups) as the cursor goes down the script
+    start = time.perf_counter()
+    block = document.firstBlock()
+    while block.isValid():
+        main.scriptEdit.setTextCursor(QTextCursor(block))
+        block = block.next()
+    results["cursor sweep us/block"] = (time.perf_counter() - start) * 1e6 / document.blockCount()
+
+    # Typing in the middle, the timers the keys start are let run every line
+    cursor = QTextCursor(document.findBlockByNumber(document.blockCount() // 2))
+    cursor.movePosition(QTextCursor.EndOfBlock)
+    main.scriptEdit.setTextCursor(cursor)
+    main.changeFormatTo(FormatState.Action)
+    keys = []
+    for key, text in sessionKeys():
+        start = time.perf_counter()
+        if (key is None):
+            QTest.keyClicks(main.scriptEdit, text)
+        else:
+            QTest.keyClick(main.scriptEdit, key)
+            QApplication.processEvents()
+        keys.append(time.perf_counter() - start)
+    keys.sort()
+    results["typing ms/key"] = sum(keys) * 1000 / len(keys)
+    results["typing p95 ms"] = keys[int(len(keys) * 0.95)] * 1000
+
+    results["insertHeader ms"], ignore = timed(main.insertHeader)
+
+    with tempfile.TemporaryDirectory() as folder:
+        printer = QPrinter()
+        printer.setOutputFormat(QPrinter.PdfFormat)
+        printer.setOutputFileName(os.path.join(folder, "bench.pdf"))
+        printer.setResolution(BASE_DPI)
+        results["print pdf ms"], ignore = timed(main.printScript, printer)
+
+    # Saving as far as the file being written, the worker included
+    main.filename = filename
+    start = time.perf_counter()
+    main.writeFile()
+    main.saver.wait()
+    QApplication.processEvents()
+    results["save ms"] = (time.perf_counter() - start) * 1000
+
+    cursor = main.scriptEdit.textCursor()
+    cursor.select(QTextCursor.Document)
+    main.scriptEdit.setTextCursor(cursor)
+    results["reformat all ms"], ignore = timed(main.changeFormatTo, FormatState.Dialogue)
+    QApplication.processEvents()
+    main.journal.close()
+    return results
+
+def gitCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+def readHistory(path):
+    runs = []
+    if (os.path.exists(path)):
+        with open(path, "rt", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    runs.append(json.loads(line))
+                except ValueError:
+                    pass
+    return runs
+
+def baselines(runs, host, count):
+    # Median of every metric over the last runs on this machine that passed
+    # (or were accepted)
+    values = {}
+    for run in [run for run in runs if run.get("host") == host and not run.get("regressions")][-count:]:
+        for metric, value in run["results"].items():
+            values.setdefault(metric, []).append(value)
+    return {metric: statistics.median(found) for metric, found in values.items()}
+
+def benchSuite(main, args):
+    print("suite: best of " + str(args.repeat) + " runs, against the median of the last " +
+          str(args.baseline) + " runs on this machine")
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for pages in args.pages:
+            records = scriptForPages(pages)
+            filename = os.path.join(folder, str(pages) + ".writer")
+            for run in range(args.repeat):
+                # Every run starts from the same file
+                fillElements(main.scriptEdit.document(), records, main.elementFormats)
+                with open(filename, "wt", encoding="utf-8") as file:
+                    file.write(serializeNative(main.scriptEdit.document(), main.elementFormats))
+                for metric, value in suiteRun(main, filename).items():
+                    key = str(pages) + " pages " + metric
+                    results[key] = round(min(results.get(key, value), value), 3)
+        main.filename = ""
+
+    host = platform.node()
+    runs = readHistory(args.history)
+    previous = baselines(runs, host, args.baseline)
+    regressions = []
+    print("{:<40} {:>10} {:>10} {:>8}".format("", "now", "baseline", "change"))
+    for metric, value in results.items():
+        baseline = previous.get(metric)
+        line = "{:<40} {:>10.2f}".format(metric, value)
+        if (baseline):
+            change = value / baseline - 1
+            line += " {:>10.2f} {:>+7.0%}".format(baseline, change)
+            # Small absolute differences are noise, however big they are relatively
+            if (change > args.threshold and value - baseline > args.floor):
+                regressions.append(metric)
+                line += "  REGRESSION"
+        print(line)
+
+    run = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": gitCommit(), "host": host,
+           "python": platform.python_version(), "qt": QT_VERSION_STR, "results": results,
+           "regressions": [] if args.accept else regressions}
+    if (not args.no_record):
+        with open(args.history, "at", encoding="utf-8") as file:
+            file.write(json.dumps(run) + "\n")
+    if (regressions and not args.accept):
+        print("\n" + str(len(regressions)) + " REGRESSIONS over " + "{:.0%}".format(args.threshold) +
+              " (recorded, but not used as a baseline; --accept takes them as the new normal)")
+        return 1
+    return 0
+
+### SUITE END ###
+
+BENCHES = {"reformat": benchReformat, "fileformat": benchFileFormat, "paginate": benchPaginate,
+           "fountain": benchFountain, "export": benchExport, "journal": benchJournal,
+           "revisions": benchRevisions, "statistics": benchStatistics,
+           "windows": benchWindows, "suite": benchSuite}
+# Left out unless asked for, it takes about a minute
+SLOW_BENCHES = ["suite"]
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(prog="writerBench",
+        description="Offscreen benchmarks for the Writer editor.")
+    parser.add_argument("benches", nargs="*", default=[name for name in BENCHES if name not in SLOW_BENCHES],
+        help="benchmarks to run: " + ", ".join(BENCHES) + " (default: all but " + ", ".join(SLOW_BENCHES) + ")")
+    parser.add_argument("--sizes", default="250,500,1000,2000,4000",
+        help="comma separated selection sizes in blocks (reformat)")
+    parser.add_argument("--scenes", default="50,200,800",
+        help="comma separated script sizes in scenes (fileformat, paginate, export, journal, revisions, statistics)")
+    parser.add_argument("--megabytes", default="1,4",
+        help="comma separated script sizes in MB (fountain)")
+    parser.add_argument("--pages", default="10,120,500",
+        help="comma separated script sizes in pages (suite)")
+    parser.add_argument("--windows", type=int, default=20,
+        help="how many windows to open (windows)")
+    parser.add_argument("--repeat", type=int, default=3,
+        help="runs per script, the fastest counts (suite)")
+    parser.add_argument("--history", default=SUITE_HISTORY,
+        help="json lines file the suite's runs are added to (default: bench-history.jsonl)")
+    parser.add_argument("--baseline", type=int, default=5,
+        help="earlier runs a result is compared with (suite)")
+    parser.add_argument("--threshold", type=float, default=0.25,
+        help="slowdown against the baseline that fails the suite (default: 0.25)")
+    parser.add_argument("--floor", type=float, default=1.0,
+        help="smallest slowdown (ms or us) that counts as a regression (suite)")
+    parser.add_argument("--accept", action="store_true",
+        help="record this run as the new baseline even if it is slower (suite)")
+    parser.add_argument("--no-record", action="store_true",
+        help="compare without adding the run to the history (suite)")
+    args = parser.parse_args(argv)
+    for bench in args.benches:
+        if bench not in BENCHES:
+            parser.error("unknown benchmark '" + bench + "'")
+    args.sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    args.scenes = [int(scenes) for scenes in args.scenes.split(",") if scenes.strip()]
+    args.megabytes = [float(size) for size in args.megabytes.split(",") if size.strip()]
+    args.pages = [int(pages) for pages in args.pages.split(",") if pages.strip()]
+    return args
+
+def main(argv=None):
+    args = parseArgs(sys.argv[1:] if argv is None else argv)
+    app = QApplication(["writerBench"])
+    window = writer.Main()
+    window.show()
+    QApplication.processEvents()
+
+    status = 0
+    for bench in args.benches:
+        # Benches that can fail (suite, export) return 1
+        if (BENCHES[bench](window, args)):
+            status = 1
+        print()
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
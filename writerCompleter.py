@@ -0,0 +1,65 @@
+import heapq
+from bisect import bisect_left, insort
+
+from PyQt5.QtCore import (QStringListModel)
+from PyQt5.QtWidgets import (QCompleter)
+
+# Most suggestions shown in the popup
+MAX_SUGGESTIONS = 12
+# A name used just now counts as this many extra lines, fading with every other use
+RECENCY_WEIGHT = 25
+RECENCY_DECAY = 0.85
+
+class CharacterCompleter(QCompleter):
+    # One long-lived completer: names are kept sorted for prefix lookups
+    # (bisect), and the matches are ranked by how often and how recently
+    # they were used before they go into the popup's model
+    def __init__(self, parent=None):
+        self.suggestions = QStringListModel()
+        super(CharacterCompleter, self).__init__(self.suggestions, parent)
+        # The model only ever holds the ranked matches, Qt doesn't filter them again
+        self.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+
+        self.names = []         # sorted, upper case
+        self.counts = {}        # name -> lines in the script
+        self.castNames = set()  # names from the cast database
+        self.lastUsed = {}      # name -> use tick
+        self.tick = 0
+        self.activated[str].connect(self.markUsed)
+
+    def loadCastDatabase(self, filename):
+        # One name per line, shared between the scripts of a project
+        with open(filename, "rt", encoding="utf-8") as file:
+            self.castNames = set(line.strip().upper() for line in file if line.strip())
+        self.updateNames(self.counts)
+
+    def updateNames(self, counts):
+        # Only the names that came or went touch the sorted list
+        wanted = set(counts) | self.castNames
+        current = set(self.names)
+        for name in current - wanted:
+            del self.names[bisect_left(self.names, name)]
+        for name in wanted - current:
+            insort(self.names, name)
+        self.counts = dict(counts)
+
+    def markUsed(self, name):
+        self.tick += 1
+        self.lastUsed[name.upper()] = self.tick
+
+    def score(self, name):
+        score = self.counts.get(name, 0)
+        used = self.lastUsed.get(name)
+        if (used is not None):
+            score += RECENCY_WEIGHT * (RECENCY_DECAY ** (self.tick - used))
+        return score
+
+    def matches(self, prefix, limit=MAX_SUGGESTIONS):
+        key = prefix.upper()
+        start = bisect_left(self.names, key)
+        end = bisect_left(self.names, key + "\uffff", start)
+        return heapq.nlargest(limit, self.names[start:end], key=self.score)
+
+    def setCompletionPrefix(self, prefix):
+        self.suggestions.setStringList(self.matches(prefix))
+        QCompleter.setCompletionPrefix(self, prefix)
@@ -0,0 +1,178 @@
+import sys
+import os
+import time
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Headless: workers never open a window, so no display is needed
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtPrintSupport import QPrinter
+from PyQt5.QtGui import QTextDocument, QFont
+
+from writerFormats import BASE_DPI, blockState
+from writerFile import readScriptText, loadScript
+from writerPages import UPPERCASE_STATES, paginate, printPages, elementLines
+from writerFountain import FOUNTAIN_EXTENSIONS, readFountain
+from writerExport import writeFountain, writeFdx
+from writerReport import documentBreakdown, writeReportCsv, writeReportJson
+
+# Output formats and the extension of the file they produce, csv and json
+# being the production breakdown (see writerReport)
+OUTPUT_FORMATS = {"pdf": ".pdf", "txt": ".txt", "fountain": ".fountain", "fdx": ".fdx",
+                  "csv": ".breakdown.csv", "json": ".breakdown.json"}
+
+# Added to the name of an output that would otherwise replace its input
+CONVERTED_SUFFIX = ".converted"
+
+# One QApplication per worker process, created by initWorker
+workerApp = None
+
+def initWorker():
+    global workerApp
+    if QApplication.instance() is None:
+        workerApp = QApplication(["writerConvert"])
+
+def loadDocument(filename):
+    # Native block files and older html .writer files alike, or Fountain
+    document = QTextDocument()
+    document.setDefaultFont(QFont("Courier", 12))
+    if (filename.lower().endswith(FOUNTAIN_EXTENSIONS)):
+        readFountain(filename, document)
+    else:
+        loadScript(readScriptText(filename), document)
+    return document
+
+def documentElements(document):
+    # Yields (FormatState, displayed text) for every block in the document
+    block = document.firstBlock()
+    while block.isValid():
+        state = blockState(block)
+        text = block.text()
+        if (state in UPPERCASE_STATES):
+            text = text.upper()
+        yield state, text
+        block = block.next()
+
+def writePdf(document, outName):
+    printer = QPrinter()
+    printer.setOutputFormat(QPrinter.PdfFormat)
+    printer.setOutputFileName(outName)
+    printer.setResolution(BASE_DPI)
+    # Same page breaks (and MORE/CONT'D) as printing from the editor
+    elements = [(state, elementLines(state, text)) for state, text in documentElements(document)]
+    printPages(printer, list(paginate(elements)), elements)
+
+def writeText(document, outName):
+    with open(outName, "wt", encoding="utf-8") as file:
+        for state, text in documentElements(document):
+            file.write(text + "\n")
+
+def writeBreakdownCsv(document, outName):
+    writeReportCsv(documentBreakdown(document), outName)
+
+def writeBreakdownJson(document, outName):
+    writeReportJson(documentBreakdown(document), outName)
+
+# Fountain and Final Draft are streamed from the blocks, see writerExport
+WRITERS = {"pdf": writePdf, "txt": writeText, "fountain": writeFountain, "fdx": writeFdx,
+           "csv": writeBreakdownCsv, "json": writeBreakdownJson}
+
+def samePath(first, second):
+    return os.path.normcase(os.path.abspath(first)) == os.path.normcase(os.path.abspath(second))
+
+def convertFile(filename, formats, outputDir=None):
+    # Runs inside a worker, returns (filename, [outputs], seconds, error)
+    initWorker()
+    start = time.perf_counter()
+    outputs = []
+    try:
+        document = loadDocument(filename)
+        base = os.path.splitext(os.path.basename(filename))[0]
+        folder = outputDir if outputDir else os.path.dirname(os.path.abspath(filename))
+        for outFormat in formats:
+            outName = os.path.join(folder, base + OUTPUT_FORMATS[outFormat])
+            if (samePath(outName, filename)):
+                # Converting a script to its own format never overwrites
+                # it, the export leaves things out (e.g. Fountain notes)
+                outName = os.path.join(folder, base + CONVERTED_SUFFIX + OUTPUT_FORMATS[outFormat])
+            WRITERS[outFormat](document, outName)
+            outputs.append(outName)
+    except Exception as error:
+        return filename, outputs, time.perf_counter() - start, str(error)
+    return filename, outputs, time.perf_counter() - start, None
+
+def expandInputs(patterns):
+    # Files, globs (** included) and folders of .writer (and Fountain) files,
+    # without duplicates
+    found = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(name for name in glob.glob(os.path.join(pattern, "*"))
+                             if name.lower().endswith((".writer",) + FOUNTAIN_EXTENSIONS))
+        else:
+            matches = sorted(glob.glob(pattern, recursive=True)) or [pattern]
+        for match in matches:
+            if match not in found:
+                found.append(match)
+    return found
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(prog="writerConvert",
+        description="Convert .writer scripts without opening the editor.")
+    parser.add_argument("inputs", nargs="+", help=".writer or .fountain files, globs or folders")
+    parser.add_argument("-f", "--format", default="pdf",
+        help="comma separated output formats: " + ", ".join(OUTPUT_FORMATS) + " (default: pdf)")
+    parser.add_argument("-o", "--output-dir", default=None,
+        help="folder for the converted files (default: next to each input)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+        help="number of worker processes (default: one per cpu)")
+    args = parser.parse_args(argv)
+
+    args.formats = [f.strip().lower() for f in args.format.split(",") if f.strip()]
+    for outFormat in args.formats:
+        if outFormat not in OUTPUT_FORMATS:
+            parser.error("unknown format '" + outFormat + "'")
+    return args
+
+def reportFile(result):
+    filename, outputs, seconds, error = result
+    if error:
+        print("{:>9.1f} ms  {}  FAILED: {}".format(seconds * 1000, filename, error))
+    else:
+        print("{:>9.1f} ms  {} -> {}".format(seconds * 1000, filename,
+              ", ".join(os.path.basename(o) for o in outputs)))
+
+def main(argv=None):
+    args = parseArgs(sys.argv[1:] if argv is None else argv)
+    files = expandInputs(args.inputs)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    results = []
+    if (args.jobs <= 1 or len(files) == 1):
+        for filename in files:
+            results.append(convertFile(filename, args.formats, args.output_dir))
+            reportFile(results[-1])
+    else:
+        jobs = min(args.jobs, len(files))
+        with ProcessPoolExecutor(max_workers=jobs, initializer=initWorker) as pool:
+            futures = [pool.submit(convertFile, f, args.formats, args.output_dir) for f in files]
+            for future in as_completed(futures):
+                results.append(future.result())
+                reportFile(results[-1])
+    elapsed = time.perf_counter() - start
+
+    # Throughput summary
+    failed = [r for r in results if r[3]]
+    inputBytes = sum(os.path.getsize(r[0]) for r in results if os.path.exists(r[0]))
+    print("{} files ({} failed) in {:.2f} s: {:.1f} files/s, {:.2f} MB/s".format(
+        len(results), len(failed), elapsed, len(results) / elapsed if elapsed else 0,
+        inputBytes / (1024 * 1024) / elapsed if elapsed else 0))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,444 @@
+import json
+from bisect import bisect_left
+
+from PyQt5.QtGui import (QColor, QTextCursor, QTextDocument, QTextFormat)
+from PyQt5.QtWidgets import (QDialog, QGridLayout, QHBoxLayout, QLabel, QComboBox,
+                             QPushButton, QListView, QFileDialog, QTextEdit)
+
+from writerFormats import FormatState
+from writerFile import (readScriptText, isNative, loadScript)
+from writerRevisions import (RevisionStore, revisionsPath, documentLines)
+from writerPanels import DiffResultsModel
+
+# Two drafts are compared as lists of native block lines (see writerFile),
+# a line standing for the whole block: element type, text and styles.
+# Scenes are matched first (so a moved scene is one change, not a removal
+# and an addition), then the blocks of every pair of scenes
+
+HEADING_STATE = FormatState.Heading.value
+CHARACTER_STATE = FormatState.Character.value
+# Blocks a replaced block is looked for among the old ones, to pair it
+# with an old block of the same element type
+PAIR_WINDOW = 8
+
+# Kinds of change and the colour the editor marks them with
+SCENE_ADDED = "Scene added"
+SCENE_REMOVED = "Scene removed"
+SCENE_MOVED = "Scene moved"
+ADDED = "Added"
+REMOVED = "Removed"
+CHANGED = "Changed"
+SPEAKER_CHANGED = "Speaker changed"
+ELEMENT_CHANGED = "Element changed"
+STYLE_CHANGED = "Style changed"
+MARK_COLORS = {
+    SCENE_ADDED:        "#c8f0bc",
+    SCENE_REMOVED:      "#ffc8c8",
+    SCENE_MOVED:        "#d0e0ff",
+    ADDED:              "#c8f0bc",
+    REMOVED:            "#ffc8c8",
+    CHANGED:            "#fff0a0",
+    SPEAKER_CHANGED:    "#ffd8a0",
+    ELEMENT_CHANGED:    "#fff0a0",
+    STYLE_CHANGED:      "#fff0a0",
+}
+
+class Change:
+    # One difference between the drafts. old and new are block numbers, a
+    # removal's new block is where the blocks were. blocks is how many
+    # blocks of the new draft the change covers
+    def __init__(self, kind, old, new, oldText="", newText="", state=None, speaker="", blocks=1):
+        self.kind = kind
+        self.old = old
+        self.new = new
+        self.oldText = oldText
+        self.newText = newText
+        self.state = state
+        self.speaker = speaker
+        self.blocks = blocks
+        # Follows the text once the change is marked in an editor
+        self.cursor = None
+
+def scriptLines(filename, formats):
+    # Native files are compared as stored, html files go through a document
+    text = readScriptText(filename)
+    if (isNative(text)):
+        return [line for line in text.splitlines()[2:] if line]
+    document = QTextDocument()
+    loadScript(text, document, formats)
+    return documentLines(document, formats)
+
+def longestIncreasing(values):
+    # Positions of a longest strictly increasing run of values (not
+    # necessarily adjacent), by patience sorting in n log n
+    tails = []
+    tailPositions = []
+    previous = []
+    for position, value in enumerate(values):
+        length = bisect_left(tails, value)
+        if (length == len(tails)):
+            tails.append(value)
+            tailPositions.append(position)
+        else:
+            tails[length] = value
+            tailPositions[length] = position
+        previous.append(tailPositions[length - 1] if length > 0 else -1)
+    run = []
+    position = tailPositions[-1] if tailPositions else -1
+    while (position >= 0):
+        run.append(position)
+        position = previous[position]
+    run.reverse()
+    return run
+
+def matchBlocks(old, new, oldStart, oldEnd, newStart, newEnd):
+    # (old, new) pairs of equal blocks, in order. Equal ends are matched
+    # first, then blocks that occur once on both sides anchor the match and
+    # the gaps between them are matched the same way (patience diff). Each
+    # gap is counted once, so similar drafts match in about linear time
+    matches = []
+    regions = [(oldStart, oldEnd, newStart, newEnd)]
+    while regions:
+        a1, a2, b1, b2 = regions.pop()
+        while (a1 < a2 and b1 < b2 and old[a1] == new[b1]):
+            matches.append((a1, b1))
+            a1 += 1
+            b1 += 1
+        while (a1 < a2 and b1 < b2 and old[a2 - 1] == new[b2 - 1]):
+            a2 -= 1
+            b2 -= 1
+            matches.append((a2, b2))
+        if (a1 == a2 or b1 == b2):
+            continue
+        counts = {}
+        for i in range(a1, a2):
+            entry = counts.get(old[i])
+            if (entry is None):
+                counts[old[i]] = [1, 0, i, -1]
+            else:
+                entry[0] += 1
+        for j in range(b1, b2):
+            entry = counts.get(new[j])
+            if (entry is not None):
+                entry[1] += 1
+                entry[3] = j
+        unique = sorted((entry[3], entry[2]) for entry in counts.values() if entry[0] == 1 and entry[1] == 1)
+        previousA, previousB = a1, b1
+        for position in longestIncreasing([i for j, i in unique]):
+            j, i = unique[position]
+            matches.append((i, j))
+            regions.append((previousA, i, previousB, j))
+            previousA, previousB = i + 1, j + 1
+        if (previousA > a1 or previousB > b1):
+            regions.append((previousA, a2, previousB, b2))
+    matches.sort()
+    return matches
+
+def unmatchedRuns(matches, oldStart, oldEnd, newStart, newEnd):
+    # (old start, old end, new start, new end) between the matched blocks
+    runs = []
+    i, j = oldStart, newStart
+    for matchI, matchJ in matches + [(oldEnd, newEnd)]:
+        if (matchI > i or matchJ > j):
+            runs.append((i, matchI, j, matchJ))
+        i, j = matchI + 1, matchJ + 1
+    return runs
+
+def splitScenes(records):
+    # [start, end) blocks of every scene, anything before the first heading
+    # being a scene of its own
+    starts = [number for number, record in enumerate(records) if record[0] == HEADING_STATE]
+    if (records and (not starts or starts[0] != 0)):
+        starts.insert(0, 0)
+    return list(zip(starts, starts[1:] + [len(records)]))
+
+def sceneHeading(records, scene):
+    record = records[scene[0]]
+    return record[1].strip().upper() if record[0] == HEADING_STATE else ""
+
+def pairUnique(oldKeys, newKeys, pairs, paired):
+    # Pairs the scenes whose key only occurs once on either side (and that
+    # aren't paired yet)
+    counts = {}
+    for number, key in enumerate(oldKeys):
+        if (number not in paired):
+            entry = counts.setdefault(key, [0, 0, number, -1])
+            entry[0] += 1
+    for number, key in enumerate(newKeys):
+        if (number not in pairs and key in counts):
+            entry = counts[key]
+            entry[1] += 1
+            entry[3] = number
+    for oldCount, newCount, oldNumber, newNumber in counts.values():
+        if (oldCount == 1 and newCount == 1):
+            pairs[newNumber] = oldNumber
+            paired.add(oldNumber)
+
+def matchScenes(oldLines, newLines, oldRecords, newRecords, oldScenes, newScenes):
+    # {new scene: old scene} and the set of new scenes that moved. Scenes
+    # are paired on their blocks, then on their heading, and what's left
+    # between two scenes that stayed in place is paired in order
+    pairs = {}
+    paired = set()
+    pairUnique([tuple(oldLines[start:end]) for start, end in oldScenes],
+               [tuple(newLines[start:end]) for start, end in newScenes], pairs, paired)
+    pairUnique([sceneHeading(oldRecords, scene) for scene in oldScenes],
+               [sceneHeading(newRecords, scene) for scene in newScenes], pairs, paired)
+
+    # The longest run of pairs in the same order stays, the others moved
+    order = sorted(pairs.items())
+    staying = [order[position] for position in longestIncreasing([oldNumber for newNumber, oldNumber in order])]
+    moved = set(pairs) - set(newNumber for newNumber, oldNumber in staying)
+    previousNew, previousOld = -1, -1
+    for newNumber, oldNumber in staying + [(len(newScenes), len(oldScenes))]:
+        oldGap = [number for number in range(previousOld + 1, oldNumber) if number not in paired]
+        newGap = [number for number in range(previousNew + 1, newNumber) if number not in pairs]
+        for oldScene, newScene in zip(oldGap, newGap):
+            pairs[newScene] = oldScene
+            paired.add(oldScene)
+        previousNew, previousOld = newNumber, oldNumber
+    return pairs, moved
+
+def blockSpeakers(records):
+    # The character speaking at every block ("" outside dialogue)
+    speakers = []
+    speaker = ""
+    for state, text, *rest in records:
+        if (state == CHARACTER_STATE):
+            speaker = text.strip().upper()
+        elif (state not in (FormatState.Dialogue.value, FormatState.Paranthesis.value)):
+            speaker = ""
+        speakers.append(speaker)
+    return speakers
+
+def runChanges(run, oldRecords, newRecords, speakers, changes):
+    # Blocks of an unmatched run paired with an old block close by that has
+    # the same text (its element or style changed) or else the same element
+    # type, as changes of that block. Blocks that couldn't be paired were
+    # added or removed
+    a1, a2, b1, b2 = run
+    i = a1
+    for j in range(b1, b2):
+        state, text = newRecords[j][0], newRecords[j][1]
+        window = range(i, min(a2, i + PAIR_WINDOW))
+        found = -1
+        for candidate in window:
+            if (oldRecords[candidate][1] == text):
+                found = candidate
+                break
+        if (found < 0):
+            for candidate in window:
+                if (oldRecords[candidate][0] == state):
+                    found = candidate
+                    break
+        if (found < 0):
+            changes.append(Change(ADDED, None, j, "", text, state, speakers[j]))
+            continue
+        for number in range(i, found):
+            changes.append(Change(REMOVED, number, j, oldRecords[number][1], "", oldRecords[number][0], blocks=0))
+        i = found + 1
+        if (oldRecords[found] == newRecords[j]):
+            # Equal blocks the match left out (e.g. a repeated character name)
+            continue
+        oldState, oldText = oldRecords[found][0], oldRecords[found][1]
+        if (oldState != state):
+            kind = ELEMENT_CHANGED
+        elif (oldText == text):
+            kind = STYLE_CHANGED
+        elif (state == CHARACTER_STATE):
+            kind = SPEAKER_CHANGED
+        else:
+            kind = CHANGED
+        changes.append(Change(kind, found, j, oldText, text, state, speakers[j]))
+    for number in range(i, a2):
+        changes.append(Change(REMOVED, number, b2, oldRecords[number][1], "", oldRecords[number][0], blocks=0))
+
+def compareScripts(oldLines, newLines):
+    # Changes from the old draft to the new one, in the new draft's order
+    oldRecords = [json.loads(line) for line in oldLines]
+    newRecords = [json.loads(line) for line in newLines]
+    oldScenes = splitScenes(oldRecords)
+    newScenes = splitScenes(newRecords)
+    pairs, moved = matchScenes(oldLines, newLines, oldRecords, newRecords, oldScenes, newScenes)
+    speakers = blockSpeakers(newRecords)
+
+    # Removed scenes are listed after the scene (that stayed) before them
+    removedAfter = {}
+    newOf = {oldNumber: newNumber for newNumber, oldNumber in pairs.items()}
+    previous = -1
+    for oldNumber in range(len(oldScenes)):
+        if (oldNumber not in newOf):
+            removedAfter.setdefault(previous, []).append(oldNumber)
+        elif (newOf[oldNumber] not in moved):
+            previous = newOf[oldNumber]
+
+    changes = []
+    for newNumber in range(-1, len(newScenes)):
+        if (newNumber >= 0):
+            start, end = newScenes[newNumber]
+            heading = newRecords[start][1]
+            if (newNumber not in pairs):
+                changes.append(Change(SCENE_ADDED, None, start, "", heading, newRecords[start][0], blocks=end - start))
+            else:
+                oldStart, oldEnd = oldScenes[pairs[newNumber]]
+                if (newNumber in moved):
+                    changes.append(Change(SCENE_MOVED, oldStart, start, heading, heading,
+                                          newRecords[start][0], blocks=end - start))
+                matches = matchBlocks(oldLines, newLines, oldStart, oldEnd, start, end)
+                for run in unmatchedRuns(matches, oldStart, oldEnd, start, end):
+                    runChanges(run, oldRecords, newRecords, speakers, changes)
+        position = newScenes[newNumber + 1][0] if newNumber + 1 < len(newScenes) else len(newRecords)
+        for oldNumber in removedAfter.get(newNumber, []):
+            oldStart, oldEnd = oldScenes[oldNumber]
+            changes.append(Change(SCENE_REMOVED, oldStart, position, oldRecords[oldStart][1], "",
+                                  oldRecords[oldStart][0], blocks=0))
+    return changes
+
+def changeSummary(changes):
+    counts = {}
+    for change in changes:
+        counts[change.kind] = counts.get(change.kind, 0) + 1
+    if (not counts):
+        return "No differences"
+    return ", ".join(str(counts[kind]) + " " + kind.lower() for kind in MARK_COLORS if kind in counts)
+
+def markChanges(editor, changes):
+    # Full width highlights over the blocks of the new draft that changed.
+    # The highlights are cursors, they move with the text as it's edited
+    document = editor.document()
+    selections = []
+    for change in changes:
+        first = document.findBlockByNumber(min(change.new, document.blockCount() - 1))
+        cursor = QTextCursor(first)
+        change.cursor = cursor
+        if (change.blocks == 0):
+            # Removed blocks only have a place to go to
+            continue
+        last = document.findBlockByNumber(min(change.new + change.blocks, document.blockCount()) - 1)
+        cursor.setPosition(last.position() + last.length() - 1, QTextCursor.KeepAnchor)
+        selection = QTextEdit.ExtraSelection()
+        selection.format.setBackground(QColor(MARK_COLORS[change.kind]))
+        selection.format.setProperty(QTextFormat.FullWidthSelection, True)
+        selection.cursor = cursor
+        selections.append(selection)
+    editor.setExtraSelections(selections)
+
+class CompareDialog(QDialog):
+    # Compares two drafts (the script, its revisions or other scripts) and
+    # marks the changes in the window showing the newer one
+    def __init__(self, main, parent=None):
+        super(CompareDialog, self).__init__(parent)
+        self.main = main
+        self.target = None
+        self.setWindowTitle("Compare drafts")
+
+        self.oldCombo = QComboBox()
+        self.newCombo = QComboBox()
+        self.resultsModel = DiffResultsModel(MARK_COLORS, self)
+        self.resultsView = QListView()
+        self.resultsView.setUniformItemSizes(True)
+        self.resultsView.setModel(self.resultsModel)
+        self.resultsView.activated.connect(self.changeActivated)
+        self.resultsView.clicked.connect(self.changeActivated)
+        self.summaryLabel = QLabel()
+        self.summaryLabel.setWordWrap(True)
+
+        compareButton = QPushButton("Compare")
+        compareButton.clicked.connect(self.compare)
+        clearButton = QPushButton("Clear marks")
+        clearButton.clicked.connect(self.clearMarks)
+        closeButton = QPushButton("Close")
+        closeButton.clicked.connect(self.hide)
+
+        buttons = QHBoxLayout()
+        buttons.addWidget(compareButton)
+        buttons.addWidget(clearButton)
+        buttons.addStretch()
+        buttons.addWidget(closeButton)
+
+        layout = QGridLayout()
+        layout.addWidget(QLabel("Old draft:"),      0, 0)
+        layout.addWidget(self.oldCombo,             0, 1)
+        layout.addWidget(QLabel("New draft:"),      1, 0)
+        layout.addWidget(self.newCombo,             1, 1)
+        layout.addWidget(self.resultsView,          2, 0, 1, 2)
+        layout.addWidget(self.summaryLabel,         3, 0, 1, 2)
+        layout.addLayout(buttons,                   4, 0, 1, 2)
+        self.setLayout(layout)
+        self.resize(640, 480)
+
+    def showCompare(self):
+        self.fillSources()
+        self.show()
+        self.raise_()
+        self.activateWindow()
+
+    def fillSources(self):
+        # Revisions newest first, the old draft defaults to the newest one
+        revisions = []
+        if (self.main.filename):
+            try:
+                revisions = RevisionStore(revisionsPath(self.main.filename)).revisions()
+            except (OSError, ValueError):
+                revisions = []
+        self.oldCombo.clear()
+        self.newCombo.clear()
+        self.newCombo.addItem("Current script", ("current", None))
+        for revision in reversed(revisions):
+            label = "Revision " + str(revision["number"]) + (" - " + revision["name"] if revision["name"] else "")
+            self.oldCombo.addItem(label, ("revision", revision["number"]))
+            self.newCombo.addItem(label, ("revision", revision["number"]))
+        self.oldCombo.addItem("Other script...", ("file", None))
+        self.newCombo.addItem("Other script...", ("file", None))
+
+    def sourceLines(self, combo):
+        # (title, block lines) of a draft, None when no file was picked
+        kind, value = combo.currentData()
+        if (kind == "current"):
+            self.main.finishLoading()
+            return "current script", documentLines(self.main.scriptEdit.document(), self.main.elementFormats)
+        if (kind == "revision"):
+            store = RevisionStore(revisionsPath(self.main.filename))
+            return combo.currentText(), store.lines(value)
+        filename = QFileDialog.getOpenFileName(self, 'Compare with', ".", "(*.writer)")[0]
+        if (not filename):
+            return None
+        return filename, scriptLines(filename, self.main.elementFormats)
+
+    def compare(self):
+        try:
+            old = self.sourceLines(self.oldCombo)
+            new = old and self.sourceLines(self.newCombo)
+        except (OSError, ValueError) as error:
+            self.summaryLabel.setText("Could not read the draft: " + str(error))
+            return
+        if (not old or not new):
+            return
+        self.clearMarks()
+        changes = compareScripts(old[1], new[1])
+        # The new draft is marked where it's shown, drafts other than the
+        # current script open in a window of their own
+        if (self.newCombo.currentData()[0] == "current"):
+            self.target = self.main
+        else:
+            self.target = self.main.openLines(new[0], new[1])
+        markChanges(self.target.scriptEdit, changes)
+        self.resultsModel.setChanges(changes)
+        self.summaryLabel.setText(changeSummary(changes))
+
+    def changeActivated(self, modelIndex):
+        change = self.resultsModel.changeAt(modelIndex.row())
+        if (self.target is None or change.cursor is None):
+            return
+        cursor = QTextCursor(change.cursor)
+        cursor.clearSelection()
+        self.target.scriptEdit.setTextCursor(cursor)
+        self.target.scriptEdit.ensureCursorVisible()
+        self.target.raise_()
+
+    def clearMarks(self):
+        if (self.target is not None):
+            self.target.scriptEdit.setExtraSelections([])
+        self.target = None
+        self.resultsModel.setChanges([])
+        self.summaryLabel.clear()
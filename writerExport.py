@@ -0,0 +1,147 @@
+from xml.sax.saxutils import escape, quoteattr
+
+from PyQt5.QtGui import QFont
+
+from writerFormats import (FormatState, blockState, elementFormats)
+from writerFile import blockRuns
+from writerPages import UPPERCASE_STATES
+from writerFountain import (HEADING, TRANSITION, isCharacter)
+
+# Exporters walk the document's blocks once and write every block as they
+# go, the output is never held in memory as a whole. Parentheses and
+# transition colons are part of the block text already (changeParenthesis,
+# changeColon), they are written as they are
+
+FDX_TYPES = {
+    FormatState.Action:         "Action",
+    FormatState.Character:      "Character",
+    FormatState.Dialogue:       "Dialogue",
+    FormatState.Paranthesis:    "Parenthetical",
+    FormatState.Heading:        "Scene Heading",
+    FormatState.Transition:     "Transition",
+    FormatState.NoState:        "General",
+}
+
+def documentBlocks(document, formats=None):
+    # Yields (FormatState, displayed text, [(text, bold, italic, underline)])
+    # for every block, the pieces being the block's text split on its styles.
+    # A style is set where the text differs from its element's own style (the
+    # emphasis), *text* in italic action is upright (see writerFountain)
+    if formats is None:
+        formats = elementFormats()
+    block = document.firstBlock()
+    while block.isValid():
+        state = blockState(block)
+        text = block.text()
+        if (state in UPPERCASE_STATES):
+            text = text.upper()
+        pieces = []
+        position = 0
+        if (state != FormatState.NoState):
+            base = formats[state][1]
+            weight = base.fontWeight()
+            italic = int(base.fontItalic())
+            underline = int(base.fontUnderline())
+            for start, length, overrides in blockRuns(block, base):
+                style = ((overrides.get("w", weight) >= QFont.Bold) != (weight >= QFont.Bold),
+                         overrides.get("i", italic) != italic, overrides.get("u", underline) != underline)
+                if (not any(style)):
+                    continue
+                if (start > position):
+                    pieces.append((text[position:start], False, False, False))
+                pieces.append((text[start:start + length],) + style)
+                position = start + length
+        if (position < len(text) or not pieces):
+            pieces.append((text[position:], False, False, False))
+        yield state, text, pieces
+        block = block.next()
+
+### FOUNTAIN START ###
+
+# Elements spoken under a character, and the ones they follow without a blank line
+SPOKEN_STATES = (FormatState.Dialogue, FormatState.Paranthesis)
+SPEECH_STATES = (FormatState.Character,) + SPOKEN_STATES
+
+def fountainText(pieces):
+    # Emphasis markers around styled text, literal markers escaped
+    out = []
+    for text, bold, italic, underline in pieces:
+        if ("*" in text or "_" in text):
+            text = text.replace("*", "\\*").replace("_", "\\_")
+        if (bold or italic):
+            marker = "*" * ((2 if bold else 0) + (1 if italic else 0))
+            text = marker + text + marker
+        if (underline):
+            text = "_" + text + "_"
+        out.append(text)
+    return "".join(out)
+
+def fountainLine(state, text, pieces, spoken=True):
+    # The block as one Fountain line, forced where the plain text would be
+    # read as another element type (see writerFountain.classify). spoken is
+    # whether dialogue (or a parenthetical) follows a character
+    line = fountainText(pieces).strip()
+    if (state == FormatState.Heading):
+        if (not HEADING.match(line)):
+            line = "." + line
+    elif (state == FormatState.Transition):
+        if (not TRANSITION.match(line)):
+            line = "> " + line
+    elif (state == FormatState.Character):
+        # Without dialogue under it a character is read as action
+        if (not spoken or not isCharacter(line)):
+            line = "@" + line
+    elif (state in (FormatState.Action, FormatState.NoState)):
+        if (line[0] in ".!@>~#=[/" or HEADING.match(line) or TRANSITION.match(line) or
+            isCharacter(line)):
+            line = "!" + line
+    return line
+
+def writeFountain(document, outName, formats=None):
+    with open(outName, "wt", encoding="utf-8") as file:
+        previous = None
+        # One block ahead, a character line depends on what follows it
+        blocks = (block for block in documentBlocks(document, formats) if block[1].strip() != "")
+        current = next(blocks, None)
+        while (current is not None):
+            following = next(blocks, None)
+            state, text, pieces = current
+            # Dialogue and parantheticals stay attached to their character, after
+            # anything else they start a paragraph of their own
+            if (previous is not None and
+                (state not in SPOKEN_STATES or previous not in SPEECH_STATES)):
+                file.write("\n")
+            spoken = following is not None and following[0] in SPOKEN_STATES
+            file.write(fountainLine(state, text, pieces, spoken) + "\n")
+            previous = state
+            current = following
+
+### FOUNTAIN END ###
+
+### FINAL DRAFT START ###
+
+def fdxText(pieces):
+    out = []
+    for text, bold, italic, underline in pieces:
+        styles = [name for name, on in (("Bold", bold), ("Italic", italic), ("Underline", underline)) if on]
+        style = " Style=" + quoteattr("+".join(styles)) if styles else ""
+        out.append("<Text" + style + ">" + escape(text) + "</Text>")
+    return "".join(out)
+
+def writeFdx(document, outName, formats=None):
+    # Final Draft 8+ .fdx, paragraphs only (Final Draft applies its own layout)
+    with open(outName, "wt", encoding="utf-8") as file:
+        file.write('<?xml version="1.0" encoding="UTF-8" standalone="no" ?>\n')
+        file.write('<FinalDraft DocumentType="Script" Template="No" Version="1">\n')
+        file.write('  <Content>\n')
+        for state, text, pieces in documentBlocks(document, formats):
+            if (text.strip() == ""):
+                continue
+            file.write('    <Paragraph Type=' + quoteattr(FDX_TYPES[state]) + '>' + fdxText(pieces) + '</Paragraph>\n')
+        file.write('  </Content>\n')
+        file.write('</FinalDraft>\n')
+
+### FINAL DRAFT END ###
+
+# Export formats and the extension of the file they produce
+EXPORTERS = {"fountain": (".fountain", writeFountain), "fdx": (".fdx", writeFdx)}
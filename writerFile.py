@@ -0,0 +1,315 @@
+import re
+import json
+import locale
+from itertools import islice
+
+from PyQt5.QtCore import (QObject, QTimer, pyqtSignal)
+from PyQt5.QtGui import (QTextCursor, QTextCharFormat, QTextFormat, QColor)
+
+from writerFormats import (FormatState, ELEMENT_STATES, blockState, elementFormats)
+
+# Native script format (version 2):
+#   line 1   WRITER 2
+#   line 2   json header, with the scene index as [block number, byte offset]
+#            pairs (offsets count from the start of line 3)
+#   line 3+  one json array per block: [element type, text] or
+#            [element type, text, runs], runs being [start, length, overrides]
+#            for the text that doesn't use the element's own format
+FILE_MAGIC = "WRITER"
+FILE_VERSION = 2
+
+# Element types are stored in the (legacy) html as one digit per block
+ELEMENT_TYPES_META = re.compile(r'<meta name="writer-elements" content="([0-9]*)" />')
+
+# Document property set while a loader fills the document, its edits
+# aren't the user's (e.g. they are kept out of the undo history)
+LOADING_PROPERTY = "writerLoading"
+
+def readScriptText(filename):
+    with open(filename, "rb") as file:
+        data = file.read()
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        # Older html files were written in the system encoding
+        return data.decode(locale.getpreferredencoding(False), errors="replace")
+
+def isNative(text):
+    return text.startswith(FILE_MAGIC + " ")
+
+def loadScript(text, document, formats=None):
+    # Fills the document from either file format
+    if (isNative(text)):
+        loadNative(text.splitlines(), document, formats)
+    else:
+        document.setProperty(LOADING_PROPERTY, True)
+        document.setHtml(text)
+        applyElementTypes(document, text)
+        document.setProperty(LOADING_PROPERTY, False)
+
+### LEGACY HTML START ###
+
+def documentHtml(document):
+    html = document.toHtml()
+    types = []
+    block = document.firstBlock()
+    while block.isValid():
+        types.append(str(blockState(block).value))
+        block = block.next()
+    meta = '<meta name="writer-elements" content="' + "".join(types) + '" />'
+    return html.replace('<meta name="qrichtext" content="1" />',
+                        '<meta name="qrichtext" content="1" />' + meta, 1)
+
+def applyElementTypes(document, html):
+    # Tag the blocks of a freshly loaded document, files without the
+    # element types (or that don't line up) are tagged from the block layout
+    found = ELEMENT_TYPES_META.search(html)
+    types = found.group(1) if found else ""
+    if (len(types) != document.blockCount()):
+        types = ""
+
+    block = document.firstBlock()
+    index = 0
+    while block.isValid():
+        if (types):
+            block.setUserState(int(types[index]))
+        else:
+            block.setUserState(-1)
+            blockState(block)
+        block = block.next()
+        index += 1
+
+### LEGACY HTML END ###
+
+### NATIVE FORMAT START ###
+
+def charOverrides(charFormat, base):
+    # Only what differs from the element's own format gets stored
+    overrides = {}
+    if (charFormat.fontWeight() != base.fontWeight()):
+        overrides["w"] = charFormat.fontWeight()
+    if (charFormat.fontItalic() != base.fontItalic()):
+        overrides["i"] = int(charFormat.fontItalic())
+    if (charFormat.fontUnderline() != base.fontUnderline()):
+        overrides["u"] = int(charFormat.fontUnderline())
+    if (charFormat.fontStrikeOut() != base.fontStrikeOut()):
+        overrides["s"] = int(charFormat.fontStrikeOut())
+    if (charFormat.verticalAlignment() != base.verticalAlignment()):
+        overrides["v"] = int(charFormat.verticalAlignment())
+    if (charFormat.hasProperty(QTextFormat.ForegroundBrush)):
+        overrides["fg"] = charFormat.foreground().color().name()
+    if (charFormat.hasProperty(QTextFormat.BackgroundBrush)):
+        overrides["bg"] = charFormat.background().color().name()
+    return overrides
+
+def applyOverrides(base, overrides):
+    charFormat = QTextCharFormat(base)
+    if ("w" in overrides):
+        charFormat.setFontWeight(overrides["w"])
+    if ("i" in overrides):
+        charFormat.setFontItalic(bool(overrides["i"]))
+    if ("u" in overrides):
+        charFormat.setFontUnderline(bool(overrides["u"]))
+    if ("s" in overrides):
+        charFormat.setFontStrikeOut(bool(overrides["s"]))
+    if ("v" in overrides):
+        charFormat.setVerticalAlignment(QTextCharFormat.VerticalAlignment(overrides["v"]))
+    if ("fg" in overrides):
+        charFormat.setForeground(QColor(overrides["fg"]))
+    if ("bg" in overrides):
+        charFormat.setBackground(QColor(overrides["bg"]))
+    return charFormat
+
+def blockRuns(block, base):
+    # [start, length, overrides] for every fragment that isn't plain element text
+    runs = []
+    blockStart = block.position()
+    fragments = block.begin()
+    while not fragments.atEnd():
+        fragment = fragments.fragment()
+        charFormat = fragment.charFormat()
+        # Plain element text is by far the most common case
+        overrides = charOverrides(charFormat, base) if (charFormat != base) else None
+        if (overrides):
+            runs.append([fragment.position() - blockStart, fragment.length(), overrides])
+        fragments += 1
+    return runs
+
+def blockRecord(block, formats):
+    state = blockState(block)
+    record = [state.value, block.text()]
+    if (state != FormatState.NoState):
+        runs = blockRuns(block, formats[state][1])
+        if (runs):
+            record.append(runs)
+    return record
+
+def encodeRecord(record):
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+
+def serializeNative(document, formats=None):
+    if formats is None:
+        formats = elementFormats()
+
+    # Body first, so the scene index can point at byte offsets inside it
+    lines = []
+    scenes = []
+    offset = 0
+    block = document.firstBlock()
+    while block.isValid():
+        record = blockRecord(block, formats)
+        line = encodeRecord(record) + "\n"
+        if (record[0] == FormatState.Heading.value):
+            scenes.append([len(lines), offset])
+        lines.append(line)
+        offset += len(line.encode("utf-8"))
+        block = block.next()
+
+    header = {"format": "writer", "version": FILE_VERSION,
+              "blocks": len(lines), "scenes": scenes}
+    return FILE_MAGIC + " " + str(FILE_VERSION) + "\n" + json.dumps(header) + "\n" + "".join(lines)
+
+def parseHeader(lines):
+    # lines: the first two lines of a native file
+    version = int(lines[0].split()[1])
+    if (version > FILE_VERSION):
+        raise ValueError("Script was saved by a newer version of Writer (format " + str(version) + ")")
+    return json.loads(lines[1])
+
+def insertRecords(cursor, records, formats, first=False):
+    # Appends decoded block records at the cursor, with the cached element formats
+    for state, text, *rest in records:
+        element = ELEMENT_STATES[state] if (0 <= state < FormatState.NoState.value) else FormatState.Action
+        blockFormat, charFormat = formats[element]
+        if (first):
+            cursor.setBlockFormat(blockFormat)
+            cursor.setBlockCharFormat(charFormat)
+            first = False
+        else:
+            cursor.insertBlock(blockFormat, charFormat)
+        cursor.block().setUserState(state if state != FormatState.NoState.value else -1)
+
+        if (not rest):
+            cursor.insertText(text, charFormat)
+            continue
+        # Inline runs (bold, colours...) on top of the element format
+        position = 0
+        for start, length, overrides in rest[0]:
+            if (start > position):
+                cursor.insertText(text[position:start], charFormat)
+            cursor.insertText(text[start:start + length], applyOverrides(charFormat, overrides))
+            position = start + length
+        if (position < len(text)):
+            cursor.insertText(text[position:], charFormat)
+
+def readNativeHeader(filename):
+    # Header of a native file (without reading the rest), None for html files
+    with open(filename, "rt", encoding="utf-8", errors="replace") as file:
+        first = file.readline()
+        if (not isNative(first)):
+            return None
+        return parseHeader([first, file.readline()])
+
+def loadRecords(records, document, formats=None):
+    # Replaces the document with the block records, built straight into the
+    # document in one edit that can't be undone
+    if formats is None:
+        formats = elementFormats()
+    undoEnabled = document.isUndoRedoEnabled()
+    document.setProperty(LOADING_PROPERTY, True)
+    document.clear()
+    document.setUndoRedoEnabled(False)
+    cursor = QTextCursor(document)
+    cursor.beginEditBlock()
+    insertRecords(cursor, records, formats, first=True)
+    cursor.endEditBlock()
+    document.setUndoRedoEnabled(undoEnabled)
+    document.setProperty(LOADING_PROPERTY, False)
+
+def loadNative(lines, document, formats=None):
+    parseHeader(lines[:2])
+    loadRecords((json.loads(line) for line in lines[2:] if line), document, formats)
+    document.setModified(False)
+
+class LazyLoader(QObject):
+    # Streams a native file into a document: the first scenes straight away,
+    # the rest in chunks from the event loop, so the script can be read and
+    # edited while it is still loading
+    progress = pyqtSignal(int, int)     # blocks loaded, total blocks
+    finished = pyqtSignal()
+
+    def __init__(self, filename, document, formats=None, firstScenes=5, chunkBlocks=500, parent=None):
+        super(LazyLoader, self).__init__(parent)
+        self.filename = filename
+        self.document = document
+        self.formats = formats if formats is not None else elementFormats()
+        self.firstScenes = firstScenes
+        self.chunkBlocks = chunkBlocks
+        self.file = None
+        self.undoEnabled = document.isUndoRedoEnabled()
+        self.loaded = 0
+        self.total = 0
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.loadChunk)
+
+    def start(self):
+        self.file = open(self.filename, "rt", encoding="utf-8")
+        header = parseHeader([self.file.readline(), self.file.readline()])
+        self.total = header["blocks"]
+
+        # The first screen ends where the scene after the first few begins
+        scenes = header.get("scenes", [])
+        firstBlocks = self.chunkBlocks
+        if (len(scenes) > self.firstScenes):
+            firstBlocks = max(scenes[self.firstScenes][0], 1)
+
+        # Edits made by the loader itself can't be undone
+        self.document.setProperty(LOADING_PROPERTY, True)
+        self.document.clear()
+        self.document.setUndoRedoEnabled(False)
+        self.document.setProperty(LOADING_PROPERTY, False)
+        self.document.setModified(False)
+        self.cursor = QTextCursor(self.document)
+        self.loadBlocks(firstBlocks, first=True)
+        if (self.isLoading()):
+            self.timer.start()
+
+    def isLoading(self):
+        return self.file is not None
+
+    def loadBlocks(self, count, first=False):
+        records = [json.loads(line) for line in islice(self.file, count) if line.strip()]
+
+        # This cursor follows any edits made above it, so chunks always
+        # continue right after the previously loaded block
+        wasModified = self.document.isModified()
+        self.document.setProperty(LOADING_PROPERTY, True)
+        self.cursor.beginEditBlock()
+        insertRecords(self.cursor, records, self.formats, first=first)
+        self.cursor.endEditBlock()
+        self.document.setProperty(LOADING_PROPERTY, False)
+        self.document.setModified(wasModified)
+
+        self.loaded += len(records)
+        self.progress.emit(self.loaded, self.total)
+        if (len(records) < count):
+            self.done()
+
+    def loadChunk(self):
+        self.loadBlocks(self.chunkBlocks)
+
+    def finishNow(self):
+        # Load whatever is left in one go (e.g. before saving)
+        if (self.isLoading()):
+            self.loadBlocks(max(self.total - self.loaded, 0) + 1)
+
+    def done(self):
+        self.timer.stop()
+        self.file.close()
+        self.file = None
+        self.document.setUndoRedoEnabled(self.undoEnabled)
+        self.finished.emit()
+
+### NATIVE FORMAT END ###
@@ -0,0 +1,243 @@
+import re
+
+from PyQt5.QtCore import (Qt, QTimer)
+from PyQt5.QtGui import (QTextCursor)
+from PyQt5.QtWidgets import (QDialog, QGridLayout, QHBoxLayout, QLabel, QLineEdit,
+                             QCheckBox, QComboBox, QPushButton, QListView)
+
+from writerFormats import FormatState
+from writerPanels import SearchResultsModel
+
+# Most matches listed in the dialog (replace all isn't limited)
+MAX_RESULTS = 5000
+# Milliseconds of quiet before the list follows the typing or the document
+SEARCH_DELAY = 150
+
+# Element type filter, as named on the format bar
+ELEMENT_FILTERS = [
+    ("Any element",     None),
+    ("Action",          FormatState.Action),
+    ("Character",       FormatState.Character),
+    ("Dialogue",        FormatState.Dialogue),
+    ("Paranthesis",     FormatState.Paranthesis),
+    ("Heading",         FormatState.Heading),
+    ("Transition",      FormatState.Transition),
+]
+
+class FindDialog(QDialog):
+    # Find/replace over the script's SearchIndex (see writerIndex). The
+    # results list follows the typing and the document's changes
+    def __init__(self, editor, index, characterNames, parent=None):
+        super(FindDialog, self).__init__(parent)
+        self.editor = editor
+        self.index = index
+        self.characterNames = characterNames
+        self.setWindowTitle("Find and replace")
+
+        self.findEdit = QLineEdit()
+        self.findEdit.setPlaceholderText("Find")
+        self.replaceEdit = QLineEdit()
+        self.replaceEdit.setPlaceholderText("Replace with")
+        self.regexCheck = QCheckBox("Regular expression")
+        self.caseCheck = QCheckBox("Match case")
+        self.wordsCheck = QCheckBox("Whole words")
+
+        self.elementCombo = QComboBox()
+        for label, state in ELEMENT_FILTERS:
+            self.elementCombo.addItem(label, state)
+        self.characterCombo = QComboBox()
+        self.characterCombo.setEditable(True)
+        self.characterCombo.lineEdit().setPlaceholderText("Any character")
+
+        self.resultsModel = SearchResultsModel(index, self)
+        self.resultsView = QListView()
+        self.resultsView.setUniformItemSizes(True)
+        self.resultsView.setModel(self.resultsModel)
+        self.resultsView.activated.connect(self.resultActivated)
+        self.resultsView.clicked.connect(self.resultActivated)
+        self.statusLabel = QLabel()
+
+        findNextButton = QPushButton("Find next")
+        findNextButton.clicked.connect(self.findNext)
+        replaceButton = QPushButton("Replace")
+        replaceButton.clicked.connect(self.replace)
+        replaceAllButton = QPushButton("Replace all")
+        replaceAllButton.clicked.connect(self.replaceAll)
+        closeButton = QPushButton("Close")
+        closeButton.clicked.connect(self.hide)
+
+        buttons = QHBoxLayout()
+        buttons.addWidget(findNextButton)
+        buttons.addWidget(replaceButton)
+        buttons.addWidget(replaceAllButton)
+        buttons.addStretch()
+        buttons.addWidget(closeButton)
+
+        layout = QGridLayout()
+        layout.addWidget(QLabel("Find:"),           0, 0)
+        layout.addWidget(self.findEdit,             0, 1, 1, 3)
+        layout.addWidget(QLabel("Replace:"),        1, 0)
+        layout.addWidget(self.replaceEdit,          1, 1, 1, 3)
+        layout.addWidget(self.regexCheck,           2, 1)
+        layout.addWidget(self.caseCheck,            2, 2)
+        layout.addWidget(self.wordsCheck,           2, 3)
+        layout.addWidget(QLabel("Only in:"),        3, 0)
+        layout.addWidget(self.elementCombo,         3, 1)
+        layout.addWidget(QLabel("Spoken by:"),      3, 2, Qt.AlignRight)
+        layout.addWidget(self.characterCombo,       3, 3)
+        layout.addWidget(self.resultsView,          4, 0, 1, 4)
+        layout.addWidget(self.statusLabel,          5, 0, 1, 4)
+        layout.addLayout(buttons,                   6, 0, 1, 4)
+        self.setLayout(layout)
+
+        # Searches wait for a pause in the typing (or in the document's changes)
+        self.searchTimer = QTimer(self)
+        self.searchTimer.setSingleShot(True)
+        self.searchTimer.setInterval(SEARCH_DELAY)
+        self.searchTimer.timeout.connect(self.refresh)
+        self.findEdit.textChanged.connect(self.searchTimer.start)
+        self.findEdit.returnPressed.connect(self.findNext)
+        self.regexCheck.toggled.connect(self.searchTimer.start)
+        self.caseCheck.toggled.connect(self.searchTimer.start)
+        self.wordsCheck.toggled.connect(self.searchTimer.start)
+        self.elementCombo.currentIndexChanged.connect(self.searchTimer.start)
+        self.characterCombo.currentTextChanged.connect(self.searchTimer.start)
+        self.index.changed.connect(self.documentChanged)
+
+    def showFind(self, text=""):
+        # Character names change with the script, refresh them on every show
+        character = self.characterCombo.currentText()
+        self.characterCombo.blockSignals(True)
+        self.characterCombo.clear()
+        self.characterCombo.addItem("")
+        self.characterCombo.addItems(self.characterNames())
+        self.characterCombo.setEditText(character)
+        self.characterCombo.blockSignals(False)
+
+        if (text):
+            self.findEdit.setText(text)
+        self.show()
+        self.raise_()
+        self.activateWindow()
+        self.findEdit.setFocus()
+        self.findEdit.selectAll()
+        self.refresh()
+
+    def documentChanged(self):
+        if (self.isVisible()):
+            self.searchTimer.start()
+
+    def search(self, limit=None):
+        # None (and the reason in the status line) when the pattern is invalid
+        states = None
+        state = self.elementCombo.currentData()
+        if (state is not None):
+            states = (state,)
+        try:
+            return self.index.search(self.findEdit.text(),
+                                     regex=self.regexCheck.isChecked(),
+                                     caseSensitive=self.caseCheck.isChecked(),
+                                     wholeWords=self.wordsCheck.isChecked(),
+                                     states=states,
+                                     character=self.characterCombo.currentText().strip(),
+                                     limit=limit)
+        except re.error as error:
+            self.statusLabel.setText("Invalid expression: " + str(error))
+            return None
+
+    def refresh(self):
+        self.searchTimer.stop()
+        if (not self.findEdit.text()):
+            self.resultsModel.setMatches([])
+            self.statusLabel.setText("")
+            return
+        matches = self.search(MAX_RESULTS + 1)
+        if (matches is None):
+            self.resultsModel.setMatches([])
+            return
+        if (len(matches) > MAX_RESULTS):
+            self.statusLabel.setText("More than " + str(MAX_RESULTS) + " matches, the first ones are listed")
+        elif (len(matches) == 1):
+            self.statusLabel.setText("1 match")
+        else:
+            self.statusLabel.setText(str(len(matches)) + " matches")
+        self.resultsModel.setMatches(matches[:MAX_RESULTS])
+
+    def resultActivated(self, modelIndex):
+        self.selectMatch(self.resultsModel.matchAt(modelIndex.row()))
+
+    def selectMatch(self, match):
+        number, start, end, found = match
+        block = self.editor.document().findBlockByNumber(number)
+        if (not block.isValid()):
+            return
+        cursor = self.editor.textCursor()
+        cursor.setPosition(block.position() + start)
+        cursor.setPosition(block.position() + end, QTextCursor.KeepAnchor)
+        self.editor.setTextCursor(cursor)
+        self.editor.ensureCursorVisible()
+
+    def cursorLocation(self, position):
+        block = self.editor.document().findBlock(position)
+        return (block.blockNumber(), position - block.position())
+
+    def findNext(self):
+        matches = self.search()
+        if (not matches):
+            if (matches is not None):
+                self.statusLabel.setText("No matches")
+            return
+        # First match after the cursor, wrapping around to the top
+        after = self.cursorLocation(self.editor.textCursor().selectionEnd())
+        for match in matches:
+            if ((match[0], match[1]) >= after):
+                self.selectMatch(match)
+                return
+        self.selectMatch(matches[0])
+
+    def replacement(self, found):
+        if (self.regexCheck.isChecked()):
+            # \1, \g<name>... as in Python's re.sub
+            return found.expand(self.replaceEdit.text())
+        return self.replaceEdit.text()
+
+    def replace(self):
+        # Replaces the selected match (if it is one) and moves on to the next
+        cursor = self.editor.textCursor()
+        if (cursor.hasSelection()):
+            start = self.cursorLocation(cursor.selectionStart())
+            end = self.cursorLocation(cursor.selectionEnd())
+            for match in self.search() or []:
+                if ((match[0], match[1]) == start and (match[0], match[2]) == end):
+                    try:
+                        cursor.insertText(self.replacement(match[3]))
+                    except re.error as error:
+                        self.statusLabel.setText("Invalid replacement: " + str(error))
+                        return
+                    self.editor.setTextCursor(cursor)
+                    break
+        self.findNext()
+
+    def replaceAll(self):
+        matches = self.search()
+        if (not matches):
+            return
+        try:
+            replacements = [self.replacement(match[3]) for match in matches]
+        except re.error as error:
+            self.statusLabel.setText("Invalid replacement: " + str(error))
+            return
+
+        # Block positions are taken before the first edit, going from the
+        # last match up keeps them valid. One edit block: one undo step
+        document = self.editor.document()
+        positions = [document.findBlockByNumber(match[0]).position() for match in matches]
+        cursor = QTextCursor(document)
+        cursor.beginEditBlock()
+        for match, position, text in reversed(list(zip(matches, positions, replacements))):
+            cursor.setPosition(position + match[1])
+            cursor.setPosition(position + match[2], QTextCursor.KeepAnchor)
+            cursor.insertText(text)
+        cursor.endEditBlock()
+        self.refresh()
+        self.statusLabel.setText("Replaced " + str(len(matches)) + (" match" if len(matches) == 1 else " matches"))
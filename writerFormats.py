@@ -0,0 +1,131 @@
+import os
+from enum import Enum
+from types import MappingProxyType
+from PyQt5.QtCore import (Qt)
+from PyQt5.QtGui import (QFont, QFontMetrics, QIcon, QTextCharFormat, QTextBlockFormat)
+
+import writterSettings
+
+# Resolution the UI and printing are laid out for, the editor scales the
+# UI by the screen's resolution over it
+BASE_DPI = 96
+
+# Ease of tracking/comparing states
+class FormatState(Enum):
+    Action = 0
+    Character = 1
+    Dialogue = 2
+    Paranthesis = 3
+    Heading = 4
+    Transition = 5
+    NoState = 6
+
+# Text style of every element: (capitalization, italic, underline, weight)
+CHAR_STYLES = {
+    FormatState.Action:         (QFont.MixedCase, True, False, QFont.Normal),     #First letter is capitalized later
+    FormatState.Character:      (QFont.AllUppercase, False, False, QFont.ExtraBold),
+    FormatState.Dialogue:       (QFont.MixedCase, False, False, QFont.Normal),    #First letter is capitalized later
+    FormatState.Paranthesis:    (QFont.MixedCase, True, False, QFont.Normal),
+    FormatState.Heading:        (QFont.AllUppercase, False, True, QFont.ExtraBold),
+    FormatState.Transition:     (QFont.AllUppercase, False, False, QFont.Normal),
+}
+
+# Block layout of every element: (left margin, right margin, alignment)
+BLOCK_LAYOUTS = {
+    FormatState.Action:         (0, 0, Qt.AlignLeft),
+    FormatState.Character:      (240, 0, Qt.AlignLeft),
+    FormatState.Dialogue:       (120, 120, Qt.AlignLeft),
+    FormatState.Paranthesis:    (190, 190, Qt.AlignLeft),
+    FormatState.Heading:        (0, 0, Qt.AlignCenter),
+    FormatState.Transition:     (0, 0, Qt.AlignRight),
+}
+
+def scriptFont(family="Courier", size=12):
+    basefont = QFont()
+    basefont.setFamily(family)
+    basefont.setPointSizeF(size)
+    return basefont
+
+def makeCharFormat(state, basefont=None):
+    capitalization, italic, underline, weight = CHAR_STYLES[state]
+    charFormat = QTextCharFormat()
+    charFormat.setFont(basefont if basefont is not None else scriptFont())
+    charFormat.setFontCapitalization(capitalization)
+    charFormat.setFontItalic(italic)
+    charFormat.setFontUnderline(underline)
+    charFormat.setFontWeight(weight)
+    charFormat.setFontLetterSpacing(100)
+    return charFormat
+
+def makeBlockFormat(state):
+    leftMargin, rightMargin, alignment = BLOCK_LAYOUTS[state]
+    blockFormat = QTextBlockFormat()
+    blockFormat.setLeftMargin(leftMargin)
+    blockFormat.setRightMargin(rightMargin)
+    blockFormat.setAlignment(alignment)
+    return blockFormat
+
+def elementFormats(basefont=None):
+    # (block format, char format) of every element
+    if (basefont is None):
+        basefont = scriptFont()
+    return {state: (makeBlockFormat(state), makeCharFormat(state, basefont))
+            for state in BLOCK_LAYOUTS}
+
+class FormatRegistry:
+    # What every window looks the same with: the element formats, the
+    # editor's font and its metrics, the editor's style sheet and the icons.
+    # Built once per process (see formatRegistry) from writterSettings and
+    # shared by all the windows, so none of it may be changed: copy a format
+    # before changing it. Icons are loaded the first time they're asked for
+    def __init__(self, settings):
+        self.font = scriptFont(settings.editorFont, settings.editorFontSize)
+        # Size of a single character (used for UI scaling)
+        self.monoCharSize = QFontMetrics(self.font).horizontalAdvance("a")
+        self.elementFormats = MappingProxyType(elementFormats(self.font))
+        self.styleSheet = 'QTextEdit { font: %gpt "%s"; }' % (settings.editorFontSize, settings.editorFont)
+        self.iconFolder = settings.iconFolder or os.path.join(os.path.dirname(os.path.abspath(__file__)), "icons")
+        self.icons = {}
+
+    def icon(self, name):
+        icon = self.icons.get(name)
+        if (icon is None):
+            icon = self.icons[name] = QIcon(os.path.join(self.iconFolder, name + ".png"))
+        return icon
+
+# The process' registry, see formatRegistry
+registry = None
+
+def formatRegistry():
+    # Needs the QApplication, the font metrics depend on the screen
+    global registry
+    if (registry is None):
+        registry = FormatRegistry(writterSettings)
+    return registry
+
+def blockFormatState(blockFormat):
+    # Every element has a unique block layout, so it's enough to tell them apart
+    # (works on documents loaded from a file, without a Main window)
+    # (html import adds AlignAbsolute to right alignment, so that bit is ignored)
+    horizontal = Qt.AlignHorizontal_Mask & ~Qt.AlignAbsolute
+    layout = (round(blockFormat.leftMargin()), round(blockFormat.rightMargin()),
+              int(blockFormat.alignment() & horizontal))
+    for state, (leftMargin, rightMargin, alignment) in BLOCK_LAYOUTS.items():
+        if (layout == (leftMargin, rightMargin, int(alignment & horizontal))):
+            return state
+    return FormatState.NoState
+
+# Indexed by a block's user state, see blockState
+ELEMENT_STATES = tuple(FormatState)
+
+def blockState(block):
+    # Blocks carry their element type as user state, set when they get formatted
+    state = block.userState()
+    if (0 <= state < FormatState.NoState.value):
+        return ELEMENT_STATES[state]
+
+    # Untagged block (plain Enter, paste, old file...): tag it from its layout once
+    detected = blockFormatState(block.blockFormat())
+    if (detected != FormatState.NoState):
+        block.setUserState(detected.value)
+    return detected
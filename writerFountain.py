@@ -0,0 +1,229 @@
+import re
+
+from PyQt5.QtGui import QFont
+
+from writerFormats import (FormatState, CHAR_STYLES)
+from writerFile import loadRecords
+
+# Fountain (https://fountain.io) and plain text screenplays. Lines are read
+# one paragraph (run of non-blank lines) at a time and classified with the
+# Fountain rules, nothing but the current paragraph is kept in memory
+
+# Files the importer reads, the CLI only takes the unambiguous ones
+FOUNTAIN_EXTENSIONS = (".fountain", ".spmd")
+TEXT_EXTENSIONS = (".txt",)
+
+HEADING = re.compile(r"(INT|EXT|EST|INT\.?/EXT|I/E)[. ]", re.IGNORECASE)
+SCENE_NUMBER = re.compile(r"\s*#[\w.\-]+#$")
+TRANSITION = re.compile(r"[^a-z]*TO:$")
+# Upper case name (with a letter in it), optionally an extension like (cont'd)
+CHARACTER = re.compile(r"(?=[^a-z(]*[A-Z])[^a-z(]+(\([^)]*\))?$")
+TITLE_KEY = re.compile(r"(Title|Credit|Authors?|Source|Draft date|Date|Contact|Copyright|Notes|Revision):",
+                       re.IGNORECASE)
+PAGE_BREAK = re.compile(r"={3,}$")
+NOTE = re.compile(r"\[\[.*?\]\]")
+EMPHASIS = re.compile(r"(\\[*_]|\*\*\*|\*\*|\*|_)")
+# Text style each emphasis marker toggles, as writerFile run overrides
+EMPHASIS_STYLES = {"***": ("w", "i"), "**": ("w",), "*": ("i",), "_": ("u",)}
+
+def emphasisOverrides(state):
+    # Emphasis sets the style an element doesn't have, *text* in an italic
+    # element is upright (writerExport writes the same markers back)
+    capitalization, italic, underline, weight = CHAR_STYLES.get(state, CHAR_STYLES[FormatState.Action])
+    return {"w": QFont.Normal if (weight >= QFont.Bold) else QFont.Bold,
+            "i": int(not italic), "u": int(not underline)}
+
+# Overrides of every element type, by value
+STYLE_OVERRIDES = {state.value: emphasisOverrides(state) for state in FormatState}
+
+# Element type values, looked up once instead of per line
+HEADING_STATE = FormatState.Heading.value
+ACTION_STATE = FormatState.Action.value
+CHARACTER_STATE = FormatState.Character.value
+DIALOGUE_STATE = FormatState.Dialogue.value
+PARANTHESIS_STATE = FormatState.Paranthesis.value
+TRANSITION_STATE = FormatState.Transition.value
+
+class SourceFilter:
+    # Drops the boneyard (/* */), notes ([[ ]]), sections (#), synopses (=)
+    # and the title page from the lines. Most lines have none of these, they
+    # only go through clean() when something looks like markup
+    def __init__(self):
+        self.boneyard = False
+        self.titlePage = None
+
+    def needsCleaning(self, line):
+        return (self.boneyard or self.titlePage is not False or "/*" in line or "[[" in line)
+
+    def clean(self, line):
+        # The line without markup, None when nothing (not even a blank line) is left
+        if (self.titlePage is None):
+            line = line.lstrip("\ufeff")
+            # A title page starts with "Key:" and ends at the first blank line
+            self.titlePage = bool(TITLE_KEY.match(line))
+        if (self.titlePage):
+            self.titlePage = bool(line.strip())
+            return None
+        if (self.boneyard or "/*" in line):
+            kept = ""
+            while line:
+                if (self.boneyard):
+                    end = line.find("*/")
+                    if (end < 0):
+                        line = ""
+                    else:
+                        line = line[end + 2:]
+                        self.boneyard = False
+                else:
+                    start = line.find("/*")
+                    if (start < 0):
+                        kept += line
+                        line = ""
+                    else:
+                        kept += line[:start]
+                        line = line[start + 2:]
+                        self.boneyard = True
+            if (not kept.strip()):
+                return None
+            line = kept
+        if ("[[" in line):
+            line = NOTE.sub("", line)
+            if (not line.strip()):
+                return None
+        return line
+
+def paragraphs(lines):
+    # Runs of non-blank lines, stripped. Removed lines (see SourceFilter)
+    # aren't blank lines, they don't end paragraphs
+    source = SourceFilter()
+    paragraph = []
+    for line in lines:
+        if (source.needsCleaning(line)):
+            line = source.clean(line)
+            if (line is None):
+                continue
+        line = line.strip()
+        if (not line):
+            if (paragraph):
+                yield paragraph
+                paragraph = []
+            continue
+        first = line[0]
+        if (first == "#"):
+            continue
+        if (first == "="):
+            if (PAGE_BREAK.match(line) and paragraph):
+                yield paragraph
+                paragraph = []
+            continue
+        paragraph.append(line)
+    if (paragraph):
+        yield paragraph
+
+def emphasisRuns(text, state):
+    # Fountain *italic*, **bold**, ***both*** and _underline_ as writerFile
+    # runs over the text without the markers. Unpaired markers stay text
+    tokens = EMPHASIS.split(text)
+    counts = {}
+    for token in tokens[1::2]:
+        counts[token] = counts.get(token, 0) + 1
+    overrides = STYLE_OVERRIDES[state]
+    plain = ""
+    runs = []
+    active = {}
+    for number, token in enumerate(tokens):
+        if (number % 2 == 0):
+            if (token and active):
+                runs.append([len(plain), len(token), {style: overrides[style] for style in active}])
+            plain += token
+        elif (token.startswith("\\")):
+            plain += token[1:]
+        elif (counts[token] % 2):
+            plain += token
+        else:
+            for style in EMPHASIS_STYLES[token]:
+                active[style] = active.get(style, 0) ^ 1
+                if (not active[style]):
+                    del active[style]
+    return plain, runs
+
+def record(state, text):
+    # [element type, text] or, with emphasis, [element type, text, runs]
+    if ("*" not in text and "_" not in text):
+        return [state, text]
+    text, runs = emphasisRuns(text, state)
+    return [state, text, runs] if runs else [state, text]
+
+def isCharacter(line):
+    if (line[0] == "@"):
+        return True
+    return bool(CHARACTER.match(line.rstrip("^").rstrip())) and not TRANSITION.match(line)
+
+def classify(paragraph, records):
+    # Appends the records of one paragraph
+    first = paragraph[0]
+    if (first[0] == "." and not first.startswith("..")):
+        records.append(record(HEADING_STATE, SCENE_NUMBER.sub("", first[1:].strip())))
+    elif (HEADING.match(first)):
+        records.append(record(HEADING_STATE, SCENE_NUMBER.sub("", first)))
+    elif (len(paragraph) == 1):
+        if (first[0] == "@"):
+            # Forced character with no dialogue under it
+            records.append(record(CHARACTER_STATE, first[1:].rstrip("^").strip()))
+        elif (first[0] == ">" and first[-1] != "<"):
+            records.append(record(TRANSITION_STATE, first[1:].strip()))
+        elif (TRANSITION.match(first)):
+            records.append(record(TRANSITION_STATE, first))
+        else:
+            records.append(actionRecord(paragraph))
+        return
+    elif (first[0] != "!" and isCharacter(first)):
+        # Dual dialogue (^) is read as dialogue one after the other
+        records.append(record(CHARACTER_STATE, first.lstrip("@").rstrip("^").strip()))
+        dialogue = []
+        for line in paragraph[1:]:
+            if (line[0] == "(" and line[-1] == ")"):
+                if (dialogue):
+                    records.append(record(DIALOGUE_STATE, " ".join(dialogue)))
+                    dialogue = []
+                records.append(record(PARANTHESIS_STATE, line))
+            else:
+                dialogue.append(line)
+        if (dialogue):
+            records.append(record(DIALOGUE_STATE, " ".join(dialogue)))
+        return
+    else:
+        records.append(actionRecord(paragraph))
+        return
+    # Anything under a heading in the same paragraph
+    if (len(paragraph) > 1):
+        classify(paragraph[1:], records)
+
+def actionRecord(paragraph):
+    # Action, also centered (>text<) text and lyrics (~)
+    text = " ".join(paragraph)
+    if (text[0] == ">" and text[-1] == "<"):
+        text = text[1:-1].strip()
+    elif (text[0] in "!~"):
+        text = text[1:]
+    return record(ACTION_STATE, text)
+
+def fountainRecords(lines):
+    # Block records (see writerFile.insertRecords) of Fountain lines, any
+    # iterable of lines: a file object is read as it goes. Records are
+    # handed out a batch of paragraphs at a time
+    records = []
+    for paragraph in paragraphs(lines):
+        classify(paragraph, records)
+        if (len(records) >= 256):
+            yield from records
+            records = []
+    yield from records
+
+def loadFountain(lines, document, formats=None):
+    # Replaces the document with the screenplay, in one edit
+    loadRecords(fountainRecords(lines), document, formats)
+
+def readFountain(filename, document, formats=None):
+    with open(filename, "rt", encoding="utf-8-sig", errors="replace") as file:
+        loadFountain(file, document, formats)
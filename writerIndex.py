@@ -0,0 +1,468 @@
+import re
+from bisect import bisect_right
+from itertools import accumulate
+
+from PyQt5 import sip
+from PyQt5.QtCore import (QObject, QTimer, pyqtSignal)
+from PyQt5.QtGui import (QTextBlockUserData, QTextCursor)
+
+from writerFormats import (FormatState, blockState)
+from writerPages import (PAGE_LINES, ELEMENT_LAYOUT, blockLines, elementLines)
+
+class BlockData(QTextBlockUserData):
+    # Per-block cache shared by the document indexes, it lives and dies with its block
+    def __init__(self):
+        super(BlockData, self).__init__()
+        self.character = None
+        self.text = None        # SearchIndex
+        self.state = None
+        self.speaker = None
+        self.pageKey = None     # PageIndex: (state, text) pageLines were wrapped from
+        self.pageLines = None
+        self.counts = None      # StatisticsIndex: (state, words, lines) the block added
+
+class BlockTracker(QObject):
+    # Turns QTextDocument.contentsChange into per-block updates, so indexes
+    # only ever look at the blocks that changed. Indexes implement:
+    #   blockChanged(block, data)   block was added or its text/format changed
+    #   blockRemoved(data)          block is gone, data is all that is left of it
+    #   flush()                     end of a batch of changes
+    def __init__(self, document, parent=None):
+        super(BlockTracker, self).__init__(parent)
+        self.document = document
+        self.indexes = []
+        # BlockData of every block in document order, a change only replaces
+        # the ones of the blocks it ran over
+        self.blocks = []
+        block = document.firstBlock()
+        while block.isValid():
+            self.blocks.append(self.blockData(block))
+            block = block.next()
+        document.contentsChange.connect(self.contentsChanged)
+
+    def addIndex(self, index):
+        self.indexes.append(index)
+        # Catch the new index up with what is already in the document
+        block = self.document.firstBlock()
+        while block.isValid():
+            index.blockChanged(block, self.blockData(block))
+            block = block.next()
+        index.flush()
+
+    def blockData(self, block):
+        data = block.userData()
+        if data is None:
+            data = BlockData()
+            block.setUserData(data)
+        return data
+
+    def contentsChanged(self, position, charsRemoved, charsAdded):
+        # Every block touched by the inserted (or re-formatted) text
+        block = self.document.findBlock(position)
+        last = self.document.findBlock(position + charsAdded)
+        if (not block.isValid()):
+            block = self.document.lastBlock()
+        if (not last.isValid()):
+            last = self.document.lastBlock()
+        changed = [block]
+        while (changed[-1] != last and changed[-1].next().isValid()):
+            changed.append(changed[-1].next())
+
+        # Blocks in front of and after the change are untouched, so it ran
+        # over as many of the old blocks as it left, and the ones it removed.
+        # Qt deletes the user data of removed blocks, sip tells us which ones
+        first = block.blockNumber()
+        end = first + len(changed) + len(self.blocks) - self.document.blockCount()
+        removed = []
+        if (first <= end <= len(self.blocks)):
+            removed = [data for data in self.blocks[first:end] if sip.isdeleted(data)]
+            self.blocks[first:end] = [self.blockData(block) for block in changed]
+        if (len(self.blocks) != self.document.blockCount()):
+            removed += self.sweep()
+        for data in removed:
+            for index in self.indexes:
+                index.blockRemoved(data)
+
+        for block in changed:
+            data = self.blockData(block)
+            for index in self.indexes:
+                index.blockChanged(block, data)
+
+        for index in self.indexes:
+            index.flush()
+
+    def sweep(self):
+        # Out of step with the document, every block is read again
+        removed = [data for data in self.blocks if sip.isdeleted(data)]
+        blocks = []
+        block = self.document.firstBlock()
+        while block.isValid():
+            blocks.append(self.blockData(block))
+            block = block.next()
+        # In place, SearchIndex shares the list
+        self.blocks[:] = blocks
+        return removed
+
+# Extensions after a character's name, e.g. (V.O.) or (CONT'D)
+CHARACTER_EXTENSION = re.compile(r"\s*\([^()]*\)\s*$")
+
+def characterName(text):
+    name = text.strip().upper()
+    while True:
+        stripped = CHARACTER_EXTENSION.sub("", name)
+        if (stripped == name):
+            return name
+        name = stripped
+
+class CharacterIndex(QObject):
+    # Character names used in the document, with how often each one speaks
+    changed = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super(CharacterIndex, self).__init__(parent)
+        self.counts = {}
+        self.dirty = False
+
+    def blockChanged(self, block, data):
+        name = None
+        if (blockState(block) == FormatState.Character):
+            name = characterName(block.text()) or None
+        if (name == data.character):
+            return
+        if (data.character is not None):
+            self.remove(data.character)
+        if (name is not None):
+            self.counts[name] = self.counts.get(name, 0) + 1
+        data.character = name
+        self.dirty = True
+
+    def blockRemoved(self, data):
+        if (data.character is not None):
+            self.remove(data.character)
+            self.dirty = True
+
+    def remove(self, name):
+        self.counts[name] -= 1
+        if (self.counts[name] <= 0):
+            del self.counts[name]
+
+    def flush(self):
+        if (self.dirty):
+            self.dirty = False
+            self.changed.emit()
+
+    def count(self, name):
+        return self.counts.get(name, 0)
+
+    def names(self):
+        return sorted(self.counts)
+
+class SearchIndex(QObject):
+    # Text and element type of every block, in the tracker's document order.
+    # A search runs one regular expression over the joined text of the
+    # whole script, instead of asking Qt for every block's text
+    changed = pyqtSignal()
+
+    def __init__(self, tracker, parent=None):
+        super(SearchIndex, self).__init__(parent)
+        self.tracker = tracker
+        self.document = tracker.document
+        self.blocks = tracker.blocks    # BlockData, in document order
+        self.dirty = False
+        # Built by the first search after a change
+        self.corpus = None      # joined text of the blocks
+        self.folded = None      # same in lower case, for case insensitive searches
+        self.starts = []
+        self.speakerList = None
+
+    def blockChanged(self, block, data):
+        data.text = block.text()
+        data.state = blockState(block)
+        data.speaker = characterName(data.text) if (data.state == FormatState.Character) else None
+        self.corpus = None
+        self.dirty = True
+
+    def blockRemoved(self, data):
+        self.corpus = None
+        self.dirty = True
+
+    def flush(self):
+        if (self.dirty):
+            self.dirty = False
+            self.changed.emit()
+
+    def update(self):
+        if (self.corpus is None):
+            texts = [data.text for data in self.blocks]
+            self.corpus = "\n".join(texts)
+            self.folded = None
+            self.speakerList = None
+            self.starts = list(accumulate((len(text) + 1 for text in texts[:-1]), initial=0))
+
+    def blockText(self, number):
+        self.update()
+        return self.blocks[number].text if (number < len(self.blocks)) else ""
+
+    def foldedCorpus(self):
+        # Only usable when lower case doesn't change the length of the text
+        if (self.folded is None):
+            folded = self.corpus.lower()
+            self.folded = folded if (len(folded) == len(self.corpus)) else ""
+        return self.folded
+
+    def speakers(self):
+        # Character speaking in each block: set by a Character block, kept
+        # through its Dialogue and Paranthesis blocks
+        if (self.speakerList is None):
+            self.speakerList = []
+            speaker = None
+            for data in self.blocks:
+                if (data.state == FormatState.Character):
+                    speaker = data.speaker
+                elif (data.state not in (FormatState.Dialogue, FormatState.Paranthesis)):
+                    speaker = None
+                self.speakerList.append(speaker)
+        return self.speakerList
+
+    def search(self, pattern, regex=False, caseSensitive=False, wholeWords=False,
+               states=None, character=None, limit=None):
+        # Matches as (block number, start, end, re match) in document order.
+        # states limits the search to those element types, character to the
+        # blocks spoken by that character. Raises re.error for a bad pattern
+        self.update()
+        corpus = self.corpus
+        flags = re.MULTILINE
+        if (not regex):
+            # Plain text is searched for in the lower case copy, much faster than IGNORECASE
+            if (not caseSensitive and self.foldedCorpus()):
+                corpus = self.folded
+                pattern = pattern.lower()
+                caseSensitive = True
+            pattern = re.escape(pattern)
+        if (wholeWords):
+            pattern = r"\b(?:" + pattern + r")\b"
+        if (not caseSensitive):
+            flags |= re.IGNORECASE
+        expression = re.compile(pattern, flags)
+
+        speakers = None
+        if (character):
+            character = characterName(character)
+            speakers = self.speakers()
+
+        matches = []
+        for found in expression.finditer(corpus):
+            start, end = found.span()
+            if (start == end):
+                continue
+            number = bisect_right(self.starts, start) - 1
+            data = self.blocks[number]
+            blockStart = self.starts[number]
+            # Matches can't run into the next block
+            if (end > blockStart + len(data.text)):
+                continue
+            if (states is not None and data.state not in states):
+                continue
+            if (speakers is not None and speakers[number] != character):
+                continue
+            matches.append((number, start - blockStart, end - blockStart, found))
+            if (limit is not None and len(matches) >= limit):
+                break
+        return matches
+
+class Scene:
+    # A heading and the blocks up to the next one
+    def __init__(self, document, block, data):
+        # Qt keeps the cursor at the heading while the text around it changes
+        self.cursor = QTextCursor(document)
+        self.cursor.setPosition(block.position())
+        self.data = data
+        self.heading = ""
+        self.lines = 0
+        self.characters = {}    # name -> times the character speaks
+        self.page = 1           # estimated page the scene starts on
+
+    def position(self):
+        return self.cursor.position()
+
+    def pages(self):
+        return self.lines / PAGE_LINES
+
+class SceneIndex(QObject):
+    # Scenes of the document in order, found by position without going over
+    # the document. Changes only recount the scenes they touched
+    changed = pyqtSignal()
+
+    def __init__(self, document, parent=None):
+        super(SceneIndex, self).__init__(parent)
+        self.document = document
+        self.scenes = []
+        self.byData = {}        # heading BlockData -> Scene
+        self.dirty = set()      # scenes to recount
+        self.leadDirty = True   # blocks in front of the first heading
+        self.leadLines = 0
+        self.reordered = False
+        self.retired = []       # cursors of removed scenes, see removeScene
+
+    def sceneAt(self, position):
+        # Number of the scene the position is in, -1 in front of the first heading
+        low, high = 0, len(self.scenes)
+        while low < high:
+            middle = (low + high) // 2
+            if (self.scenes[middle].position() <= position):
+                low = middle + 1
+            else:
+                high = middle
+        return low - 1
+
+    def markDirty(self, position):
+        number = self.sceneAt(position)
+        if (number < 0):
+            self.leadDirty = True
+        else:
+            self.dirty.add(self.scenes[number])
+
+    def blockChanged(self, block, data):
+        heading = (blockState(block) == FormatState.Heading)
+        scene = self.byData.get(data)
+        if (heading and scene is None):
+            scene = Scene(self.document, block, data)
+            self.scenes.insert(self.sceneAt(block.position()) + 1, scene)
+            self.byData[data] = scene
+            self.reordered = True
+        elif (not heading and scene is not None):
+            self.removeScene(scene)
+        elif (scene is not None):
+            # e.g. a new line typed in front of the heading
+            scene.cursor.setPosition(block.position())
+        # Also recounts the scene in front, which may have grown or shrunk
+        self.markDirty(block.position())
+        self.markDirty(max(block.position() - 1, 0))
+
+    def blockRemoved(self, data):
+        scene = self.byData.get(data)
+        if (scene is not None):
+            self.removeScene(scene)
+
+    def removeScene(self, scene):
+        number = self.scenes.index(scene)
+        del self.scenes[number]
+        del self.byData[scene.data]
+        self.dirty.discard(scene)
+        # QTextDocument.clear() puts its list of cursors back after the change
+        # signals, a cursor deleted in between would be left dangling in it
+        self.retired.append(scene.cursor)
+        if (len(self.retired) == 1):
+            QTimer.singleShot(0, self.retired.clear)
+        if (number > 0):
+            self.dirty.add(self.scenes[number - 1])
+        else:
+            self.leadDirty = True
+        self.reordered = True
+
+    def count(self, block):
+        # Lines and characters from block up to the next heading
+        lines = 0
+        characters = {}
+        while block.isValid():
+            state = blockState(block)
+            text = block.text()
+            lines += blockLines(state, text)
+            if (state == FormatState.Character):
+                name = characterName(text)
+                if (name):
+                    characters[name] = characters.get(name, 0) + 1
+            block = block.next()
+            if (block.isValid() and blockState(block) == FormatState.Heading):
+                break
+        return lines, characters
+
+    def flush(self):
+        if (not self.dirty and not self.leadDirty and not self.reordered):
+            return
+        for scene in self.dirty:
+            block = self.document.findBlock(scene.position())
+            scene.heading = block.text().strip()
+            scene.lines, scene.characters = self.count(block)
+        if (self.leadDirty):
+            self.leadLines = 0
+            first = self.document.firstBlock()
+            if (blockState(first) != FormatState.Heading):
+                self.leadLines = self.count(first)[0]
+        self.dirty.clear()
+        self.leadDirty = False
+        self.reordered = False
+
+        # Page estimates follow from the lines in front of every scene
+        lines = self.leadLines
+        for scene in self.scenes:
+            scene.page = lines // PAGE_LINES + 1
+            lines += scene.lines
+        self.changed.emit()
+
+# Elements counted as dialogue and as action by StatisticsIndex.ratio
+DIALOGUE_STATES = (FormatState.Character, FormatState.Dialogue, FormatState.Paranthesis)
+ACTION_STATES = (FormatState.Action,)
+
+class StatisticsIndex(QObject):
+    # Running totals of words and printed lines per element type. Every block
+    # remembers what it added, a change takes that back out and adds the
+    # block as it is now, so the totals never need the whole document.
+    # Reads the text and element type SearchIndex keeps on the BlockData, it
+    # has to be added to the tracker after it
+    changed = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super(StatisticsIndex, self).__init__(parent)
+        self.words = {}         # FormatState -> words
+        self.lines = {}         # FormatState -> printed lines, blank lines in front included
+        self.scenes = 0
+        self.dirty = False
+
+    def blockChanged(self, block, data):
+        state = data.state
+        # Printed lines are cached on the BlockData, shared with PageIndex
+        key = (state, data.text)
+        if (data.pageKey != key):
+            data.pageKey = key
+            data.pageLines = elementLines(state, data.text)
+        counts = (state, len(data.text.split()), ELEMENT_LAYOUT[state][2] + len(data.pageLines))
+        if (counts == data.counts):
+            return
+        if (data.counts is not None):
+            self.add(data.counts, -1)
+        self.add(counts, 1)
+        data.counts = counts
+        self.dirty = True
+
+    def blockRemoved(self, data):
+        if (data.counts is not None):
+            self.add(data.counts, -1)
+            data.counts = None
+            self.dirty = True
+
+    def add(self, counts, sign):
+        state, words, lines = counts
+        self.words[state] = self.words.get(state, 0) + sign * words
+        self.lines[state] = self.lines.get(state, 0) + sign * lines
+        if (state == FormatState.Heading):
+            self.scenes += sign
+
+    def flush(self):
+        if (self.dirty):
+            self.dirty = False
+            self.changed.emit()
+
+    def wordCount(self):
+        return sum(self.words.values())
+
+    def lineCount(self):
+        return sum(self.lines.values())
+
+    def ratio(self):
+        # Share of the dialogue in the printed lines of dialogue and action
+        dialogue = sum(self.lines.get(state, 0) for state in DIALOGUE_STATES)
+        action = sum(self.lines.get(state, 0) for state in ACTION_STATES)
+        if (dialogue + action == 0):
+            return 0.0
+        return dialogue / (dialogue + action)
@@ -0,0 +1,362 @@
+import os
+import json
+
+from PyQt5.QtCore import (QObject, QRunnable, QThreadPool, QTimer, QLockFile, pyqtSignal)
+from PyQt5.QtGui import QTextCursor
+
+from writerFile import (LOADING_PROPERTY, blockRecord, encodeRecord, insertRecords)
+from writerSave import atomicWrite
+
+# Crash recovery journal, kept next to the script as .<name>.journal:
+#   line 1   WRITERJOURNAL 1
+#   line 2   json header, the size and modification time of the saved script
+#            the entries apply to
+#   line 3+  one json entry per batch of edits: [first block, blocks removed,
+#            block records] replaces that many blocks (of the script as the
+#            entry before left it) with the records, see writerFile. A
+#            compacted journal starts with the whole script as one entry
+#            that removes everything (-1)
+# Every save starts the journal over and closing the window removes it, so a
+# journal that is found (and not locked by a running Writer) when its script
+# is opened was left behind by a crash
+JOURNAL_MAGIC = "WRITERJOURNAL"
+JOURNAL_VERSION = 1
+# Edits further apart (in blocks) than this are written as separate entries
+# instead of one entry with everything in between
+WINDOW_GAP = 64
+
+def journalPath(filename):
+    folder, name = os.path.split(os.path.abspath(filename))
+    return os.path.join(folder, "." + name + ".journal")
+
+def fileStamp(filename):
+    info = os.stat(filename)
+    return {"size": info.st_size, "mtime": info.st_mtime_ns}
+
+def journalHeader(filename):
+    return JOURNAL_MAGIC + " " + str(JOURNAL_VERSION) + "\n" + json.dumps(fileStamp(filename)) + "\n"
+
+def lockJournal(path):
+    # The journal's lock, None while another Writer holds it. Locks left by
+    # a process that is gone are taken over
+    lock = QLockFile(path + ".lock")
+    lock.setStaleLockTime(0)
+    if (not lock.tryLock(0)):
+        return None
+    return lock
+
+def readJournal(path):
+    # (header, entries, bytes read), a last line cut short by the crash is
+    # left out along with anything after it
+    with open(path, "rb") as file:
+        data = file.read()
+    lines = data.split(b"\n")
+    if (len(lines) < 3 or lines[0].decode("utf-8", "replace").split()[:1] != [JOURNAL_MAGIC]):
+        raise ValueError("Not a Writer journal")
+    if (int(lines[0].split()[1]) > JOURNAL_VERSION):
+        raise ValueError("Journal was written by a newer version of Writer")
+    header = json.loads(lines[1])
+    length = len(lines[0]) + len(lines[1]) + 2
+    entries = []
+    # The last item is whatever follows the last newline
+    for line in lines[2:-1]:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            break
+        entries.append(entry)
+        length += len(line) + 1
+    return header, entries, length
+
+def canReplay(header, entries, filename):
+    # Entries only apply to the script they were journaled on, unless the
+    # journal was compacted (it then holds the whole script)
+    if (not entries):
+        return False
+    if (entries[0][1] < 0):
+        return True
+    try:
+        return fileStamp(filename) == {"size": header.get("size"), "mtime": header.get("mtime")}
+    except OSError:
+        return False
+
+def replayJournal(document, entries, formats):
+    # Applies the entries in one edit that can't be undone
+    undoEnabled = document.isUndoRedoEnabled()
+    document.setProperty(LOADING_PROPERTY, True)
+    document.setUndoRedoEnabled(False)
+    cursor = QTextCursor(document)
+    cursor.beginEditBlock()
+    for first, removed, records in entries:
+        if (removed < 0):
+            cursor.select(QTextCursor.Document)
+        else:
+            block = document.findBlockByNumber(first)
+            last = document.findBlockByNumber(first + removed - 1)
+            cursor.setPosition(block.position())
+            cursor.setPosition(last.position() + last.length() - 1, QTextCursor.KeepAnchor)
+        # Leaves one empty block for the first record
+        cursor.removeSelectedText()
+        insertRecords(cursor, records, formats, first=True)
+    cursor.endEditBlock()
+    document.setUndoRedoEnabled(undoEnabled)
+    document.setProperty(LOADING_PROPERTY, False)
+
+def snapshotEntry(document, formats):
+    # The whole script as one entry
+    records = []
+    block = document.firstBlock()
+    while block.isValid():
+        records.append(blockRecord(block, formats))
+        block = block.next()
+    return encodeRecord([0, -1, records]) + "\n"
+
+class CompactSignals(QObject):
+    # journal generation, snapshot entry
+    finished = pyqtSignal(int, str)
+
+class CompactTask(QRunnable):
+    def __init__(self, generation, snapshot, formats, signals):
+        super(CompactTask, self).__init__()
+        self.generation = generation
+        self.snapshot = snapshot
+        self.formats = formats
+        self.signals = signals
+
+    def run(self):
+        self.signals.finished.emit(self.generation, snapshotEntry(self.snapshot, self.formats))
+
+class ScriptJournal(QObject):
+    # Appends the document's edits to the script's journal. Changes collect
+    # in a window of blocks, which is written as one entry (the blocks as
+    # they are now) a moment after the first change, so a burst of typing
+    # costs one short line instead of one per keystroke
+    def __init__(self, document, formats, delay=300, compactSize=0, parent=None):
+        super(ScriptJournal, self).__init__(parent)
+        self.document = document
+        self.formats = formats
+        self.compactSize = compactSize
+        self.filename = ""
+        self.path = None
+        self.file = None
+        self.lock = None
+        self.header = ""
+        self.size = 0
+        self.baseSize = 0           # size of the journal when it was last rewritten
+        self.generation = 0
+        self.blockCount = document.blockCount()
+        self.window = None          # [first block, end block, block count delta] not written yet
+        self.written = 0            # entries written to this journal
+        self.saves = []             # entries written when each pending save was taken
+        self.compaction = None      # same for the compaction being written
+        self.entries = []           # (entry number, line) the pending saves and compaction still need
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay)
+        self.timer.timeout.connect(self.flush)
+
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(1)
+        self.signals = CompactSignals()
+        self.signals.finished.connect(self.compacted)
+
+        document.contentsChange.connect(self.contentsChange)
+
+    def isActive(self):
+        return self.file is not None
+
+    def start(self, filename, lock=None):
+        # Journals the script from its saved file on, lock being the journal's
+        # lock when the caller took it already. False when another Writer
+        # journals the script
+        self.close()
+        path = journalPath(filename)
+        if (lock is None):
+            lock = lockJournal(path)
+            if (lock is None):
+                return False
+        self.lock = lock
+        self.path = path
+        self.filename = filename
+        self.header = journalHeader(filename)
+        self.rewrite(self.header)
+        # Edits made before the journal started (e.g. while the script was
+        # still streaming in) are only in the document
+        if (self.document.isModified()):
+            self.compact()
+        return True
+
+    def resume(self, filename, lock, length):
+        # Goes on with a journal that was just replayed, without the cut off
+        # line it may end in
+        self.close()
+        self.lock = lock
+        self.path = journalPath(filename)
+        self.filename = filename
+        with open(self.path, "rb") as file:
+            self.header = b"".join(file.readline() for i in range(2)).decode("utf-8")
+        os.truncate(self.path, length)
+        self.file = open(self.path, "at", encoding="utf-8")
+        self.size = length
+        self.baseSize = length
+
+    def close(self):
+        # Clean end of the journal: there is nothing left to recover
+        self.timer.stop()
+        self.window = None
+        self.saves = []
+        self.compaction = None
+        self.entries = []
+        self.generation += 1
+        if (self.file is not None):
+            self.file.close()
+            self.file = None
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        if (self.lock is not None):
+            self.lock.unlock()
+            self.lock = None
+        self.path = None
+        self.filename = ""
+
+    def rewrite(self, text):
+        if (self.file is not None):
+            self.file.close()
+        atomicWrite(self.path, text)
+        self.file = open(self.path, "at", encoding="utf-8")
+        self.size = len(text)
+        self.baseSize = self.size
+
+    def contentsChange(self, position, removed, added):
+        count = self.document.blockCount()
+        delta = count - self.blockCount
+        self.blockCount = count
+        if (self.file is None):
+            return
+        first = max(self.document.findBlock(position).blockNumber(), 0)
+        last = self.document.findBlock(position + added).blockNumber()
+        if (last < 0):
+            last = count - 1
+        if (self.document.property(LOADING_PROPERTY)):
+            # A loader's blocks go in after the block it is at, they are
+            # in the saved script already
+            if (self.window is not None and self.window[1] > first + 1):
+                self.window[1] += delta
+            return
+
+        # The change replaced blocks first to changeEnd of the document before it
+        changeEnd = last + 1 - delta
+        if (self.window is not None):
+            start, end, windowDelta = self.window
+            if (first <= end + WINDOW_GAP and changeEnd + WINDOW_GAP >= start):
+                self.window = [min(start, first), max(end, changeEnd) + delta, windowDelta + delta]
+                return
+            # The blocks changed so far aren't touched by this change, they
+            # only move when it is above them
+            self.writeWindow(delta if changeEnd <= start else 0)
+        self.window = [first, last + 1, delta]
+        if (not self.timer.isActive()):
+            self.timer.start()
+
+    def writeWindow(self, shift=0):
+        start, end, delta = self.window
+        self.window = None
+        records = []
+        block = self.document.findBlockByNumber(start + shift)
+        for number in range(end - start):
+            records.append(blockRecord(block, self.formats))
+            block = block.next()
+        self.append(encodeRecord([start, end - start - delta, records]) + "\n")
+
+    def append(self, line):
+        # Flushed to the system straight away, it survives the process dying
+        self.file.write(line)
+        self.file.flush()
+        self.size += len(line)
+        self.written += 1
+        if (self.saves or self.compaction is not None):
+            self.entries.append((self.written, line))
+
+    def flush(self):
+        self.timer.stop()
+        if (self.window is not None and self.file is not None):
+            self.writeWindow()
+        # Compacting is only worth it once the edits outgrow what was rewritten last
+        if (self.compactSize > 0 and self.size - self.baseSize > self.compactSize):
+            self.compact()
+
+    def checkpoint(self):
+        # A save took its snapshot of the document, returns the save's
+        # checkpoint (to hand back to saved or saveFailed)
+        self.flush()
+        self.saves.append(self.written)
+        return self.written
+
+    def saved(self, filename, checkpoint):
+        # The saved file holds everything up to the save's checkpoint, the
+        # journal starts over from it with the entries written since
+        if (self.file is None or filename != self.filename):
+            # Saved under a new name, its journal starts with the save
+            self.start(filename)
+            return
+        # Edits not written yet go in while the save still holds on to them
+        self.timer.stop()
+        if (self.window is not None):
+            self.writeWindow()
+        self.dropSave(checkpoint)
+        self.header = journalHeader(filename)
+        self.rewrite(self.header + "".join(line for entry, line in self.entries if entry > checkpoint))
+        self.dropEntries()
+
+    def saveFailed(self, checkpoint):
+        # The journal still goes back to the last save that worked
+        self.dropSave(checkpoint)
+        self.dropEntries()
+
+    def saveReplaced(self, checkpoint):
+        # A newer save was asked for before this one started, it never runs
+        self.dropSave(checkpoint)
+        self.dropEntries()
+
+    def dropSave(self, checkpoint):
+        # Saves of the same edits share a checkpoint, each one takes one
+        if (checkpoint in self.saves):
+            self.saves.remove(checkpoint)
+
+    def dropEntries(self):
+        # Only what the oldest pending save or compaction needs is kept
+        pending = self.saves + ([self.compaction] if self.compaction is not None else [])
+        if (pending):
+            oldest = min(pending)
+            self.entries = [(entry, line) for entry, line in self.entries if entry > oldest]
+        else:
+            self.entries = []
+
+    def compact(self):
+        # The script as one entry, encoded on a worker thread from a snapshot
+        if (self.file is None or self.compaction is not None):
+            return
+        if (self.window is not None):
+            self.writeWindow()
+        self.compaction = self.written
+        self.pool.start(CompactTask(self.generation, self.document.clone(), self.formats, self.signals))
+
+    def compacted(self, generation, snapshot):
+        if (generation != self.generation or self.file is None):
+            self.compaction = None
+            self.dropEntries()
+            return
+        self.timer.stop()
+        if (self.window is not None):
+            self.writeWindow()
+        number = self.compaction
+        self.compaction = None
+        self.rewrite(self.header + snapshot + "".join(line for entry, line in self.entries if entry > number))
+        self.dropEntries()
+
+    def wait(self):
+        # Block until a compaction being encoded is done
+        self.pool.waitForDone()
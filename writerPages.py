@@ -0,0 +1,362 @@
+import re
+from bisect import (bisect_left, bisect_right)
+
+from PyQt5.QtCore import (QObject, QPointF, QMarginsF, pyqtSignal)
+from PyQt5.QtGui import (QPainter, QFont, QPageLayout, QPageSize)
+
+from writerFormats import (FormatState, CHAR_STYLES)
+
+# Screenplay pages in Courier 12: 10 characters and 6 lines to the inch on
+# US letter, 1.5" left margin and 1" at the top. Everything below is counted
+# in characters and lines, never measured with a font
+PAGE_WIDTH = 8.5
+PAGE_HEIGHT = 11.0
+CHARS_PER_INCH = 10
+LINES_PER_INCH = 6
+LEFT_MARGIN = 1.5
+TOP_MARGIN = 1.0
+PAGE_LINES = 54
+LINE_CHARS = 60
+
+# For every element: indent from the left margin (characters), width
+# (characters) and blank lines in front of it
+ELEMENT_LAYOUT = {
+    FormatState.Action:         (0, 60, 1),
+    FormatState.Character:      (22, 38, 1),
+    FormatState.Dialogue:       (10, 35, 0),
+    FormatState.Paranthesis:    (16, 25, 0),
+    FormatState.Heading:        (0, 60, 1),
+    FormatState.Transition:     (0, 60, 1),     # right aligned
+    FormatState.NoState:        (0, 60, 1),
+}
+UPPERCASE_STATES = (FormatState.Character, FormatState.Heading, FormatState.Transition)
+
+# Fewest lines of a block left at the bottom or carried to the top of a page
+MIN_LINES = 2
+MORE = "(MORE)"
+CONTINUED = " (CONT'D)"
+CONTINUED_NAME = re.compile(r"\s*\(CONT'D\)\s*$", re.IGNORECASE)
+
+def wrapText(text, width):
+    # Greedy word wrap, every character being as wide as the next
+    lines = []
+    line = ""
+    for word in text.split():
+        while len(word) > width:
+            if (line):
+                lines.append(line)
+                line = ""
+            lines.append(word[:width])
+            word = word[width:]
+        if (not line):
+            line = word
+        elif (len(line) + 1 + len(word) <= width):
+            line += " " + word
+        else:
+            lines.append(line)
+            line = word
+    lines.append(line)
+    return lines
+
+def elementLines(state, text):
+    # Printed lines of a block
+    if (state in UPPERCASE_STATES):
+        text = text.upper()
+    return wrapText(text, ELEMENT_LAYOUT[state][1])
+
+def blockLines(state, text):
+    # Lines a block takes up, blank lines in front included
+    return ELEMENT_LAYOUT[state][2] + len(elementLines(state, text))
+
+class Page:
+    # A printed page. start is where it begins: (block, line in that block,
+    # character continued from the previous page or None). items are
+    # (block offset from the start block, first line, end line, blank lines in front)
+    def __init__(self, start):
+        self.start = start
+        self.items = []
+        self.more = False
+        self.number = 1
+
+    def continued(self):
+        return self.start[2]
+
+    def blocks(self):
+        return [(self.start[0] + offset, first, last, blank) for offset, first, last, blank in self.items]
+
+    def shift(self, delta):
+        # Blocks were added or removed in front of the page
+        self.start = (self.start[0] + delta,) + self.start[1:]
+
+def keepLines(elements, block):
+    # Lines after the block that have to be on the same page as its end:
+    # a heading keeps with what follows, a character (or parenthetical)
+    # with the start of the dialogue
+    state = elements[block][0]
+    if (state not in (FormatState.Heading, FormatState.Character, FormatState.Paranthesis) or
+        block + 1 >= len(elements)):
+        return 0
+    nextState, nextLines = elements[block + 1]
+    if (state != FormatState.Heading and nextState not in (FormatState.Dialogue, FormatState.Paranthesis)):
+        return 0
+    blank = ELEMENT_LAYOUT[nextState][2]
+    if (nextState in (FormatState.Character, FormatState.Paranthesis)):
+        return blank + len(nextLines) + keepLines(elements, block + 1)
+    return blank + min(MIN_LINES, len(nextLines))
+
+def splitAt(state, remaining, free):
+    # Lines of a block that can stay on this page when it doesn't fit
+    # (0: the block moves to the next page). Dialogue leaves a line for (MORE)
+    if (state == FormatState.Dialogue):
+        free -= 1
+    elif (state not in (FormatState.Action, FormatState.NoState)):
+        return 0
+    if (free >= MIN_LINES and remaining - free >= MIN_LINES):
+        return free
+    return 0
+
+def speakerOf(elements, block):
+    # Character line (extension included) whose speech the block is part of
+    while block > 0 and elements[block][0] in (FormatState.Dialogue, FormatState.Paranthesis):
+        block -= 1
+    if (elements[block][0] == FormatState.Character):
+        return CONTINUED_NAME.sub("", " ".join(elements[block][1]))
+    return None
+
+def paginate(elements, start=(0, 0, None), number=1):
+    # Pages of elements, a sequence of (FormatState, printed lines), from a
+    # page start on. A generator, so callers can stop once the rest is known
+    count = len(elements)
+    block, line, continued = start
+    while block < count:
+        page = Page((block, line, continued))
+        page.number = number
+        used = 1 if continued else 0
+        continued = None
+        while block < count:
+            state, lines = elements[block]
+            blank = ELEMENT_LAYOUT[state][2] if (used and line == 0) else 0
+            remaining = len(lines) - line
+            free = PAGE_LINES - used - blank
+            if (remaining + (keepLines(elements, block) if remaining else 0) <= free):
+                page.items.append((block - page.start[0], line, len(lines), blank))
+                used += blank + remaining
+                block += 1
+                line = 0
+                continue
+
+            # Doesn't fit: split it, or leave it for the next page
+            split = splitAt(state, remaining, free)
+            if (not page.items and not split):
+                # Alone on the page and still too long, it has to be broken somewhere
+                split = min(remaining, free) if (remaining > free) else remaining
+            if (split):
+                page.items.append((block - page.start[0], line, line + split, blank))
+                line += split
+                if (line >= len(lines)):
+                    block += 1
+                    line = 0
+                elif (state == FormatState.Dialogue):
+                    page.more = True
+                    continued = speakerOf(elements, block)
+            break
+        yield page
+        number += 1
+
+class BlockElements:
+    # The document's blocks as paginate's elements. Printed lines are cached
+    # on the blocks' BlockData until the text or element type changes
+    def __init__(self, blocks):
+        self.blocks = blocks
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __getitem__(self, number):
+        data = self.blocks[number]
+        key = (data.state, data.text)
+        if (data.pageKey != key):
+            data.pageKey = key
+            data.pageLines = elementLines(data.state, data.text)
+        return data.state, data.pageLines
+
+class PageIndex(QObject):
+    # Page breaks of the document, kept by a BlockTracker. After a change
+    # pagination starts again a page in front of the first changed block,
+    # and stops as soon as a page starts where it started before (past the
+    # changed blocks), since the rest can't have changed
+    changed = pyqtSignal()
+
+    def __init__(self, searchIndex, parent=None):
+        super(PageIndex, self).__init__(parent)
+        self.searchIndex = searchIndex
+        self.pages = []
+        self.starts = []        # (block, line) every page starts at, for bisecting
+        self.blockCount = 0
+        self.dirtyFrom = 0      # lowest changed block number, None when up to date
+        self.dirtyTo = -1       # highest one
+        self.dirtyCount = 0     # blocks in the document when dirtyTo was last set
+        self.touched = False
+
+    def blockChanged(self, block, data):
+        number = block.blockNumber()
+        count = block.document().blockCount()
+        if (number <= self.dirtyTo):
+            # Blocks added or removed in front of it moved the last changed block
+            self.dirtyTo += count - self.dirtyCount
+        self.dirtyCount = count
+        self.dirtyFrom = number if self.dirtyFrom is None else min(self.dirtyFrom, number)
+        self.dirtyTo = max(self.dirtyTo, number)
+        self.touched = True
+
+    def blockRemoved(self, data):
+        self.touched = True
+
+    def flush(self):
+        if (self.touched):
+            self.touched = False
+            self.changed.emit()
+
+    def elements(self):
+        return BlockElements(self.searchIndex.blocks)
+
+    def pageAt(self, blockNumber):
+        # Index of the page the block starts on
+        return max(bisect_left(self.starts, (blockNumber + 1,)) - 1, 0)
+
+    def update(self):
+        if (self.dirtyFrom is None):
+            return self.pages
+        elements = self.elements()
+        blocks = elements.blocks
+        delta = len(blocks) - self.blockCount
+        lastChanged = self.dirtyTo
+
+        # The page in front of the change may lose a heading (or character)
+        # that is kept with the next page
+        first = max(self.pageAt(self.dirtyFrom) - 1, 0) if self.pages else 0
+        start = self.pages[first].start if (first < len(self.pages)) else (0, 0, None)
+        oldStarts = {}
+        for index in range(first + 1, len(self.pages)):
+            oldStarts[self.pages[index].start] = index
+
+        pages = self.pages[:first]
+        for page in paginate(elements, start, first + 1):
+            if (page.start[0] > lastChanged):
+                oldKey = (page.start[0] - delta,) + page.start[1:]
+                index = oldStarts.get(oldKey)
+                if (index is not None):
+                    # Same start past the change: the rest is as it was
+                    for old in self.pages[index:]:
+                        old.shift(delta)
+                        old.number = len(pages) + 1
+                        pages.append(old)
+                    break
+            pages.append(page)
+
+        self.pages = pages
+        self.starts = [page.start[:2] for page in pages]
+        self.blockCount = len(blocks)
+        self.dirtyFrom = None
+        self.dirtyTo = -1
+        return self.pages
+
+    def pageCount(self):
+        return len(self.update())
+
+    def pageOf(self, blockNumber, line=0):
+        # Number of the page a block's line is printed on
+        pages = self.update()
+        if (not pages):
+            return 1
+        index = max(bisect_right(self.starts, (blockNumber, line)) - 1, 0)
+        return pages[index].number
+
+    def pagesOf(self, blockNumbers):
+        # pageOf for block numbers in ascending order, in one pass over the pages
+        pages = self.update()
+        numbers = []
+        index = 0
+        for blockNumber in blockNumbers:
+            while (index + 1 < len(pages) and self.starts[index + 1] <= (blockNumber, 0)):
+                index += 1
+            numbers.append(pages[index].number if pages else 1)
+        return numbers
+
+def pageContent(page, elements):
+    # Everything printed on a page but its number, as a hashable tuple:
+    # (continued character, more, ((state, lines, blank lines), ...)).
+    # Equal contents print the same, wherever the page ends up
+    items = tuple((elements[block][0], tuple(elements[block][1][first:end]), blank)
+                  for block, first, end, blank in page.blocks())
+    return (page.continued(), page.more, items)
+
+def elementFont(state, basefont):
+    capitalization, italic, underline, weight = CHAR_STYLES.get(state, CHAR_STYLES[FormatState.Action])
+    font = QFont(basefont)
+    font.setItalic(italic)
+    font.setUnderline(underline)
+    font.setWeight(weight)
+    return font
+
+def pageFonts():
+    basefont = QFont("Courier")
+    basefont.setStyleHint(QFont.TypeWriter)
+    basefont.setPointSizeF(12)
+    fonts = {state: elementFont(state, basefont) for state in ELEMENT_LAYOUT}
+    fonts[None] = basefont
+    return fonts
+
+def drawLine(painter, dpi, line, column, text, font):
+    # Text sits on the baseline, a little above the bottom of its line
+    painter.setFont(font)
+    painter.drawText(QPointF((LEFT_MARGIN + column / CHARS_PER_INCH) * dpi,
+                             (TOP_MARGIN + (line + 0.8) / LINES_PER_INCH) * dpi), text)
+
+def paintPageNumber(painter, dpi, number, fonts):
+    # Top right corner, from page 2 on
+    if (number > 1):
+        text = str(number) + "."
+        drawLine(painter, dpi, -3, LINE_CHARS - len(text) + 2, text, fonts[None])
+
+def paintPage(painter, dpi, content, fonts):
+    # Draws a pageContent with the fixed metrics above. Painting a QImage
+    # this way is safe on a worker thread too (see writerPreview)
+    continued, more, items = content
+    line = 0
+    characterIndent = ELEMENT_LAYOUT[FormatState.Character][0]
+    if (continued):
+        drawLine(painter, dpi, line, characterIndent, continued + CONTINUED, fonts[FormatState.Character])
+        line += 1
+    for state, lines, blank in items:
+        indent = ELEMENT_LAYOUT[state][0]
+        line += blank
+        for text in lines:
+            column = LINE_CHARS - len(text) if (state == FormatState.Transition) else indent
+            drawLine(painter, dpi, line, column, text, fonts[state])
+            line += 1
+    if (more):
+        drawLine(painter, dpi, line, characterIndent, MORE, fonts[FormatState.Character])
+
+def printPages(printer, pages, elements):
+    # Prints the pages (or writes them to a pdf) on US letter
+    printer.setFullPage(True)
+    printer.setPageLayout(QPageLayout(QPageSize(QPageSize.Letter), QPageLayout.Portrait, QMarginsF(0, 0, 0, 0)))
+    dpi = printer.resolution()
+    fonts = pageFonts()
+
+    # Page range picked in the print dialog
+    first = printer.fromPage() or 1
+    last = printer.toPage() or len(pages)
+
+    painter = QPainter(printer)
+    started = False
+    for page in pages:
+        if (page.number < first or page.number > last):
+            continue
+        if (started):
+            printer.newPage()
+        started = True
+        paintPageNumber(painter, dpi, page.number, fonts)
+        paintPage(painter, dpi, pageContent(page, elements), fonts)
+    painter.end()
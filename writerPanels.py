@@ -0,0 +1,338 @@
+import time
+from collections import OrderedDict
+
+from PyQt5.QtCore import (Qt, QAbstractListModel, QModelIndex, QVariant, QSize)
+from PyQt5.QtGui import (QImage, QPainter, QPixmap, QColor)
+
+from writerFormats import FormatState
+from writerPages import (PAGE_WIDTH, PAGE_HEIGHT, pageFonts, paintPageNumber)
+
+# Role holding the bare name of a row
+NameRole = Qt.UserRole + 1
+
+class CharacterListModel(QAbstractListModel):
+    # Rows of the character side panel: name and number of lines in the script.
+    # Updates are applied row by row, so the view only repaints what changed
+    def __init__(self, parent=None):
+        super(CharacterListModel, self).__init__(parent)
+        self.names = []
+        self.counts = {}
+        self.removable = set()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.names)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if (not index.isValid() or index.row() >= len(self.names)):
+            return QVariant()
+        name = self.names[index.row()]
+        if (role == Qt.DisplayRole):
+            count = self.counts.get(name, 0)
+            return name + ("   " + str(count) + (" line" if count == 1 else " lines") if count else "")
+        if (role == Qt.ToolTipRole):
+            if (name in self.removable):
+                return "Added by hand, press Delete to remove"
+            return "Found in the script"
+        if (role == NameRole):
+            return name
+        return QVariant()
+
+    def nameAt(self, row):
+        return self.names[row]
+
+    def setCharacters(self, names, counts, removable):
+        # Rows that went away
+        wanted = set(names)
+        for row in reversed(range(len(self.names))):
+            if (self.names[row] not in wanted):
+                self.beginRemoveRows(QModelIndex(), row, row)
+                del self.names[row]
+                self.endRemoveRows()
+
+        # Rows that are new, the remaining rows keep their order
+        current = set(self.names)
+        for row, name in enumerate(names):
+            if (row < len(self.names) and self.names[row] == name):
+                continue
+            if (name in current):
+                # The order itself changed, not worth being clever about
+                self.beginResetModel()
+                self.names = list(names)
+                self.counts = dict(counts)
+                self.removable = set(removable)
+                self.endResetModel()
+                return
+            self.beginInsertRows(QModelIndex(), row, row)
+            self.names.insert(row, name)
+            self.endInsertRows()
+
+        # Rows whose line count changed
+        oldCounts = self.counts
+        self.counts = dict(counts)
+        self.removable = set(removable)
+        for row, name in enumerate(self.names):
+            if (oldCounts.get(name, 0) != self.counts.get(name, 0)):
+                index = self.index(row)
+                self.dataChanged.emit(index, index, [Qt.DisplayRole])
+
+# Characters of block text shown around a match
+CONTEXT_CHARS = 30
+
+class SearchResultsModel(QAbstractListModel):
+    # Matches listed by the find dialog: block, element type and the text
+    # around the match. Rows are only formatted when the view asks for them
+    def __init__(self, index, parent=None):
+        super(SearchResultsModel, self).__init__(parent)
+        self.searchIndex = index
+        self.matches = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.matches)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if (not index.isValid() or index.row() >= len(self.matches)):
+            return QVariant()
+        number, start, end, found = self.matches[index.row()]
+        if (role == Qt.DisplayRole):
+            text = self.searchIndex.blockText(number)
+            before = text[max(start - CONTEXT_CHARS, 0):start]
+            after = text[end:end + CONTEXT_CHARS]
+            if (start > CONTEXT_CHARS):
+                before = "..." + before
+            if (end + CONTEXT_CHARS < len(text)):
+                after += "..."
+            state = self.searchIndex.blocks[number].state if (number < len(self.searchIndex.blocks)) else None
+            element = state.name if state is not None else ""
+            return "{:>5}  {:<12} {}[{}]{}".format(number + 1, element, before, text[start:end], after)
+        if (role == Qt.ToolTipRole):
+            return "Line " + str(number + 1)
+        return QVariant()
+
+    def setMatches(self, matches):
+        self.beginResetModel()
+        self.matches = matches
+        self.endResetModel()
+
+    def matchAt(self, row):
+        return self.matches[row]
+
+class SceneListModel(QAbstractListModel):
+    # Rows of the scene navigator: number, heading and estimated page. The
+    # rows are the SceneIndex's own scenes, so counts are always current
+    def __init__(self, parent=None):
+        super(SceneListModel, self).__init__(parent)
+        self.scenes = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.scenes)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if (not index.isValid() or index.row() >= len(self.scenes)):
+            return QVariant()
+        scene = self.scenes[index.row()]
+        if (role == Qt.DisplayRole):
+            return "{}. {}   p. {}".format(index.row() + 1, scene.heading or "(no heading)", scene.page)
+        if (role == Qt.ToolTipRole):
+            # Length in eighths of a page, the way schedules count it
+            eighths = max(1, round(scene.pages() * 8))
+            length = (str(eighths // 8) + " " if eighths >= 8 else "") + (str(eighths % 8) + "/8 " if eighths % 8 else "")
+            characters = ", ".join(sorted(scene.characters)) or "no characters"
+            return scene.heading + "\nPage " + str(scene.page) + ", " + length + "page(s)\n" + characters
+        return QVariant()
+
+    def sceneAt(self, row):
+        return self.scenes[row]
+
+    def setScenes(self, scenes):
+        # Scenes that went away, then the new ones, the rest keep their rows
+        wanted = set(scenes)
+        for row in reversed(range(len(self.scenes))):
+            if (self.scenes[row] not in wanted):
+                self.beginRemoveRows(QModelIndex(), row, row)
+                del self.scenes[row]
+                self.endRemoveRows()
+        for row, scene in enumerate(scenes):
+            if (row < len(self.scenes) and self.scenes[row] is scene):
+                continue
+            self.beginInsertRows(QModelIndex(), row, row)
+            self.scenes.insert(row, scene)
+            self.endInsertRows()
+        # Headings, numbers and pages can change anywhere after an edit
+        if (self.scenes):
+            self.dataChanged.emit(self.index(0), self.index(len(self.scenes) - 1), [Qt.DisplayRole])
+
+class RevisionListModel(QAbstractListModel):
+    # Rows of the revisions dialog: number, name, when and how long, from
+    # the revision headers (see writerRevisions), newest last
+    def __init__(self, parent=None):
+        super(RevisionListModel, self).__init__(parent)
+        self.revisions = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.revisions)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if (not index.isValid() or index.row() >= len(self.revisions)):
+            return QVariant()
+        revision = self.revisions[index.row()]
+        if (role == Qt.DisplayRole):
+            return "{}. {}   {}   {} blocks".format(revision["number"], revision["name"] or "(unnamed)",
+                   time.strftime("%Y-%m-%d %H:%M", time.localtime(revision["time"])), revision["blocks"])
+        if (role == Qt.ToolTipRole):
+            return ("Stored as changes to revision " + str(revision["number"] - 1) if revision["delta"]
+                    else "Stored whole") + ", " + str(max(1, round(revision["size"] / 1024))) + " KB"
+        return QVariant()
+
+    def setRevisions(self, revisions):
+        # Revisions are only ever added
+        if (len(revisions) < len(self.revisions) or revisions[:len(self.revisions)] != self.revisions):
+            self.beginResetModel()
+            self.revisions = list(revisions)
+            self.endResetModel()
+        elif (len(revisions) > len(self.revisions)):
+            self.beginInsertRows(QModelIndex(), len(self.revisions), len(revisions) - 1)
+            self.revisions = list(revisions)
+            self.endInsertRows()
+
+class DiffResultsModel(QAbstractListModel):
+    # Changes listed by the compare dialog (see writerDiff), with the colour
+    # they are marked with in the editor
+    def __init__(self, colors, parent=None):
+        super(DiffResultsModel, self).__init__(parent)
+        self.colors = colors
+        self.changes = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.changes)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if (not index.isValid() or index.row() >= len(self.changes)):
+            return QVariant()
+        change = self.changes[index.row()]
+        if (role == Qt.DisplayRole):
+            element = FormatState(change.state).name if change.state is not None else ""
+            if (change.speaker and element in ("Dialogue", "Paranthesis")):
+                element += " (" + change.speaker + ")"
+            if (change.oldText and change.newText and change.oldText != change.newText):
+                text = change.oldText[:CONTEXT_CHARS] + "  ->  " + change.newText[:CONTEXT_CHARS]
+            else:
+                text = (change.newText or change.oldText)[:2 * CONTEXT_CHARS]
+            return "{:>5}  {:<16} {:<14} {}".format(change.new + 1, change.kind, element, text)
+        if (role == Qt.ToolTipRole):
+            return "\n".join(line for line in ("Was: " + change.oldText if change.oldText else "",
+                                                "Now: " + change.newText if change.newText else "") if line)
+        if (role == Qt.DecorationRole):
+            return QColor(self.colors[change.kind])
+        return QVariant()
+
+    def setChanges(self, changes):
+        self.beginResetModel()
+        self.changes = changes
+        self.endResetModel()
+
+    def changeAt(self, row):
+        return self.changes[row]
+
+# Pages of the preview kept scaled to the current zoom
+SCALED_PAGES = 24
+
+class PreviewPagesModel(QAbstractListModel):
+    # Pages of the print preview, rows are (page number, page content). The
+    # images come from a PageRenderer (see writerPreview), a page is only
+    # asked for when the view paints it. Page numbers are drawn on the
+    # scaled image, so a page moving to another number isn't rendered again
+    def __init__(self, renderer, parent=None):
+        super(PreviewPagesModel, self).__init__(parent)
+        self.renderer = renderer
+        self.pages = []
+        self.rows = {}              # content -> rows showing it
+        self.zoom = 1.0
+        self.scaled = OrderedDict() # row -> QPixmap at the current zoom
+        self.blank = None
+        self.fonts = pageFonts()
+        renderer.pageRendered.connect(self.pageRendered)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.pages)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if (not index.isValid() or index.row() >= len(self.pages)):
+            return QVariant()
+        row = index.row()
+        if (role == Qt.DecorationRole):
+            pixmap = self.scaled.get(row)
+            if (pixmap is not None):
+                self.scaled.move_to_end(row)
+                return pixmap
+            number, content = self.pages[row]
+            image = self.renderer.image(content)
+            if (image is None):
+                self.renderer.request(content)
+                return self.blankPage()
+            pixmap = self.pagePixmap(image, number)
+            self.scaled[row] = pixmap
+            if (len(self.scaled) > SCALED_PAGES):
+                self.scaled.popitem(last=False)
+            return pixmap
+        if (role == Qt.ToolTipRole):
+            return "Page " + str(self.pages[row][0])
+        return QVariant()
+
+    def pageSize(self):
+        dpi = self.renderer.dpi * self.zoom
+        return QSize(round(PAGE_WIDTH * dpi), round(PAGE_HEIGHT * dpi))
+
+    def blankPage(self):
+        # Stands in for pages still being rendered
+        if (self.blank is None):
+            self.blank = QPixmap(self.pageSize())
+            self.blank.fill(Qt.white)
+        return self.blank
+
+    def pagePixmap(self, image, number):
+        scaled = image.scaled(self.pageSize(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        scaled = scaled.convertToFormat(QImage.Format_RGB32)
+        # Point sizes follow the image's resolution
+        dpi = self.renderer.dpi * self.zoom
+        scaled.setDotsPerMeterX(round(dpi / 0.0254))
+        scaled.setDotsPerMeterY(round(dpi / 0.0254))
+        painter = QPainter(scaled)
+        paintPageNumber(painter, dpi, number, self.fonts)
+        painter.setPen(QColor(Qt.darkGray))
+        painter.drawRect(0, 0, scaled.width() - 1, scaled.height() - 1)
+        painter.end()
+        return QPixmap.fromImage(scaled)
+
+    def setPages(self, pages):
+        # Only rows whose number or content changed are painted again
+        old = self.pages
+        if (len(pages) < len(old)):
+            self.beginRemoveRows(QModelIndex(), len(pages), len(old) - 1)
+            self.pages = old[:len(pages)]
+            self.endRemoveRows()
+        elif (len(pages) > len(old)):
+            self.beginInsertRows(QModelIndex(), len(old), len(pages) - 1)
+            self.pages = old + pages[len(old):]
+            self.endInsertRows()
+        self.pages = list(pages)
+        self.rows = {}
+        for row, (number, content) in enumerate(self.pages):
+            self.rows.setdefault(content, []).append(row)
+        changed = [row for row in range(min(len(old), len(pages))) if old[row] != pages[row]]
+        for row in changed:
+            self.scaled.pop(row, None)
+        if (changed):
+            self.dataChanged.emit(self.index(changed[0]), self.index(changed[-1]), [Qt.DecorationRole])
+
+    def pageRendered(self, content):
+        for row in self.rows.get(content, ()):
+            self.scaled.pop(row, None)
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def setZoom(self, zoom):
+        self.layoutAboutToBeChanged.emit()
+        self.zoom = zoom
+        self.scaled.clear()
+        self.blank = None
+        self.layoutChanged.emit()
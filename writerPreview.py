@@ -0,0 +1,195 @@
+from collections import OrderedDict
+
+from PyQt5.QtCore import (Qt, QObject, QRunnable, QThread, QThreadPool, QTimer, pyqtSignal)
+from PyQt5.QtGui import (QImage, QPainter, QFontDatabase)
+from PyQt5.QtWidgets import (QDialog, QGridLayout, QHBoxLayout, QLabel, QPushButton, QListView)
+
+from writerPages import (PAGE_WIDTH, PAGE_HEIGHT, pageFonts, paintPage)
+from writerPanels import PreviewPagesModel
+
+# Resolution pages are rendered at, zooming only scales the rendered images
+PREVIEW_DPI = 96
+ZOOM_STEPS = [0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 2.0]
+# Milliseconds of quiet before an open preview follows the script's changes
+REFRESH_DELAY = 500
+
+def renderPage(content, dpi=PREVIEW_DPI):
+    # A writerPages.pageContent as a grayscale image, page number left out
+    image = QImage(round(PAGE_WIDTH * dpi), round(PAGE_HEIGHT * dpi), QImage.Format_Grayscale8)
+    # Point sizes follow the image's resolution
+    image.setDotsPerMeterX(round(dpi / 0.0254))
+    image.setDotsPerMeterY(round(dpi / 0.0254))
+    image.fill(Qt.white)
+    painter = QPainter(image)
+    paintPage(painter, dpi, content, pageFonts())
+    painter.end()
+    return image
+
+class RenderSignals(QObject):
+    # page content, rendered image
+    rendered = pyqtSignal(object, QImage)
+
+class RenderTask(QRunnable):
+    def __init__(self, content, signals):
+        super(RenderTask, self).__init__()
+        self.content = content
+        self.signals = signals
+
+    def run(self):
+        self.signals.rendered.emit(self.content, renderPage(self.content))
+
+class PageRenderer(QObject):
+    # Rendered pages keyed by their content, so a page is only rendered again
+    # when what is printed on it changes. Pages are rendered on worker
+    # threads when the platform can render fonts off the GUI thread, the
+    # least recently shown ones are dropped past memoryLimit
+    pageRendered = pyqtSignal(object)
+
+    def __init__(self, memoryLimit=0, parent=None):
+        super(PageRenderer, self).__init__(parent)
+        self.dpi = PREVIEW_DPI
+        self.memoryLimit = memoryLimit
+        self.images = OrderedDict()     # content -> QImage, least recently used first
+        self.memoryUsed = 0
+        self.pending = set()
+        self.requests = 0
+        self.queue = []                 # GUI thread rendering, newest request last
+
+        self.threaded = QFontDatabase.supportsThreadedFontRendering()
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(max(QThread.idealThreadCount() - 1, 1))
+        self.signals = RenderSignals()
+        self.signals.rendered.connect(self.taskFinished)
+
+    def image(self, content):
+        image = self.images.get(content)
+        if (image is not None):
+            self.images.move_to_end(content)
+        return image
+
+    def request(self, content):
+        if (content in self.pending or content in self.images):
+            return
+        self.pending.add(content)
+        self.requests += 1
+        if (self.threaded):
+            # Pages scrolled to last are the ones on screen, they go first
+            self.pool.start(RenderTask(content, self.signals), self.requests)
+        else:
+            self.queue.append(content)
+            if (len(self.queue) == 1):
+                QTimer.singleShot(0, self.renderQueued)
+
+    def renderQueued(self):
+        # One page per pass of the event loop, the window stays responsive
+        if (self.queue):
+            content = self.queue.pop()
+            self.taskFinished(content, renderPage(content, self.dpi))
+        if (self.queue):
+            QTimer.singleShot(0, self.renderQueued)
+
+    def taskFinished(self, content, image):
+        self.pending.discard(content)
+        self.images[content] = image
+        self.memoryUsed += image.sizeInBytes()
+        while (self.memoryLimit > 0 and self.memoryUsed > self.memoryLimit and len(self.images) > 1):
+            evicted, old = self.images.popitem(last=False)
+            self.memoryUsed -= old.sizeInBytes()
+        self.pageRendered.emit(content)
+
+    def cancel(self):
+        # Drops the renders that haven't started, e.g. when the preview closes
+        self.pool.clear()
+        self.queue = []
+        self.pool.waitForDone()
+        self.pending.clear()
+
+class PreviewDialog(QDialog):
+    # Print preview of the paginated script (see writerPages). Pages are
+    # only rendered once the list shows them, and zooming scales the
+    # rendered images instead of rendering again
+    def __init__(self, pageSource, printScript, memoryLimit=0, parent=None):
+        super(PreviewDialog, self).__init__(parent)
+        # pageSource() -> [(page number, page content)]
+        self.pageSource = pageSource
+        self.setWindowTitle("Print preview")
+        self.renderer = PageRenderer(memoryLimit, self)
+
+        self.pagesModel = PreviewPagesModel(self.renderer, self)
+        self.pagesView = QListView()
+        self.pagesView.setModel(self.pagesModel)
+        self.pagesView.setUniformItemSizes(True)
+        self.pagesView.setSelectionMode(QListView.NoSelection)
+        self.pagesView.setEditTriggers(QListView.NoEditTriggers)
+        self.pagesView.setSpacing(10)
+        self.pagesView.setStyleSheet("QListView { background: gray; }")
+        self.pagesView.setIconSize(self.pagesModel.pageSize())
+
+        zoomOutButton = QPushButton("Zoom out")
+        zoomOutButton.clicked.connect(lambda: self.zoomBy(-1))
+        zoomInButton = QPushButton("Zoom in")
+        zoomInButton.clicked.connect(lambda: self.zoomBy(1))
+        self.zoomLabel = QLabel()
+        self.pageLabel = QLabel()
+        printButton = QPushButton("Print...")
+        printButton.clicked.connect(printScript)
+        closeButton = QPushButton("Close")
+        closeButton.clicked.connect(self.close)
+
+        buttons = QHBoxLayout()
+        buttons.addWidget(zoomOutButton)
+        buttons.addWidget(zoomInButton)
+        buttons.addWidget(self.zoomLabel)
+        buttons.addStretch()
+        buttons.addWidget(self.pageLabel)
+        buttons.addStretch()
+        buttons.addWidget(printButton)
+        buttons.addWidget(closeButton)
+
+        layout = QGridLayout()
+        layout.addLayout(buttons,           0, 0)
+        layout.addWidget(self.pagesView,    1, 0)
+        self.setLayout(layout)
+
+        self.zoom = ZOOM_STEPS.index(1.0)
+        self.showZoom()
+        size = self.pagesModel.pageSize()
+        self.resize(size.width() + 80, size.height())
+
+        # An open preview follows the script after a pause in the typing
+        self.refreshTimer = QTimer(self)
+        self.refreshTimer.setSingleShot(True)
+        self.refreshTimer.setInterval(REFRESH_DELAY)
+        self.refreshTimer.timeout.connect(self.refresh)
+
+    def showPreview(self):
+        self.refresh()
+        self.show()
+        self.raise_()
+        self.activateWindow()
+
+    def documentChanged(self):
+        if (self.isVisible()):
+            self.refreshTimer.start()
+
+    def refresh(self):
+        self.refreshTimer.stop()
+        pages = self.pageSource()
+        self.pagesModel.setPages(pages)
+        self.pageLabel.setText(str(len(pages)) + (" page" if len(pages) == 1 else " pages"))
+
+    def zoomBy(self, steps):
+        self.zoom = min(max(self.zoom + steps, 0), len(ZOOM_STEPS) - 1)
+        self.showZoom()
+
+    def showZoom(self):
+        self.pagesModel.setZoom(ZOOM_STEPS[self.zoom])
+        self.pagesView.setIconSize(self.pagesModel.pageSize())
+        self.zoomLabel.setText(str(round(ZOOM_STEPS[self.zoom] * 100)) + " %")
+
+    def hideEvent(self, event):
+        # Pages nobody looks at anymore aren't worth rendering, the cache
+        # stays. Closing, Esc (reject) and hiding all end up here
+        self.refreshTimer.stop()
+        self.renderer.cancel()
+        QDialog.hideEvent(self, event)
@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import inspect
+import threading
+from collections import deque
+from functools import wraps
+
+from PyQt5.QtCore import (Qt, QObject, QEvent, QTimer)
+from PyQt5.QtWidgets import QLabel
+
+# Opt-in latency instrumentation (writer.py --latency). Handlers are timed by
+# replacing them on their class with a wrapper before the window is built, so
+# signals get connected to the wrappers. Without --latency nothing is
+# replaced and nothing is recorded, the handlers run as they always do
+
+# Timings kept per handler for the percentiles, the oldest are dropped first
+LATENCY_SAMPLES = 2000
+# Spans kept for the trace file
+TRACE_EVENTS = 200000
+# Name of the span from a key press to the editor's next paint
+KEY_TO_PAINT = "key to paint"
+
+def percentile(ordered, fraction):
+    # Nearest rank of a sorted list
+    if (not ordered):
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(int(round(fraction * len(ordered))) - 1, 0))]
+
+class LatencyRecorder(QObject):
+    # Spans as (name, start, seconds, thread). Recording is only ever an
+    # append, the worker threads (saving, snapshots) record too
+    def __init__(self, parent=None):
+        super(LatencyRecorder, self).__init__(parent)
+        self.origin = time.perf_counter()
+        self.samples = {}       # name -> deque of seconds
+        self.events = deque(maxlen=TRACE_EVENTS)
+        self.keyPressed = None  # time of the key press no paint followed yet
+        self.viewport = None
+
+    def record(self, name, start, end):
+        samples = self.samples.get(name)
+        if (samples is None):
+            samples = self.samples.setdefault(name, deque(maxlen=LATENCY_SAMPLES))
+        samples.append(end - start)
+        self.events.append((name, start, end - start, threading.get_ident()))
+
+    def instrument(self, cls, names):
+        # Times the methods of cls, named after the class and method
+        for name in names:
+            setattr(cls, name, self.timed(getattr(cls, name), cls.__name__ + "." + name))
+
+    def timed(self, function, name):
+        record = self.record
+        # PyQt leaves out the signal arguments a slot has no room for, it
+        # can't tell how many the wrapper takes so the wrapper does it
+        code = function.__code__
+        count = None if (code.co_flags & inspect.CO_VARARGS) else code.co_argcount
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args[:count], **kwargs)
+            finally:
+                record(name, start, time.perf_counter())
+        return wrapper
+
+    def watchEditor(self, editor):
+        # Key press to the paint that shows it, what typing actually feels like
+        self.viewport = editor.viewport()
+        editor.installEventFilter(self)
+        self.viewport.installEventFilter(self)
+
+    def eventFilter(self, watched, event):
+        if (event.type() == QEvent.KeyPress and self.keyPressed is None):
+            self.keyPressed = time.perf_counter()
+        elif (event.type() == QEvent.Paint and watched is self.viewport and self.keyPressed is not None):
+            self.record(KEY_TO_PAINT, self.keyPressed, time.perf_counter())
+            self.keyPressed = None
+        return False
+
+    def summary(self):
+        # (name, count, p50, p95, p99, max) in milliseconds, slowest p99 first
+        rows = []
+        for name, samples in list(self.samples.items()):
+            ordered = sorted(samples)
+            rows.append((name, len(ordered)) + tuple(percentile(ordered, fraction) * 1000
+                        for fraction in (0.5, 0.95, 0.99, 1.0)))
+        rows.sort(key=lambda row: -row[4])
+        return rows
+
+    def report(self, limit=None):
+        lines = ["{:<32}{:>6}{:>8}{:>8}{:>8}{:>8}".format("latency (ms)", "n", "p50", "p95", "p99", "max")]
+        for row in self.summary()[:limit]:
+            lines.append("{:<32.32}{:>6}{:>8.2f}{:>8.2f}{:>8.2f}{:>8.2f}".format(*row))
+        return "\n".join(lines)
+
+    def writeTrace(self, filename):
+        # Chrome trace format (chrome://tracing, Perfetto): complete events
+        # in microseconds from the recorder's start
+        pid = os.getpid()
+        events = [{"name": name, "cat": "writer", "ph": "X", "pid": pid, "tid": thread,
+                   "ts": round((start - self.origin) * 1e6, 1), "dur": round(seconds * 1e6, 1)}
+                  for name, start, seconds, thread in list(self.events)]
+        with open(filename, "wt", encoding="utf-8") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+        return len(events)
+
+class LatencyOverlay(QLabel):
+    # Percentiles of the slowest handlers in a corner of the editor, updated
+    # once a second
+    def __init__(self, recorder, editor, rows=12):
+        super(LatencyOverlay, self).__init__(editor.viewport())
+        self.recorder = recorder
+        self.rows = rows
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.setStyleSheet("QLabel { background: rgba(0, 0, 0, 210); color: #e0ffe0; "
+                           "font: 8pt \"Courier\"; padding: 4px; }")
+        self.timer = QTimer(self)
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start()
+        self.refresh()
+        self.show()
+
+    def refresh(self):
+        self.setText(self.recorder.report(self.rows))
+        self.ensurePolished()
+        self.adjustSize()
+        self.move(self.parentWidget().width() - self.width() - 4, 4)
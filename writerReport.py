@@ -0,0 +1,132 @@
+import csv
+import json
+
+from writerFormats import (FormatState, blockState)
+from writerIndex import characterName
+from writerPages import (PAGE_LINES, elementLines, paginate)
+
+# Production breakdown of a script: its scenes with their length in eighths
+# of a page and who speaks in them, and the cast with their speeches, lines
+# and words. Worked out from the element types alone: a Heading starts a
+# scene, a Character block names the speaker and the Dialogue (and
+# Paranthesis) blocks after it are what they say. Lengths come from the same
+# page breaks as printing, see writerPages
+
+# Eighths of a page, the usual unit for scene lengths
+EIGHTHS = 8
+
+# Columns of the CSV report, one row per speaker in a scene (a scene nobody
+# speaks in gets one row without a character)
+CSV_COLUMNS = ["scene", "heading", "page", "eighths", "length", "character",
+               "speeches", "lines", "words"]
+
+def lengthText(eighths):
+    # 11 -> "1 3/8"
+    pages, rest = divmod(eighths, EIGHTHS)
+    if (not rest):
+        return str(pages)
+    fraction = str(rest) + "/" + str(EIGHTHS)
+    return (str(pages) + " " + fraction) if pages else fraction
+
+def newScene(number, heading, page):
+    return {"scene": number, "heading": heading, "page": page, "eighths": 0,
+            "length": "", "speakers": {}}
+
+def scriptBreakdown(texts, elements, pages=None):
+    # texts are the text of every block and elements paginate's (state,
+    # printed lines) of the same blocks, pages their pages when they are
+    # known already (the editor's page index). Returns the report as a dict
+    if (pages is None):
+        pages = list(paginate(elements))
+
+    # Scene of every block, the blocks in front of the first heading are
+    # scene 0 (left out of the report when they are empty)
+    scenes = [newScene(0, "", 1)]
+    sceneOf = []
+    speaker = None
+    for number, text in enumerate(texts):
+        state = elements[number][0]
+        if (state == FormatState.Heading):
+            scenes.append(newScene(len(scenes), text.strip().upper(), 1))
+            speaker = None
+        scene = scenes[-1]
+        sceneOf.append(scene["scene"])
+        if (state == FormatState.Character):
+            speaker = characterName(text) or None
+            if (speaker is not None):
+                counts = scene["speakers"].setdefault(speaker, {"speeches": 0, "lines": 0, "words": 0})
+                counts["speeches"] += 1
+        elif (state in (FormatState.Dialogue, FormatState.Paranthesis)):
+            if (speaker is not None and state == FormatState.Dialogue):
+                counts = scene["speakers"][speaker]
+                counts["lines"] += len(elements[number][1])
+                counts["words"] += len(text.split())
+        else:
+            speaker = None
+
+    # Printed lines of every scene on every page (MORE and CONT'D lines
+    # included), rounded to eighths page by page with at least one eighth
+    # for a scene that is on the page at all
+    for page in pages:
+        lines = {}
+        items = page.blocks()
+        if (page.continued() and items):
+            lines[sceneOf[items[0][0]]] = 1
+        for block, first, end, blank in items:
+            scene = sceneOf[block]
+            if (first == 0 and elements[block][0] == FormatState.Heading):
+                scenes[scene]["page"] = page.number
+            lines[scene] = lines.get(scene, 0) + blank + end - first
+        if (page.more and items):
+            lines[sceneOf[items[-1][0]]] += 1
+        for scene, count in lines.items():
+            scenes[scene]["eighths"] += max(round(count * EIGHTHS / PAGE_LINES), 1)
+
+    if (not any(text.strip() for number, text in enumerate(texts) if sceneOf[number] == 0)):
+        scenes = scenes[1:]
+
+    # The cast, most lines first
+    cast = {}
+    for scene in scenes:
+        scene["length"] = lengthText(scene["eighths"])
+        for name, counts in scene["speakers"].items():
+            total = cast.setdefault(name, {"name": name, "speeches": 0, "lines": 0, "words": 0, "scenes": []})
+            for key in ("speeches", "lines", "words"):
+                total[key] += counts[key]
+            total["scenes"].append(scene["scene"])
+        scene["speakers"] = [dict(name=name, **counts) for name, counts in scene["speakers"].items()]
+    characters = sorted(cast.values(), key=lambda total: (-total["lines"], -total["speeches"], total["name"]))
+
+    eighths = sum(scene["eighths"] for scene in scenes)
+    return {"pages": len(pages), "scenes": scenes, "characters": characters,
+            "eighths": eighths, "length": lengthText(eighths)}
+
+def documentBreakdown(document):
+    # Breakdown of a QTextDocument, paginated here
+    texts = []
+    elements = []
+    block = document.firstBlock()
+    while block.isValid():
+        state = blockState(block)
+        texts.append(block.text())
+        elements.append((state, elementLines(state, block.text())))
+        block = block.next()
+    return scriptBreakdown(texts, elements)
+
+def writeReportJson(report, outName):
+    with open(outName, "wt", encoding="utf-8") as file:
+        json.dump(report, file, ensure_ascii=False, indent=1)
+
+def writeReportCsv(report, outName):
+    with open(outName, "wt", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(CSV_COLUMNS)
+        for scene in report["scenes"]:
+            fields = [scene["scene"], scene["heading"], scene["page"], scene["eighths"], scene["length"]]
+            if (not scene["speakers"]):
+                writer.writerow(fields + ["", 0, 0, 0])
+            for speaker in scene["speakers"]:
+                writer.writerow(fields + [speaker["name"], speaker["speeches"], speaker["lines"], speaker["words"]])
+
+# Report formats and the extension of the file they produce
+REPORTERS = {"csv": (".csv", writeReportCsv), "json": (".json", writeReportJson)}
@@ -0,0 +1,349 @@
+import os
+import json
+import time
+import zlib
+from bisect import bisect_left
+
+from PyQt5.QtCore import (QObject, QRunnable, QThreadPool, pyqtSignal)
+from PyQt5.QtGui import QTextCursor
+from PyQt5.QtWidgets import (QDialog, QGridLayout, QHBoxLayout, QLabel, QLineEdit,
+                             QPushButton, QListView)
+
+from writerFile import (blockRecord, encodeRecord, insertRecords, loadRecords)
+from writerPanels import RevisionListModel
+
+# Revision store, kept next to the script as <name>.revisions:
+#   line 1   WRITERREVISIONS 1
+#   then per revision a json header line (number, name, time, blocks, size
+#   of the data and whether it is a delta) followed by the zlib compressed
+#   data and a newline. The data is a json list of the revision's block
+#   lines (as in the native file, see writerFile) or, for a delta, of
+#   [start, count] copies from the revision before and block lines of its own
+# Entries are only ever appended, a revision never changes once it's stored
+REVISIONS_MAGIC = "WRITERREVISIONS"
+REVISIONS_VERSION = 1
+# A revision is stored whole every so many revisions, so restoring one
+# applies at most this many deltas
+KEYFRAME_INTERVAL = 64
+
+def revisionsPath(filename):
+    return os.path.splitext(os.path.abspath(filename))[0] + ".revisions"
+
+def documentLines(document, formats):
+    # The document's blocks as native file lines
+    lines = []
+    block = document.firstBlock()
+    while block.isValid():
+        lines.append(encodeRecord(blockRecord(block, formats)))
+        block = block.next()
+    return lines
+
+def blockDelta(old, new):
+    # new as [start, count] runs copied from old and lines of its own. Runs
+    # are looked up in a line -> block numbers table and grown while the
+    # lines keep matching, so drafts of the same script diff in about linear
+    # time. A copy that jumps elsewhere has to match at least two lines, a
+    # repeated short line (a character name) isn't worth moving for
+    positions = {}
+    for number, line in enumerate(old):
+        positions.setdefault(line, []).append(number)
+    ops = []
+    position = 0
+    number = 0
+    while (number < len(new)):
+        line = new[number]
+        start = -1
+        if (position < len(old) and old[position] == line):
+            start = position
+        elif (line in positions):
+            found = positions[line]
+            index = bisect_left(found, position)
+            start = found[index] if index < len(found) else found[0]
+            if (start + 1 >= len(old) or number + 1 >= len(new) or old[start + 1] != new[number + 1]):
+                start = -1
+        if (start < 0):
+            ops.append(line)
+            number += 1
+            continue
+        end = start
+        while (end < len(old) and number < len(new) and old[end] == new[number]):
+            end += 1
+            number += 1
+        ops.append([start, end - start])
+        position = end
+    return ops
+
+def applyDelta(old, ops):
+    new = []
+    for op in ops:
+        if (isinstance(op, str)):
+            new.append(op)
+        else:
+            new.extend(old[op[0]:op[0] + op[1]])
+    return new
+
+class RevisionStore:
+    # Reads and appends the revisions of one script. The headers are read
+    # without the data, a revision's data is only read to restore it
+    def __init__(self, path):
+        self.path = path
+        self.entries = []       # (header, offset of the data)
+        self.end = 0            # end of the last complete entry
+        self.cache = None       # (number, lines) of the last revision built
+        self.read()
+
+    def read(self):
+        self.entries = []
+        self.end = 0
+        if (not os.path.exists(self.path)):
+            return
+        with open(self.path, "rb") as file:
+            first = file.readline()
+            if (first.split()[:1] != [REVISIONS_MAGIC.encode()]):
+                raise ValueError("Not a Writer revision file")
+            if (int(first.split()[1]) > REVISIONS_VERSION):
+                raise ValueError("Revisions were stored by a newer version of Writer")
+            self.end = file.tell()
+            while True:
+                line = file.readline()
+                if (not line.endswith(b"\n")):
+                    break
+                try:
+                    header = json.loads(line)
+                except ValueError:
+                    break
+                offset = file.tell()
+                file.seek(header["size"], os.SEEK_CUR)
+                # The data's newline, an entry cut short (e.g. by a crash) is left out
+                if (file.read(1) != b"\n"):
+                    break
+                self.entries.append((header, offset))
+                self.end = file.tell()
+
+    def revisions(self):
+        return [header for header, offset in self.entries]
+
+    def data(self, file, index):
+        header, offset = self.entries[index]
+        file.seek(offset)
+        return json.loads(zlib.decompress(file.read(header["size"])).decode("utf-8"))
+
+    def lines(self, number):
+        # Block lines of a revision: the whole revision before it, then the
+        # deltas up to it
+        index = number - 1
+        if (self.cache is not None and self.cache[0] == number):
+            return list(self.cache[1])
+        start = index
+        while (self.entries[start][0]["delta"]):
+            start -= 1
+        with open(self.path, "rb") as file:
+            lines = self.data(file, start)
+            for delta in range(start + 1, index + 1):
+                lines = applyDelta(lines, self.data(file, delta))
+        self.cache = (number, lines)
+        return list(lines)
+
+    def add(self, lines, name=""):
+        # Stores the lines as the next revision, returns its header
+        if (os.path.exists(self.path) and os.path.getsize(self.path) != self.end):
+            # Another window stored a revision of the script meanwhile
+            self.read()
+            self.cache = None
+        number = len(self.entries) + 1
+        data = lines
+        delta = False
+        if (self.entries and number - self.keyframe() < KEYFRAME_INTERVAL):
+            ops = blockDelta(self.lines(number - 1), lines)
+            # A delta that is mostly new lines is stored whole
+            if (sum(1 for op in ops if isinstance(op, str)) < len(lines) // 2):
+                data = ops
+                delta = True
+        packed = zlib.compress(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        header = {"number": number, "name": name, "time": time.time(), "blocks": len(lines),
+                  "delta": delta, "size": len(packed)}
+
+        newFile = not os.path.exists(self.path)
+        with open(self.path, "ab") as file:
+            if (newFile):
+                file.write((REVISIONS_MAGIC + " " + str(REVISIONS_VERSION) + "\n").encode())
+                self.end = file.tell()
+            # Anything after the last complete entry is what a crash left
+            file.truncate(self.end)
+            file.write((json.dumps(header) + "\n").encode("utf-8"))
+            offset = file.tell()
+            file.write(packed + b"\n")
+            file.flush()
+            os.fsync(file.fileno())
+            self.end = file.tell()
+        self.entries.append((header, offset))
+        self.cache = (number, lines)
+        return header
+
+    def keyframe(self):
+        # Number of the last revision stored whole
+        for header, offset in reversed(self.entries):
+            if (not header["delta"]):
+                return header["number"]
+        return 0
+
+class SnapshotSignals(QObject):
+    # revisions path, revision header, seconds spent off the GUI thread
+    finished = pyqtSignal(str, dict, float)
+    # revisions path, error message
+    failed = pyqtSignal(str, str)
+
+class SnapshotTask(QRunnable):
+    def __init__(self, store, snapshot, name, formats, signals):
+        super(SnapshotTask, self).__init__()
+        self.store = store
+        self.snapshot = snapshot
+        self.name = name
+        self.formats = formats
+        self.signals = signals
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            header = self.store.add(documentLines(self.snapshot, self.formats), self.name)
+        except (OSError, ValueError) as error:
+            self.signals.failed.emit(self.store.path, str(error))
+            return
+        self.signals.finished.emit(self.store.path, header, time.perf_counter() - start)
+
+class BackgroundSnapshots(QObject):
+    # Stores revisions on a worker thread, the GUI thread only takes a copy
+    # of the document. Same signatures as SnapshotSignals
+    created = pyqtSignal(str, dict, float)
+    failed = pyqtSignal(str, str)
+
+    def __init__(self, formats, parent=None):
+        super(BackgroundSnapshots, self).__init__(parent)
+        self.formats = formats
+        self.stores = {}        # revisions path -> RevisionStore, only used by the worker
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(1)
+        self.signals = SnapshotSignals()
+        self.signals.finished.connect(self.created)
+        self.signals.failed.connect(self.failed)
+
+    def snapshot(self, filename, document, name=""):
+        path = revisionsPath(filename)
+        if (path not in self.stores):
+            try:
+                self.stores[path] = RevisionStore(path)
+            except (OSError, ValueError) as error:
+                self.failed.emit(path, str(error))
+                return
+        self.pool.start(SnapshotTask(self.stores[path], document.clone(), name, self.formats, self.signals))
+
+    def wait(self):
+        self.pool.waitForDone()
+
+def loadRevision(document, lines, formats):
+    loadRecords((json.loads(line) for line in lines), document, formats)
+    document.setModified(False)
+
+def restoreRevision(document, lines, formats):
+    # Replaces the script with a revision, as one edit that can be undone
+    cursor = QTextCursor(document)
+    cursor.beginEditBlock()
+    cursor.select(QTextCursor.Document)
+    cursor.removeSelectedText()
+    insertRecords(cursor, (json.loads(line) for line in lines), formats, first=True)
+    cursor.endEditBlock()
+
+class RevisionsDialog(QDialog):
+    # The script's revisions: new snapshots, and opening or restoring old ones
+    def __init__(self, main, parent=None):
+        super(RevisionsDialog, self).__init__(parent)
+        self.main = main
+        self.store = None
+        self.setWindowTitle("Revisions")
+
+        self.revisionsModel = RevisionListModel(self)
+        self.revisionsView = QListView()
+        self.revisionsView.setUniformItemSizes(True)
+        self.revisionsView.setModel(self.revisionsModel)
+        self.revisionsView.activated.connect(self.openRevision)
+        self.nameEdit = QLineEdit()
+        self.nameEdit.setPlaceholderText("e.g. Second draft")
+        self.statusLabel = QLabel()
+
+        snapshotButton = QPushButton("Take snapshot")
+        snapshotButton.clicked.connect(self.takeSnapshot)
+        openButton = QPushButton("Open")
+        openButton.clicked.connect(lambda: self.openRevision(self.revisionsView.currentIndex()))
+        restoreButton = QPushButton("Restore")
+        restoreButton.clicked.connect(self.restore)
+        closeButton = QPushButton("Close")
+        closeButton.clicked.connect(self.hide)
+
+        buttons = QHBoxLayout()
+        buttons.addWidget(openButton)
+        buttons.addWidget(restoreButton)
+        buttons.addStretch()
+        buttons.addWidget(closeButton)
+
+        layout = QGridLayout()
+        layout.addWidget(QLabel("Name:"),           0, 0)
+        layout.addWidget(self.nameEdit,             0, 1)
+        layout.addWidget(snapshotButton,            0, 2)
+        layout.addWidget(self.revisionsView,        1, 0, 1, 3)
+        layout.addWidget(self.statusLabel,          2, 0, 1, 3)
+        layout.addLayout(buttons,                   3, 0, 1, 3)
+        self.setLayout(layout)
+        self.resize(520, 360)
+
+    def showRevisions(self):
+        self.refresh()
+        self.show()
+        self.raise_()
+        self.activateWindow()
+
+    def refresh(self):
+        # Headers only, the data stays on disk until a revision is opened
+        self.store = None
+        revisions = []
+        if (self.main.filename):
+            try:
+                self.store = RevisionStore(revisionsPath(self.main.filename))
+                revisions = self.store.revisions()
+            except (OSError, ValueError) as error:
+                self.statusLabel.setText(str(error))
+                return
+        self.revisionsModel.setRevisions(revisions)
+        if (not self.main.filename):
+            self.statusLabel.setText("Save the script first, revisions are kept next to it")
+        else:
+            size = os.path.getsize(self.store.path) if revisions else 0
+            self.statusLabel.setText(str(len(revisions)) + " revisions, " +
+                                     str(round(size / 1024)) + " KB")
+
+    def takeSnapshot(self):
+        if (not self.main.filename):
+            return
+        self.main.takeSnapshot(self.nameEdit.text().strip())
+        self.nameEdit.clear()
+        self.statusLabel.setText("Storing snapshot...")
+
+    def selectedLines(self, index):
+        if (self.store is None or not index.isValid()):
+            return None, None
+        header = self.revisionsModel.revisions[index.row()]
+        try:
+            return header, self.store.lines(header["number"])
+        except (OSError, ValueError, zlib.error) as error:
+            self.statusLabel.setText("Could not read revision " + str(header["number"]) + ": " + str(error))
+            return None, None
+
+    def openRevision(self, index):
+        header, lines = self.selectedLines(index)
+        if (lines is not None):
+            self.main.openRevision(header, lines)
+
+    def restore(self):
+        header, lines = self.selectedLines(self.revisionsView.currentIndex())
+        if (lines is not None):
+            restoreRevision(self.main.scriptEdit.document(), lines, self.main.elementFormats)
+            self.statusLabel.setText("Restored revision " + str(header["number"]) + ", undo brings the script back")
@@ -0,0 +1,114 @@
+import os
+import time
+import shutil
+import tempfile
+
+from PyQt5.QtCore import (QCoreApplication, QEvent, QObject, QRunnable, QThreadPool, pyqtSignal)
+
+def atomicWrite(filename, text, encoding="utf-8"):
+    # Write next to the target and rename over it, so a crash mid-write
+    # leaves either the old file or the new one, never half of one
+    folder = os.path.dirname(os.path.abspath(filename))
+    handle, tempName = tempfile.mkstemp(prefix="." + os.path.basename(filename) + ".",
+                                        suffix=".tmp", dir=folder)
+    try:
+        with os.fdopen(handle, "w", encoding=encoding) as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+        if os.path.exists(filename):
+            shutil.copymode(filename, tempName)
+        os.replace(tempName, filename)
+    except BaseException:
+        if os.path.exists(tempName):
+            os.remove(tempName)
+        raise
+
+class SaveSignals(QObject):
+    # filename, seconds spent off the GUI thread, the save's token
+    finished = pyqtSignal(str, float, object)
+    # filename, error message, the save's token
+    failed = pyqtSignal(str, str, object)
+
+class SaveTask(QRunnable):
+    def __init__(self, filename, snapshot, serialize, signals, token=None):
+        super(SaveTask, self).__init__()
+        self.filename = filename
+        self.snapshot = snapshot
+        self.serialize = serialize
+        self.signals = signals
+        self.token = token
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            atomicWrite(self.filename, self.serialize(self.snapshot))
+        except Exception as error:
+            self.signals.failed.emit(self.filename, str(error), self.token)
+            return
+        self.signals.finished.emit(self.filename, time.perf_counter() - start, self.token)
+
+class BackgroundSaver(QObject):
+    # Same signatures as SaveSignals, emitted on the GUI thread
+    saved = pyqtSignal(str, float, object)
+    failed = pyqtSignal(str, str, object)
+    # token of a save that was replaced by a newer one before it started,
+    # it never signals saved or failed
+    replaced = pyqtSignal(object)
+
+    def __init__(self, serialize, parent=None):
+        super(BackgroundSaver, self).__init__(parent)
+        # serialize(snapshot) -> text, runs on the worker thread
+        self.serialize = serialize
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(1)
+        self.running = False
+        self.pending = None
+
+        self.signals = SaveSignals()
+        self.signals.finished.connect(self.taskFinished)
+        self.signals.failed.connect(self.taskFailed)
+
+    def save(self, filename, document, token=None):
+        # The snapshot is the only part that runs on the GUI thread. token
+        # is handed back with the save's signal
+        snapshot = document.clone()
+        document.setModified(False)
+
+        # Only the newest snapshot matters while a save is still being written
+        if (self.running):
+            if (self.pending is not None):
+                self.replaced.emit(self.pending[2])
+            self.pending = (filename, snapshot, token)
+            return
+        self.start(filename, snapshot, token)
+
+    def start(self, filename, snapshot, token=None):
+        self.running = True
+        self.pool.start(SaveTask(filename, snapshot, self.serialize, self.signals, token))
+
+    def busy(self):
+        return self.running or self.pending is not None
+
+    def startPending(self):
+        self.running = False
+        if (self.pending is not None):
+            filename, snapshot, token = self.pending
+            self.pending = None
+            self.start(filename, snapshot, token)
+
+    def taskFinished(self, filename, seconds, token):
+        self.startPending()
+        self.saved.emit(filename, seconds, token)
+
+    def taskFailed(self, filename, error, token):
+        self.startPending()
+        self.failed.emit(filename, error, token)
+
+    def wait(self):
+        # Block until everything that was asked for is on disk
+        while (self.busy()):
+            self.pool.waitForDone()
+            # The finished/failed signals are queued, delivering them starts
+            # the pending save (and signals the saves in the order they ran)
+            QCoreApplication.sendPostedEvents(None, QEvent.MetaCall)
@@ -0,0 +1,388 @@
+import time
+
+from PyQt5.QtCore import (QObject)
+from PyQt5.QtGui import (QTextCursor, QTextCharFormat)
+from PyQt5.QtWidgets import (QUndoCommand)
+
+from writerFormats import (FormatState, ELEMENT_STATES, blockState)
+from writerFile import (LOADING_PROPERTY, blockRuns, applyOverrides)
+
+# Keystrokes further apart than this (seconds) become separate undo steps
+MERGE_INTERVAL = 2.0
+# QUndoCommand.id() of the commands that can merge with each other
+TYPING_ID = 1
+# Block separator, as QTextCursor.selectedText() returns it
+PARAGRAPH = "\u2029"
+# Rough memory cost of a command besides its text (python objects, formats)
+COMMAND_OVERHEAD = 128
+RUN_SIZE = 160
+# Inline runs of a block that is plain element text, shared by all of them
+NO_RUNS = ()
+
+class TextDelta(QUndoCommand):
+    # One change to the document: the text replaced at a position, and the
+    # element types of the blocks it touched before and after the change.
+    # The inline runs (bold, italic...) of those blocks are only kept when
+    # there are any, as block relative writerFile.blockRuns, None otherwise.
+    # Nothing else of the document is kept, so a command costs about as much
+    # as the text that changed
+    def __init__(self, recorder, position, oldText, newText, firstBlock, oldStates, newStates,
+                 oldRuns=None, newRuns=None):
+        super(TextDelta, self).__init__()
+        self.recorder = recorder
+        self.position = position
+        self.oldText = oldText
+        self.newText = newText
+        self.firstBlock = firstBlock
+        self.oldStates = oldStates
+        self.newStates = newStates
+        self.oldRuns = oldRuns
+        self.newRuns = newRuns
+        self.time = time.monotonic()
+        # The change is already in the document when the command is pushed
+        self.applied = True
+
+        self.kind = None
+        if (oldStates == newStates and PARAGRAPH not in oldText + newText):
+            if (not oldText and len(newText) == 1):
+                self.kind = "insert"
+            elif (len(oldText) == 1 and not newText):
+                self.kind = "delete"
+        if (self.kind == "insert"):
+            self.setText("Typing")
+        elif (self.kind == "delete"):
+            self.setText("Delete")
+        elif (oldText == newText):
+            self.setText("Change format")
+        else:
+            self.setText("Edit")
+
+    def id(self):
+        return TYPING_ID if self.kind is not None else -1
+
+    def mergeWith(self, other):
+        # Runs of typing (or of backspace/delete) in the same block are one step
+        if (other.kind != self.kind or other.firstBlock != self.firstBlock or
+            other.time - self.time > MERGE_INTERVAL or self.recorder.rebuilding):
+            return False
+        if (self.kind == "insert" and other.position == self.position + len(self.newText)):
+            self.newText += other.newText
+        elif (self.kind == "delete" and other.position + len(other.oldText) == self.position):
+            # Backspace
+            self.position = other.position
+            self.oldText = other.oldText + self.oldText
+        elif (self.kind == "delete" and other.position == self.position):
+            # Delete
+            self.oldText += other.oldText
+        else:
+            return False
+        if (self.oldRuns is not None or other.newRuns is not None):
+            if (self.oldRuns is None):
+                self.oldRuns = [NO_RUNS] * len(self.oldStates)
+            self.newRuns = other.newRuns if other.newRuns is not None else [NO_RUNS] * len(other.newStates)
+        self.time = other.time
+        return True
+
+    def undo(self):
+        self.recorder.replace(self.position, len(self.newText), self.oldText,
+                              self.firstBlock, self.oldStates, self.reformats(), self.oldRuns)
+
+    def redo(self):
+        if (self.applied):
+            self.applied = False
+            return
+        self.recorder.replace(self.position, len(self.oldText), self.newText,
+                              self.firstBlock, self.newStates, self.reformats(), self.newRuns)
+
+    def reformats(self):
+        # Blocks split or joined again get their element format back
+        return PARAGRAPH in self.oldText or PARAGRAPH in self.newText
+
+    def size(self):
+        runs = sum(len(blockRuns) for side in (self.oldRuns, self.newRuns) if side is not None
+                   for blockRuns in side)
+        return (COMMAND_OVERHEAD + 2 * (len(self.oldText) + len(self.newText)) +
+                8 * (len(self.oldStates) + len(self.newStates)) + RUN_SIZE * runs)
+
+    def copy(self):
+        command = TextDelta(self.recorder, self.position, self.oldText, self.newText,
+                            self.firstBlock, self.oldStates, self.newStates,
+                            self.oldRuns, self.newRuns)
+        command.time = self.time
+        return command
+
+class StyleDelta(QUndoCommand):
+    # Inline formatting (bold, colours...) of a selection, before and after
+    def __init__(self, recorder, oldRuns, newRuns):
+        super(StyleDelta, self).__init__()
+        self.recorder = recorder
+        self.oldRuns = oldRuns
+        self.newRuns = newRuns
+        self.applied = True
+        self.setText("Change style")
+
+    def undo(self):
+        self.recorder.restyle(self.oldRuns)
+
+    def redo(self):
+        if (self.applied):
+            self.applied = False
+            return
+        self.recorder.restyle(self.newRuns)
+
+    def size(self):
+        return COMMAND_OVERHEAD + RUN_SIZE * (len(self.oldRuns) + len(self.newRuns))
+
+    def copy(self):
+        return StyleDelta(self.recorder, self.oldRuns, self.newRuns)
+
+def commandSize(command):
+    # Bytes a command holds, a macro's are its commands'
+    if (hasattr(command, "size")):
+        return command.size()
+    return sum(commandSize(command.child(i)) for i in range(command.childCount()))
+
+class UndoRecorder(QObject):
+    # Records the editor's changes on a QUndoStack as deltas. The document's
+    # own undo history is switched off (it can't be bounded), instead a copy
+    # of every block's text, element type and inline runs is kept in step
+    # with the document, which is all that is needed to know what a change
+    # replaced. A change only reads and replaces the blocks it touched
+    def __init__(self, editor, undoStack, formats, memoryLimit=0, parent=None):
+        super(UndoRecorder, self).__init__(parent)
+        self.editor = editor
+        self.document = editor.document()
+        self.undoStack = undoStack
+        self.formats = formats
+        self.memoryLimit = memoryLimit
+        # Running total of the bytes pushed, the stack is only counted
+        # again when it passes the limit (see push)
+        self.used = 0
+        self.replaying = False
+        self.rebuilding = False
+        self.styleRange = None
+        self.styleRuns = None
+
+        self.document.setUndoRedoEnabled(False)
+        self.resync()
+        self.document.contentsChange.connect(self.contentsChanged)
+
+    def resync(self):
+        self.texts, self.states, self.runs = self.readBlocks(self.document.firstBlock())
+        self.length = self.document.characterCount() - 1
+
+    def reset(self):
+        # New content (e.g. an opened script), there is nothing to undo
+        self.undoStack.clear()
+        self.used = 0
+        self.resync()
+
+    def readBlocks(self, block, count=-1):
+        # (texts, states, inline runs) of count blocks from block on, -1 for all
+        texts = []
+        states = []
+        runs = []
+        while (block.isValid() and len(texts) != count):
+            state = blockState(block)
+            texts.append(block.text())
+            states.append(state.value)
+            runs.append(self.inlineRuns(block, state))
+            block = block.next()
+        return texts, states, runs
+
+    def inlineRuns(self, block, state):
+        if (state == FormatState.NoState):
+            return NO_RUNS
+        return blockRuns(block, self.formats[state][1]) or NO_RUNS
+
+    def contentsChanged(self, position, charsRemoved, charsAdded):
+        # Qt may count the document's final separator, hence the clamping
+        length = self.document.characterCount() - 1
+
+        # Text in front of the change is untouched, so is the first block's
+        # number and position
+        block = self.document.findBlock(position)
+        if (not block.isValid()):
+            block = self.document.lastBlock()
+        firstBlock = block.blockNumber()
+        offset = position - block.position()
+        if (firstBlock >= len(self.texts)):
+            self.reset()
+            return
+
+        # The copied blocks the change ran over, and the blocks in their place now
+        last = firstBlock
+        covered = len(self.texts[last])
+        while (covered < offset + charsRemoved and last + 1 < len(self.texts)):
+            last += 1
+            covered += 1 + len(self.texts[last])
+        oldText = PARAGRAPH.join(self.texts[firstBlock:last + 1])[offset:offset + charsRemoved]
+        newCount = self.document.findBlock(min(position + charsAdded, length)).blockNumber() - firstBlock + 1
+        texts, newStates, newRuns = self.readBlocks(block, max(newCount, 1))
+        newText = PARAGRAPH.join(texts)[offset:offset + charsAdded]
+
+        oldBlocks = oldText.count(PARAGRAPH) + 1
+        oldStates = self.states[firstBlock:firstBlock + oldBlocks]
+        oldRuns = self.runs[firstBlock:firstBlock + oldBlocks]
+        newStates = newStates[:newText.count(PARAGRAPH) + 1]
+        texts = texts[:len(newStates)]
+        newRuns = newRuns[:len(newStates)]
+
+        self.texts[firstBlock:firstBlock + oldBlocks] = texts
+        self.states[firstBlock:firstBlock + oldBlocks] = newStates
+        self.runs[firstBlock:firstBlock + oldBlocks] = newRuns
+        self.length += len(newText) - len(oldText)
+        if (self.length != length or len(self.texts) != self.document.blockCount()):
+            # Out of step with the document, the recorded history can't be trusted
+            self.reset()
+            return
+
+        if (self.replaying or self.document.property(LOADING_PROPERTY)):
+            return
+        if (oldText == newText and oldStates == newStates and
+            (oldRuns == newRuns or self.styleRange is not None)):
+            # Formatting only, inline styles are recorded by beginStyle/endStyle.
+            # Anything else that changes them (an element format put over
+            # them again) is a step of its own
+            return
+        if (not any(oldRuns) and not any(newRuns)):
+            # Plain element text, the element formats are all it takes
+            oldRuns = newRuns = None
+
+        # Only what actually differs is kept
+        start = 0
+        while (start < min(len(oldText), len(newText)) and oldText[start] == newText[start]):
+            start += 1
+        end = 0
+        while (end < min(len(oldText), len(newText)) - start and
+               oldText[len(oldText) - 1 - end] == newText[len(newText) - 1 - end]):
+            end += 1
+        self.push(TextDelta(self, position + start, oldText[start:len(oldText) - end],
+                            newText[start:len(newText) - end], firstBlock, oldStates, newStates,
+                            oldRuns, newRuns))
+
+    def push(self, command):
+        # Adding the pushed size never undercounts: merges, dropped redo
+        # history and the stack's count limit only free memory. So the
+        # stack is only summed when the total passes the limit
+        self.used += command.size()
+        self.undoStack.push(command)
+        # A macro (e.g. insertHeader's) on top may still be collecting
+        # commands, it can't be trimmed away under them
+        top = self.undoStack.command(self.undoStack.count() - 1)
+        if (self.memoryLimit > 0 and top is not None and hasattr(top, "size") and
+            self.used > self.memoryLimit):
+            self.used = self.memoryUsed()
+            if (self.used > self.memoryLimit):
+                self.trim()
+
+    def memoryUsed(self):
+        return sum(commandSize(self.undoStack.command(i)) for i in range(self.undoStack.count()))
+
+    def trim(self):
+        # QUndoStack can only drop its oldest commands by count, so the newest
+        # commands that fit in half the limit are pushed again onto a cleared
+        # stack (redo history is dropped)
+        kept = []
+        used = 0
+        for i in reversed(range(self.undoStack.index())):
+            command = self.undoStack.command(i)
+            used += commandSize(command)
+            # Macros can't be pushed again, they go with everything before them
+            if (used > self.memoryLimit // 2 or not hasattr(command, "copy")):
+                break
+            kept.append(command.copy())
+        self.rebuilding = True
+        self.undoStack.clear()
+        for command in reversed(kept):
+            self.undoStack.push(command)
+        self.rebuilding = False
+        self.used = self.memoryUsed()
+
+    def replace(self, position, length, text, firstBlock, states, reformat, runs=None):
+        # Puts one side of a TextDelta back into the document, runs being
+        # the inline runs of its blocks when it has any
+        cursor = QTextCursor(self.document)
+        self.replaying = True
+        cursor.beginEditBlock()
+        if (length or text):
+            cursor.setPosition(position)
+            cursor.setPosition(position + length, QTextCursor.KeepAnchor)
+            cursor.insertText(text)
+        block = self.document.findBlockByNumber(firstBlock)
+        for number, state in enumerate(states):
+            if (not block.isValid()):
+                break
+            if (reformat or runs is not None or blockState(block).value != state):
+                self.formatBlock(cursor, block, state)
+            if (runs is not None and state != FormatState.NoState.value):
+                self.restoreRuns(cursor, block, state, runs[number])
+            block = block.next()
+        cursor.endEditBlock()
+        self.replaying = False
+
+        cursor.setPosition(position + len(text))
+        self.editor.setTextCursor(cursor)
+
+    def formatBlock(self, cursor, block, state):
+        if (state == FormatState.NoState.value):
+            block.setUserState(-1)
+            return
+        blockFormat, charFormat = self.formats[ELEMENT_STATES[state]]
+        block.setUserState(state)
+        cursor.setPosition(block.position())
+        cursor.setBlockFormat(blockFormat)
+        cursor.setBlockCharFormat(charFormat)
+        cursor.setPosition(block.position() + block.length() - 1, QTextCursor.KeepAnchor)
+        cursor.setCharFormat(charFormat)
+
+    def restoreRuns(self, cursor, block, state, runs):
+        base = self.formats[ELEMENT_STATES[state]][1]
+        for start, length, overrides in runs:
+            cursor.setPosition(block.position() + start)
+            cursor.setPosition(block.position() + start + length, QTextCursor.KeepAnchor)
+            cursor.setCharFormat(applyOverrides(base, overrides))
+
+    def charRuns(self, start, end):
+        # (position, length, format) of every fragment between start and end
+        runs = []
+        block = self.document.findBlock(start)
+        while (block.isValid() and block.position() < end):
+            fragments = block.begin()
+            while not fragments.atEnd():
+                fragment = fragments.fragment()
+                first = max(fragment.position(), start)
+                last = min(fragment.position() + fragment.length(), end)
+                if (first < last):
+                    runs.append((first, last - first, QTextCharFormat(fragment.charFormat())))
+                fragments += 1
+            block = block.next()
+        return runs
+
+    def beginStyle(self):
+        # Call around inline formatting of the selection
+        cursor = self.editor.textCursor()
+        self.styleRange = None
+        if (cursor.hasSelection()):
+            self.styleRange = (cursor.selectionStart(), cursor.selectionEnd())
+            self.styleRuns = self.charRuns(*self.styleRange)
+
+    def endStyle(self):
+        if (self.styleRange is None):
+            return
+        newRuns = self.charRuns(*self.styleRange)
+        if (newRuns != self.styleRuns):
+            self.push(StyleDelta(self, self.styleRuns, newRuns))
+        self.styleRange = None
+        self.styleRuns = None
+
+    def restyle(self, runs):
+        cursor = QTextCursor(self.document)
+        self.replaying = True
+        cursor.beginEditBlock()
+        for position, length, charFormat in runs:
+            cursor.setPosition(position)
+            cursor.setPosition(position + length, QTextCursor.KeepAnchor)
+            cursor.setCharFormat(charFormat)
+        cursor.endEditBlock()
+        self.replaying = False
@@ -5,6 +5,47 @@ tabFormat = True
 # Change whether you want Enter to automatically change formats
 enterFormat = True
 
+# Seconds between autosaves of a changed script (0 turns autosave off)
+## Untitled scripts are only autosaved after they have been saved once
+autosaveInterval = 60
+
+# Scripts with more blocks (lines) than this open scene by scene: the first
+# few scenes show straight away and the rest streams in (0 always loads at once)
+lazyLoadBlocks = 3000
+# How many scenes are shown before the rest starts streaming in
+lazyFirstScenes = 5
+
+# Most undo steps kept, the oldest are dropped first (0 for no limit)
+undoLimit = 1000
+# Most memory (in MB) the undo history may use, the oldest steps are dropped
+# first (0 for no limit). Steps only store what changed, not the whole script
+undoMemoryLimit = 16
+
+# Edits are written to a journal next to the script (.<name>.journal) as they
+# are made, so they can be recovered when Writer didn't close properly
+journalEnabled = True
+# Milliseconds edits wait before they are written to the journal
+journalDelay = 300
+# Size (in MB) the journal may grow by before it's rewritten as a copy of the
+# script (0 never). Saves start the journal over, this matters without autosave
+journalCompactSize = 4
+
+# Show words, pages, scenes, dialogue share and screen time in the status bar
+showStatistics = True
+# Milliseconds between updates of the statistics while typing
+statisticsInterval = 1000
+
+# Font of the script in the editor. Pages are always laid out and printed in
+# 12pt Courier (see writerPages), the script files don't keep the font
+editorFont = "Courier"
+editorFontSize = 12
+# Folder with the toolbar icons ("" for the icons folder next to writer.py)
+iconFolder = ""
+
+# Most memory (in MB) the print preview keeps rendered pages in, pages that
+# haven't changed aren't rendered again when the preview is reopened
+previewCacheMemory = 64
+
 # Change the default author of scripts
 defaultAuthor = "Josh Davis"
 
@@ -13,6 +54,10 @@ startWithDefaultCharacters = False
 # Change the default characters in your scripts
 defaultCharacters = ["ALEX", "CHARLIE", "FRANKIE", "JESSIE"]
 
+# Optional cast database for name completion: a text file with one name per
+# line, e.g. shared by all the episodes of a project ("" for none)
+castDatabase = ""
+
 # Alternative (and customizable) shortcuts for formatting
 ## Refer to https://doc.qt.io/qtforpython-5/PySide2/QtCore/Qt.html
 actionFormat = Qt.ALT + Qt.Key_1